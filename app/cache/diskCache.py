@@ -0,0 +1,311 @@
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import ClassVar, Iterator
+
+from app.cache.tileStore import TileStore, tile_digest
+from app.wmts.tileMatrix import TileRange
+from app.wmts.utils import TileKey
+
+logger = logging.getLogger(__name__)
+
+WMTS_VERSION = "1.0.0"
+BLOBS_FOLDER = "blobs"
+
+
+class DiskTileCache(TileStore):
+    """
+    Filesystem tile cache in the tilecloud-chain layout, so it can share the tree of caches.local:
+    {folder}/1.0.0/{layer}/{style}/{dimension}/{matrix_set}/{zoom}/{row}/{col}.{extension}
+    With link_blobs, the content is stored once per distinct tile in {folder}/blobs/{sha1[:2]}/{sha1}.{extension},
+    the tile paths are hard links to it: the thousands of identical empty or uniform tiles share one inode.
+    Only for a tree this cache owns: tilecloud-chain rewrites its tiles in place, writing one of them would
+    overwrite the blob and all the tiles linked to it. On filesystems without hard links the tiles are plain copies.
+    Tiles are written to a temporary file in the target directory and renamed over the final path,
+    a reader (another worker, tilecloud-chain, the web server) never sees a partially written png.
+    With max_bytes > 0 the cache keeps an index of the tiles and their size and evicts the least
+    recently used ones above the budget, max_bytes = 0 means unbounded and no index at all.
+    A budget is only for a tree this cache owns too: the evicted tiles are deleted, whoever wrote them.
+    """
+    stores_files: ClassVar[bool] = True
+
+    def __init__(self, folder: str, max_bytes: int = 0, style: str = "default", extension: str = "png",
+                 link_blobs: bool = False):
+        self.folder = os.path.abspath(folder)
+        self.max_bytes = max_bytes
+        self.link_blobs = link_blobs
+        self.style = style
+        self.extension = extension
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.linked = 0
+        self.evictions = 0
+        self.size_bytes = 0
+        self._lock = threading.Lock()
+        # TileKey -> (inode, size in bytes), oldest use first, only maintained when the cache is bounded
+        self._index: OrderedDict[TileKey, tuple[int, int]] = OrderedDict()
+        # inode -> number of indexed tiles sharing it, the budget counts every inode once
+        self._inode_refs: dict[int, int] = {}
+
+    def get_path(self, key: TileKey) -> str:
+        return os.path.join(self.folder, WMTS_VERSION, key.layer, self.style, key.dimension, key.matrix_set,
+                            str(key.zoom), str(key.row), f"{key.col}.{self.extension}")
+
+    def get_blob_path(self, digest: str) -> str:
+        return os.path.join(self.folder, BLOBS_FOLDER, digest[:2], f"{digest}.{self.extension}")
+
+    def get_file(self, key: TileKey) -> str | None:
+        """
+        Get the path of a cached tile, to be sent as is by a FileResponse.
+        return: the path, or None on a miss.
+        """
+        path = self.get_path(key)
+        # called from the event loop, it never waits for the lock: while a writer holds it, the file answers
+        # and the tile is not moved to the end of the LRU
+        if self.max_bytes > 0 and self._lock.acquire(blocking=False):
+            try:
+                found = key in self._index
+                if found:
+                    self._index.move_to_end(key)
+            finally:
+                self._lock.release()
+            # the index is still loading or the file was added by another process
+            found = found or os.path.isfile(path)
+        else:
+            found = os.path.isfile(path)
+        if found:
+            self.hits += 1
+            return path
+        self.misses += 1
+        return None
+
+    def get(self, key: TileKey) -> bytes | None:
+        path = self.get_file(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            # evicted between the lookup and the read
+            return None
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _link_atomic(self, blob_path: str, path: str) -> bool:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            os.link(blob_path, tmp_path)
+        except OSError:
+            # no hard links on this filesystem, too many links, or the blob was just evicted
+            return False
+        os.replace(tmp_path, path)
+        return True
+
+    def put(self, key: TileKey, data: bytes, digest: str | None = None):
+        path = self.get_path(key)
+        if self.link_blobs:
+            blob_path = self.get_blob_path(digest or tile_digest(data))
+            if not os.path.exists(blob_path):
+                self._write_atomic(blob_path, data)
+        if self.link_blobs and self._link_atomic(blob_path, path):
+            self.linked += 1
+        else:
+            self._write_atomic(path, data)
+        self.writes += 1
+        if self.max_bytes > 0:
+            inode = os.stat(path).st_ino
+            with self._lock:
+                self._unref(self._index.pop(key, None))
+                self._index[key] = (inode, len(data))
+                self._ref(inode, len(data))
+                victims = self._evict()
+            self._remove_evicted(victims)
+
+    def _ref(self, inode: int, size: int):
+        refs = self._inode_refs.get(inode, 0)
+        if refs == 0:
+            self.size_bytes += size
+        self._inode_refs[inode] = refs + 1
+
+    def _unref(self, entry: tuple[int, int] | None):
+        if entry is None:
+            return
+        inode, size = entry
+        refs = self._inode_refs[inode] - 1
+        if refs == 0:
+            del self._inode_refs[inode]
+            self.size_bytes -= size
+        else:
+            self._inode_refs[inode] = refs
+
+    def _remove(self, path: str) -> bool:
+        """
+        Unlink a tile, and with link_blobs its blob when no other tile links to it anymore.
+        """
+        try:
+            if not self.link_blobs:
+                os.unlink(path)
+                return True
+            st = os.stat(path)
+            if st.st_nlink == 2:
+                with open(path, "rb") as f:
+                    blob_path = self.get_blob_path(tile_digest(f.read()))
+                if os.stat(blob_path).st_ino == st.st_ino:
+                    os.unlink(blob_path)
+            os.unlink(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def delete(self, key: TileKey) -> bool:
+        with self._lock:
+            self._unref(self._index.pop(key, None))
+        return self._remove(self.get_path(key))
+
+    def _evict(self) -> list[tuple[TileKey, int]]:
+        # called with the lock held, the files of the (key, inode) returned are removed by _remove_evicted
+        # once it is released
+        victims = []
+        while self.size_bytes > self.max_bytes and self._index:
+            key, entry = self._index.popitem(last=False)
+            self._unref(entry)
+            self.evictions += 1
+            victims.append((key, entry[0]))
+        return victims
+
+    def _remove_evicted(self, victims: list[tuple[TileKey, int]]):
+        for key, inode in victims:
+            path = self.get_path(key)
+            with self._lock:
+                written_again = key in self._index
+            try:
+                if written_again or os.stat(path).st_ino != inode:
+                    continue
+            except FileNotFoundError:
+                continue
+            self._remove(path)
+
+    def _parse_path(self, path: str) -> TileKey | None:
+        parts = os.path.relpath(path, self.folder).split(os.sep)
+        if len(parts) != 8 or parts[0] != WMTS_VERSION or parts[2] != self.style:
+            return None
+        col, extension = os.path.splitext(parts[7])
+        if extension != f".{self.extension}" or not (parts[5].isdigit() and parts[6].isdigit() and col.isdigit()):
+            return None
+        return TileKey(parts[1], parts[3], parts[4], int(parts[5]), int(col), int(parts[6]))
+
+    def iter_tiles(self) -> Iterator[tuple[TileKey, str]]:
+        """
+        Walk the tiles on disk, the other files of the tree are skipped.
+        return: generator of (key, path)
+        """
+        for directory, _, files in os.walk(os.path.join(self.folder, WMTS_VERSION)):
+            for name in files:
+                path = os.path.join(directory, name)
+                key = self._parse_path(path)
+                if key is not None:
+                    yield key, path
+
+    def iter_keys(self) -> Iterator[TileKey]:
+        return (key for key, _ in self.iter_tiles())
+
+    def iter_keys_in_range(self, layer: str, dimension: str, matrix_set: str,
+                           tile_range: TileRange) -> Iterator[TileKey]:
+        # only the row folders of the range are listed
+        folder = os.path.join(self.folder, WMTS_VERSION, layer, self.style, dimension, matrix_set, str(tile_range.zoom))
+        try:
+            rows = os.listdir(folder)
+        except FileNotFoundError:
+            return
+        for row in rows:
+            if not (row.isdigit() and tile_range.min_row <= int(row) <= tile_range.max_row):
+                continue
+            try:
+                names = os.listdir(os.path.join(folder, row))
+            except FileNotFoundError:
+                continue
+            for name in names:
+                col, extension = os.path.splitext(name)
+                if (extension == f".{self.extension}" and col.isdigit()
+                        and tile_range.min_col <= int(col) <= tile_range.max_col):
+                    yield TileKey(layer, dimension, matrix_set, tile_range.zoom, int(col), int(row))
+
+    def remove_orphan_blobs(self) -> int:
+        """
+        Remove the blobs no tile links to anymore, e.g. after a crash or tiles deleted by another tool.
+        return: the number of blobs removed
+        """
+        removed = 0
+        for directory, _, files in os.walk(os.path.join(self.folder, BLOBS_FOLDER)):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    if os.stat(path).st_nlink == 1:
+                        os.unlink(path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def load_index(self):
+        """
+        Scan the tiles already on disk into the index, least recently accessed first,
+        then evict down to the budget, and remove the orphan blobs. Blocking, run it in a thread at startup.
+        """
+        if self.max_bytes <= 0:
+            removed = self.remove_orphan_blobs() if self.link_blobs else 0
+            logger.info(f"disk cache {self.folder}: unbounded, {removed} orphan blobs removed")
+            return
+        found = []
+        for key, path in self.iter_tiles():
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            found.append((st.st_atime, key, st.st_ino, st.st_size))
+        found.sort()
+        with self._lock:
+            # tiles written while scanning are already in the index and are the most recent ones
+            for _, key, inode, size in reversed(found):
+                if key not in self._index:
+                    self._index[key] = (inode, size)
+                    self._index.move_to_end(key, last=False)
+                    self._ref(inode, size)
+            victims = self._evict()
+        self._remove_evicted(victims)
+        removed = self.remove_orphan_blobs() if self.link_blobs else 0
+        logger.info(f"disk cache {self.folder}: {len(found)} tiles, {len(self._inode_refs)} distinct, "
+                    f"{self.size_bytes} bytes indexed, {removed} orphan blobs removed")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "folder": self.folder,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "writes": self.writes,
+            "linked": self.linked,
+            "evictions": self.evictions,
+            "max_bytes": self.max_bytes,
+            "size_bytes": self.size_bytes if self.max_bytes > 0 else None,
+            "tiles": len(self._index) if self.max_bytes > 0 else None,
+            "distinct_tiles": len(self._inode_refs) if self.max_bytes > 0 else None,
+        }
@@ -0,0 +1,352 @@
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+from collections import Counter
+from typing import Iterable, Iterator
+
+from app.cache.diskCache import DiskTileCache
+from app.cache.tileStore import TileStore, iter_digests, tile_digest
+from app.wmts.tileMatrix import TileRange
+from app.wmts.utils import TileKey
+
+logger = logging.getLogger(__name__)
+
+# the deduplicated MBTiles schema of a vintage: its map points each tile to an image of the layer by sha1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS map (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_id TEXT);
+CREATE UNIQUE INDEX IF NOT EXISTS map_index ON map (zoom_level, tile_column, tile_row);
+"""
+# the images of all the vintages of a layer, attached as shared, refs counts the map rows of all of them
+IMAGES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shared.images (tile_id TEXT PRIMARY KEY, tile_data BLOB, refs INTEGER NOT NULL);
+"""
+IMAGES_FILE = "images.db"
+
+
+def release_images(conn: sqlite3.Connection, released: Counter[str]):
+    """
+    Drop references to images of the layer, an image goes with its last reference.
+    param conn: a connection with the images database attached as shared, in a transaction
+    param released: the number of references to drop by tile_id
+    """
+    conn.executemany("UPDATE shared.images SET refs = refs - ? WHERE tile_id = ?",
+                     [(count, digest) for digest, count in released.items()])
+    conn.executemany("DELETE FROM shared.images WHERE tile_id = ? AND refs <= 0", [(d,) for d in released])
+
+
+class _MBTilesFile:
+    """
+    One MBTiles file: a writer connection buffering the writes, and one reader connection per thread.
+    The images database of the layer is attached to all of them.
+    """
+
+    def __init__(self, path: str, images_path: str, key: TileKey, extension: str, mmap_size: int):
+        self.path = path
+        self.images_path = images_path
+        self.mmap_size = mmap_size
+        self.lock = threading.Lock()
+        # (zoom, col, row) -> (digest, tile bytes)
+        self.pending: dict[tuple[int, int, int], tuple[str, bytes]] = {}
+        self._readers = threading.local()
+        # all the reader connections, closed with the file whatever thread opened them
+        self._reader_connections: list[sqlite3.Connection] = []
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.writer = self._connect()
+        self.writer.executescript(SCHEMA + IMAGES_SCHEMA)
+        with self.writer:
+            self.writer.executemany("INSERT OR IGNORE INTO metadata (name, value) VALUES (?, ?)", [
+                ("name", key.layer), ("format", extension), ("dimension", key.dimension),
+                ("matrix_set", key.matrix_set),
+                # rows are the WMTS TileRow of the grid, counted from the top, not the TMS rows of web mercator
+                ("scheme", "wmts"),
+                # the tile_data of the map, by tile_id, relative to this file
+                ("images", os.path.relpath(images_path, os.path.dirname(path))),
+            ])
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout=10000")
+        conn.execute("ATTACH DATABASE ? AS shared", (self.images_path,))
+        for schema in ("main", "shared"):
+            conn.execute(f"PRAGMA {schema}.journal_mode=WAL")
+            conn.execute(f"PRAGMA {schema}.synchronous=NORMAL")
+            conn.execute(f"PRAGMA {schema}.mmap_size={int(self.mmap_size)}")
+        return conn
+
+    def reader(self) -> sqlite3.Connection:
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            conn.execute("PRAGMA query_only=ON")
+            self._readers.conn = conn
+            with self.lock:
+                self._reader_connections.append(conn)
+        return conn
+
+    def close(self):
+        """
+        Commit the buffered tiles and close all the connections, called with the lock held.
+        """
+        self.flush()
+        self.writer.close()
+        for conn in self._reader_connections:
+            conn.close()
+        self._reader_connections.clear()
+
+    def flush(self):
+        """
+        Commit the buffered tiles, called with the lock held: all of them go in a single transaction.
+        """
+        if not self.pending:
+            return
+        conn = self.writer
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # the new references of the images, and the ones of the rewritten tiles to release
+            added: Counter[str] = Counter()
+            released: Counter[str] = Counter()
+            images = {}
+            unchanged = {}
+            rows = []
+            for (zoom, col, row), (digest, data) in self.pending.items():
+                previous = conn.execute("SELECT tile_id FROM map WHERE zoom_level = ? AND tile_column = ? "
+                                        "AND tile_row = ?", (zoom, col, row)).fetchone()
+                if previous is not None and previous[0] == digest:
+                    unchanged[digest] = data
+                    continue
+                if previous is not None:
+                    released[previous[0]] += 1
+                added[digest] += 1
+                images[digest] = data
+                rows.append((zoom, col, row, digest))
+            conn.executemany("INSERT OR REPLACE INTO map (zoom_level, tile_column, tile_row, tile_id) "
+                             "VALUES (?, ?, ?, ?)", rows)
+            conn.executemany("INSERT INTO shared.images (tile_id, tile_data, refs) VALUES (?, ?, ?) "
+                             "ON CONFLICT (tile_id) DO UPDATE SET refs = refs + excluded.refs",
+                             [(digest, images[digest], count) for digest, count in added.items()])
+            # an image lost by a crash between the commits of the two databases is written again
+            conn.executemany("INSERT OR IGNORE INTO shared.images (tile_id, tile_data, refs) VALUES (?, ?, 1)",
+                             unchanged.items())
+            release_images(conn, released)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self.pending.clear()
+
+
+class MBTilesStore(TileStore):
+    """
+    Tile store keeping the tiles of a layer, dimension and grid in a single SQLite file in MBTiles form:
+    {folder}/{layer}/{dimension}/{matrix_set}.mbtiles
+    It replaces millions of small files by a few big ones, which is much kinder to inodes, rsync and backups.
+    Identical tiles are stored once per layer: the map table of a file points each (zoom, col, row) to its image
+    by sha1, and the images of all the files of a layer, so of all its vintages (its DATE values), are in
+    {folder}/{layer}/images.db, attached to the connections, with the number of tiles using each of them.
+    An image goes with the last tile using it in any vintage.
+    The files are MBTiles without the tiles table, the images metadata names the images database.
+    A commit spans the two databases and is not atomic across them in WAL mode: a crash in between can only
+    leave an unused image behind, or lose an image that the next write of one of its tiles stores again.
+    Writes are buffered and committed batch_size tiles per transaction, the buffered tiles are readable meanwhile.
+    The database is in WAL mode, so reads never wait for a write, and memory mapped up to mmap_size bytes.
+    The format of the metadata is the extension of the layer, from extensions by layer name, png by default.
+    """
+
+    def __init__(self, folder: str, batch_size: int = 256, mmap_size: int = 256 * 1024 * 1024,
+                 extensions: dict[str, str] | None = None):
+        self.folder = os.path.abspath(folder)
+        self.extensions = extensions or {}
+        self.batch_size = batch_size
+        self.mmap_size = mmap_size
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+        self._files: dict[tuple[str, str, str], _MBTilesFile] = {}
+
+    def get_path(self, key: TileKey) -> str:
+        return os.path.join(self.folder, key.layer, key.dimension, f"{key.matrix_set}.mbtiles")
+
+    def _get_file(self, key: TileKey, create: bool) -> _MBTilesFile | None:
+        file_key = (key.layer, key.dimension, key.matrix_set)
+        mbtiles = self._files.get(file_key)
+        if mbtiles is None:
+            with self._lock:
+                mbtiles = self._files.get(file_key)
+                if mbtiles is None:
+                    path = self.get_path(key)
+                    if not create and not os.path.exists(path):
+                        return None
+                    mbtiles = self._files[file_key] = _MBTilesFile(
+                        path, os.path.join(self.folder, key.layer, IMAGES_FILE), key,
+                        self.extensions.get(key.layer, "png"), self.mmap_size)
+        return mbtiles
+
+    def get(self, key: TileKey) -> bytes | None:
+        mbtiles = self._get_file(key, create=False)
+        data = None
+        if mbtiles is not None:
+            pending = mbtiles.pending.get((key.zoom, key.col, key.row))
+            if pending is not None:
+                data = pending[1]
+            else:
+                row = mbtiles.reader().execute(
+                    "SELECT images.tile_data FROM map JOIN shared.images ON images.tile_id = map.tile_id "
+                    "WHERE map.zoom_level = ? AND map.tile_column = ? AND map.tile_row = ?",
+                    (key.zoom, key.col, key.row)).fetchone()
+                data = row[0] if row is not None else None
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key: TileKey, data: bytes, digest: str | None = None):
+        mbtiles = self._get_file(key, create=True)
+        with mbtiles.lock:
+            mbtiles.pending[(key.zoom, key.col, key.row)] = (digest or tile_digest(data), data)
+            if len(mbtiles.pending) >= self.batch_size:
+                mbtiles.flush()
+        self.writes += 1
+
+    def put_many(self, items: dict[TileKey, bytes], flush: bool = True):
+        """
+        Buffer tiles, then commit the buffers holding batch_size tiles or more, or all of them with flush.
+        """
+        touched = set()
+        for key, data, digest in iter_digests(items):
+            mbtiles = self._get_file(key, create=True)
+            with mbtiles.lock:
+                mbtiles.pending[(key.zoom, key.col, key.row)] = (digest, data)
+            touched.add(mbtiles)
+        for mbtiles in touched:
+            with mbtiles.lock:
+                if flush or len(mbtiles.pending) >= self.batch_size:
+                    mbtiles.flush()
+        self.writes += len(items)
+
+    def delete(self, key: TileKey) -> bool:
+        return self.delete_many([key]) > 0
+
+    def delete_many(self, keys: Iterable[TileKey]) -> int:
+        """
+        Delete tiles with one transaction per MBTiles file. An image goes with the last tile of the layer using it.
+        return: the number of tiles that were in the store.
+        """
+        by_file: dict[_MBTilesFile, list[tuple[int, int, int]]] = {}
+        for key in keys:
+            mbtiles = self._get_file(key, create=False)
+            if mbtiles is not None:
+                by_file.setdefault(mbtiles, []).append((key.zoom, key.col, key.row))
+        deleted = 0
+        for mbtiles, tiles in by_file.items():
+            with mbtiles.lock:
+                buffered = {tile for tile in tiles if mbtiles.pending.pop(tile, None) is not None}
+                conn = mbtiles.writer
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    released: Counter[str] = Counter()
+                    for tile in tiles:
+                        row = conn.execute("DELETE FROM map WHERE zoom_level = ? AND tile_column = ? "
+                                           "AND tile_row = ? RETURNING tile_id", tile).fetchone()
+                        if row is not None:
+                            released[row[0]] += 1
+                        deleted += row is not None or tile in buffered
+                    release_images(conn, released)
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+        return deleted
+
+    def iter_keys(self) -> Iterator[TileKey]:
+        for directory, _, files in os.walk(self.folder):
+            for name in files:
+                if not name.endswith(".mbtiles"):
+                    continue
+                parts = os.path.relpath(os.path.join(directory, name), self.folder).split(os.sep)
+                if len(parts) != 3:
+                    continue
+                layer, dimension, matrix_set = parts[0], parts[1], parts[2].removesuffix(".mbtiles")
+                mbtiles = self._get_file(TileKey(layer, dimension, matrix_set, 0, 0, 0), create=False)
+                if mbtiles is None:
+                    # removed meanwhile
+                    continue
+                with mbtiles.lock:
+                    mbtiles.flush()
+                for zoom, col, row in mbtiles.reader().execute(
+                        "SELECT zoom_level, tile_column, tile_row FROM map"):
+                    yield TileKey(layer, dimension, matrix_set, zoom, col, row)
+
+    def iter_keys_in_range(self, layer: str, dimension: str, matrix_set: str,
+                           tile_range: TileRange) -> Iterator[TileKey]:
+        mbtiles = self._get_file(TileKey(layer, dimension, matrix_set, tile_range.zoom, 0, 0), create=False)
+        if mbtiles is None:
+            return
+        with mbtiles.lock:
+            mbtiles.flush()
+        for col, row in mbtiles.reader().execute(
+                "SELECT tile_column, tile_row FROM map WHERE zoom_level = ? AND tile_column BETWEEN ? AND ? "
+                "AND tile_row BETWEEN ? AND ?",
+                (tile_range.zoom, tile_range.min_col, tile_range.max_col, tile_range.min_row, tile_range.max_row)):
+            yield TileKey(layer, dimension, matrix_set, tile_range.zoom, col, row)
+
+    def flush(self):
+        for mbtiles in list(self._files.values()):
+            with mbtiles.lock:
+                mbtiles.flush()
+
+    def close(self):
+        with self._lock:
+            files = list(self._files.values())
+            self._files.clear()
+        for mbtiles in files:
+            with mbtiles.lock:
+                mbtiles.close()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "folder": self.folder,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "writes": self.writes,
+            "files": len(self._files),
+            "pending": sum(len(f.pending) for f in list(self._files.values())),
+        }
+
+
+def convert_directory(disk_cache: DiskTileCache, store: TileStore, batch_size: int = 1000) -> int:
+    """
+    Copy all the tiles of a directory cache into another store, e.g. an MBTilesStore.
+    return: the number of tiles copied
+    """
+    count = 0
+    batch = {}
+    for key, path in disk_cache.iter_tiles():
+        with open(path, "rb") as f:
+            batch[key] = f.read()
+        if len(batch) >= batch_size:
+            store.put_many(batch)
+            count += len(batch)
+            batch = {}
+            logger.info(f"{count} tiles copied")
+    if batch:
+        store.put_many(batch)
+        count += len(batch)
+    store.close()
+    return count
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Convert a tilecloud-chain directory cache to MBTiles files")
+    parser.add_argument("folder", help="folder of the directory cache, e.g. /var/sig/tiles")
+    parser.add_argument("mbtiles_folder", help="folder of the MBTiles files")
+    args = parser.parse_args()
+    copied = convert_directory(DiskTileCache(args.folder), MBTilesStore(args.mbtiles_folder))
+    print(f"{copied} tiles copied from {args.folder} to {args.mbtiles_folder}")
@@ -0,0 +1,96 @@
+from collections import OrderedDict
+from typing import Iterator
+
+from app.cache.tileStore import TileStore, tile_digest
+from app.wmts.utils import TileKey
+
+
+class MemoryTileCache(TileStore):
+    """
+    In-process LRU of encoded tiles bounded by the total size of the tiles, not by their number:
+    a budget in bytes holds many more of the small empty or uniform tiles than of the detailed ones.
+    Identical tiles (empty, lake, forest fill) are interned: all their keys reference a single bytes object,
+    which is counted once in the budget.
+    The tiles are kept as the immutable bytes they were rendered to, a hit is written to the response as is.
+    Not thread-safe, it is only used from the event loop and never blocks.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._tiles: OrderedDict[TileKey, str] = OrderedDict()
+        # digest -> [tile bytes, number of keys referencing it]
+        self._blobs: dict[str, list] = {}
+
+    def get(self, key: TileKey) -> bytes | None:
+        digest = self._tiles.get(key)
+        if digest is None:
+            self.misses += 1
+            return None
+        self._tiles.move_to_end(key)
+        self.hits += 1
+        return self._blobs[digest][0]
+
+    def put(self, key: TileKey, data: bytes, digest: str | None = None):
+        if len(data) > self.max_bytes:
+            return
+        digest = digest or tile_digest(data)
+        if self._tiles.get(key) == digest:
+            self._tiles.move_to_end(key)
+            return
+        self._unref(self._tiles.pop(key, None))
+        blob = self._blobs.get(digest)
+        if blob is None:
+            self._blobs[digest] = [data, 1]
+            self.size_bytes += len(data)
+        else:
+            blob[1] += 1
+        self._tiles[key] = digest
+        while self.size_bytes > self.max_bytes:
+            _, evicted = self._tiles.popitem(last=False)
+            self._unref(evicted)
+            self.evictions += 1
+
+    def _unref(self, digest: str | None):
+        if digest is None:
+            return
+        blob = self._blobs[digest]
+        blob[1] -= 1
+        if blob[1] == 0:
+            del self._blobs[digest]
+            self.size_bytes -= len(blob[0])
+
+    def delete(self, key: TileKey) -> bool:
+        digest = self._tiles.pop(key, None)
+        if digest is None:
+            return False
+        self._unref(digest)
+        return True
+
+    def keys(self) -> list[TileKey]:
+        return list(self._tiles)
+
+    def iter_keys(self) -> Iterator[TileKey]:
+        return iter(self.keys())
+
+    def __contains__(self, key: TileKey) -> bool:
+        return key in self._tiles
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "tiles": len(self._tiles),
+            "blobs": len(self._blobs),
+            "size_bytes": self.size_bytes,
+            "max_bytes": self.max_bytes,
+        }
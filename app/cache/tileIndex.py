@@ -0,0 +1,152 @@
+import threading
+from collections import defaultdict
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from app.wmts.tileMatrix import TileRange
+from app.wmts.utils import TileKey
+
+# (row, col) packed in one int64, sorted by row then col: the tiles of a row are contiguous
+ROW_SHIFT = 32
+COL_MASK = (1 << ROW_SHIFT) - 1
+# changes kept aside before being merged into the sorted array, at least
+MIN_MERGE = 4096
+
+
+class _ZoomTiles:
+    """
+    The tiles present at one zoom level: a sorted array of packed (row, col), 8 bytes per tile.
+    The changes are kept aside in two small sets, looked at by the queries, and merged into the array
+    once they reach 1/64 of it, so a merge costs about 64 copies of 8 bytes per change.
+    """
+    __slots__ = ('packed', 'added', 'removed')
+
+    def __init__(self):
+        self.packed = np.empty(0, dtype=np.int64)
+        self.added: set[int] = set()
+        self.removed: set[int] = set()
+
+    def add(self, value: int):
+        self.removed.discard(value)
+        self.added.add(value)
+        self._merge_if_needed()
+
+    def discard(self, value: int):
+        self.added.discard(value)
+        self.removed.add(value)
+        self._merge_if_needed()
+
+    def _merge_if_needed(self):
+        if len(self.added) + len(self.removed) > max(MIN_MERGE, len(self.packed) >> 6):
+            self.merge()
+
+    def _positions(self, values: set[int]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # sorted values, their position in packed and whether packed holds them there
+        array = np.sort(np.fromiter(values, dtype=np.int64, count=len(values)))
+        positions = np.searchsorted(self.packed, array)
+        present = np.zeros(len(array), dtype=bool)
+        inside = positions < len(self.packed)
+        present[inside] = self.packed[positions[inside]] == array[inside]
+        return array, positions, present
+
+    def __contains__(self, value: int) -> bool:
+        if value in self.added:
+            return True
+        if value in self.removed:
+            return False
+        position = int(np.searchsorted(self.packed, value))
+        return position < len(self.packed) and int(self.packed[position]) == value
+
+    def merge(self):
+        if self.added:
+            array, positions, present = self._positions(self.added)
+            self.packed = np.insert(self.packed, positions[~present], array[~present])
+            self.added.clear()
+        if self.removed:
+            _, positions, present = self._positions(self.removed)
+            self.packed = np.delete(self.packed, positions[present])
+            self.removed.clear()
+
+    def query(self, tile_range: TileRange) -> np.ndarray:
+        """
+        return: the sorted packed values of the tiles inside the range.
+        """
+        packed = self.packed
+        rows = np.arange(tile_range.min_row, tile_range.max_row + 1, dtype=np.int64) << ROW_SHIFT
+        starts = np.searchsorted(packed, rows | tile_range.min_col, side='left').tolist()
+        ends = np.searchsorted(packed, rows | tile_range.max_col, side='right').tolist()
+        found = [packed[start:end] for start, end in zip(starts, ends) if end > start]
+        found = np.concatenate(found) if found else packed[:0]
+        if self.removed:
+            found = found[~np.isin(found, np.fromiter(self.removed, dtype=np.int64, count=len(self.removed)))]
+        if self.added:
+            added = [value for value in self.added
+                     if tile_range.min_row <= value >> ROW_SHIFT <= tile_range.max_row
+                     and tile_range.min_col <= value & COL_MASK <= tile_range.max_col]
+            if added:
+                found = np.union1d(found, np.array(added, dtype=np.int64))
+        return found
+
+    def __len__(self):
+        # counted without merging: stats must not copy the whole array
+        count = len(self.packed)
+        if self.added:
+            count += int(np.count_nonzero(~self._positions(self.added)[2]))
+        if self.removed:
+            count -= int(np.count_nonzero(self._positions(self.removed)[2]))
+        return count
+
+
+class TileIndex:
+    """
+    Compact in-memory index of the tiles present in the caches, by layer, dimension, grid and zoom level,
+    answering "which cached tiles intersect this range" without touching the disk:
+    a binary search per row of the range, in a sorted array of 8 bytes per tile.
+    Thread-safe, the tile stores write from worker threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._zooms: dict[tuple[str, str, str, int], _ZoomTiles] = defaultdict(_ZoomTiles)
+
+    def add(self, key: TileKey):
+        with self._lock:
+            self._zooms[(key.layer, key.dimension, key.matrix_set, key.zoom)].add((key.row << ROW_SHIFT) | key.col)
+
+    def add_many(self, keys: Iterable[TileKey]):
+        for key in keys:
+            self.add(key)
+
+    def discard(self, key: TileKey):
+        with self._lock:
+            tiles = self._zooms.get((key.layer, key.dimension, key.matrix_set, key.zoom))
+            if tiles is not None:
+                tiles.discard((key.row << ROW_SHIFT) | key.col)
+
+    def __contains__(self, key: TileKey) -> bool:
+        with self._lock:
+            tiles = self._zooms.get((key.layer, key.dimension, key.matrix_set, key.zoom))
+            return tiles is not None and ((key.row << ROW_SHIFT) | key.col) in tiles
+
+    def query(self, layer: str, dimension: str, matrix_set: str, tile_range: TileRange) -> Iterator[TileKey]:
+        """
+        Iterate over the indexed tiles of a layer inside a range.
+        """
+        with self._lock:
+            tiles = self._zooms.get((layer, dimension, matrix_set, tile_range.zoom))
+            if tiles is None:
+                return
+            found = tiles.query(tile_range)
+        for value in found.tolist():
+            yield TileKey(layer, dimension, matrix_set, tile_range.zoom, value & COL_MASK,
+                          value >> ROW_SHIFT)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(tiles) for tiles in self._zooms.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            count = sum(len(tiles) for tiles in self._zooms.values())
+            return {"tiles": count, "zoom_levels": len(self._zooms), "size_bytes": count * 8}
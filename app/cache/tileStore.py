@@ -0,0 +1,108 @@
+import hashlib
+from abc import ABC, abstractmethod
+from typing import ClassVar, Iterable, Iterator, NamedTuple
+
+from app.wmts.tileMatrix import TileRange
+from app.wmts.utils import TileKey
+
+
+def tile_digest(data: bytes) -> str:
+    """
+    Content address of an encoded tile, the sha1 also used by tilecloud-chain for empty tile detection.
+    """
+    return hashlib.sha1(data).hexdigest()
+
+
+def iter_digests(items: dict[TileKey, bytes]):
+    """
+    Iterate over (key, data, digest), hashing only once the bytes shared by several keys,
+    like the tiles of a uniform metatile.
+    """
+    digests = {}
+    for key, data in items.items():
+        digest = digests.get(id(data))
+        if digest is None:
+            digest = digests[id(data)] = tile_digest(data)
+        yield key, data, digest
+
+
+class TileSignature(NamedTuple):
+    """
+    size and hash of a known tile, like the empty_tile_detection of the tilecloud-chain layers.
+    """
+    size: int
+    hash: str
+
+    def matches(self, data: bytes) -> bool:
+        # comparing the size first avoids hashing almost every tile
+        return len(data) == self.size and tile_digest(data) == self.hash
+
+
+class TileStore(ABC):
+    """
+    Storage of encoded tiles by TileKey, the cache tiers of the tile service implement it.
+    The methods are blocking, async callers run them with asyncio.to_thread when they may touch the disk.
+    """
+    # True when every tile is a file that get_file can return
+    stores_files: ClassVar[bool] = False
+
+    @abstractmethod
+    def get(self, key: TileKey) -> bytes | None:
+        """
+        return: the tile bytes, or None on a miss.
+        """
+
+    @abstractmethod
+    def put(self, key: TileKey, data: bytes, digest: str | None = None):
+        """
+        param: digest: tile_digest(data) when the caller already computed it.
+        """
+
+    def get_file(self, key: TileKey) -> str | None:
+        """
+        Get the path of a tile stored in its own file, to be sent as is.
+        return: the path, or None on a miss and for the stores not keeping one file per tile.
+        """
+        return None
+
+    def put_many(self, items: dict[TileKey, bytes]):
+        for key, data, digest in iter_digests(items):
+            self.put(key, data, digest)
+
+    def close(self):
+        """
+        Flush and release what the store holds open.
+        """
+
+    @abstractmethod
+    def delete(self, key: TileKey) -> bool:
+        """
+        return: True if the tile was in the store.
+        """
+
+    def delete_many(self, keys: Iterable[TileKey]) -> int:
+        """
+        return: the number of tiles that were in the store.
+        """
+        return sum(self.delete(key) for key in keys)
+
+    def iter_keys(self) -> Iterator[TileKey]:
+        """
+        Iterate over the keys of all the stored tiles, e.g. to index them at startup. Slow, it reads the whole store.
+        """
+        return iter(())
+
+    def iter_keys_in_range(self, layer: str, dimension: str, matrix_set: str,
+                           tile_range: TileRange) -> Iterator[TileKey]:
+        """
+        Iterate over the keys of the stored tiles of a layer inside a range, read from the store itself:
+        the tiles written by other processes (seeding, the other workers) are found too.
+        """
+        return (key for key in self.iter_keys()
+                if key.layer == layer and key.dimension == dimension and key.matrix_set == matrix_set
+                and key.zoom == tile_range.zoom and tile_range.min_col <= key.col <= tile_range.max_col
+                and tile_range.min_row <= key.row <= tile_range.max_row)
+
+    @abstractmethod
+    def stats(self) -> dict:
+        pass
@@ -0,0 +1,24 @@
+from app.cache.diskCache import DiskTileCache
+from app.cache.mbtilesStore import MBTilesStore
+from app.cache.tileStore import TileStore
+
+TILE_STORE_TYPES = ("directory", "directory-linked", "mbtiles")
+
+
+def open_tile_store(store_type: str, folder: str, max_bytes: int = 0,
+                    extensions: dict[str, str] | None = None) -> TileStore:
+    """
+    Open a tile store by type, shared by the service and the seeding command.
+    param: store_type: 'directory' for the tilecloud-chain layout, 'directory-linked' for the same layout with
+           the identical tiles hard-linked to one blob (not in a tree shared with tilecloud-chain) or 'mbtiles'
+    param: max_bytes: budget of the directory cache, 0 for unbounded
+    param: extensions: the extension of the tiles by layer name, the format of the MBTiles files
+    raise: ValueError if the type is unknown.
+    """
+    if store_type == "directory":
+        return DiskTileCache(folder, max_bytes)
+    if store_type == "directory-linked":
+        return DiskTileCache(folder, max_bytes, link_blobs=True)
+    if store_type == "mbtiles":
+        return MBTilesStore(folder, extensions=extensions)
+    raise ValueError(f"Unknown tile store {store_type}, please choose one of {', '.join(TILE_STORE_TYPES)}.")
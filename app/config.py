@@ -0,0 +1,94 @@
+import logging
+import os
+from functools import lru_cache
+from pathlib import Path
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TILECLOUD_CONFIG = Path(__file__).resolve().parent.parent / "data" / "tilecloud-chain_config.yaml"
+
+
+def get_tilecloud_config_path() -> Path:
+    """
+    Get the path of the tilecloud-chain configuration file.
+    return: value of the TILECLOUD_CONFIG environment variable, or the file shipped in data/
+    """
+    return Path(os.getenv("TILECLOUD_CONFIG", DEFAULT_TILECLOUD_CONFIG))
+
+
+def _expand_env_vars(value):
+    # tilecloud-chain configs use ${VAR} placeholders, unknown variables are left untouched
+    if isinstance(value, str):
+        return os.path.expandvars(value)
+    if isinstance(value, dict):
+        return {k: _expand_env_vars(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_expand_env_vars(v) for v in value]
+    return value
+
+
+def read_tilecloud_config(path: str | Path | None = None) -> dict:
+    """
+    Read a tilecloud-chain YAML configuration, the << merge keys of the defaults are resolved by the loader.
+    Unlike load_tilecloud_config the file is read again on every call.
+    param: path: path of the YAML file, defaults to get_tilecloud_config_path()
+    return: the configuration as a dict
+    """
+    path = Path(path) if path is not None else get_tilecloud_config_path()
+    logger.debug(f"loading tilecloud-chain config {path}")
+    with open(path, encoding="utf-8") as f:
+        return _expand_env_vars(yaml.safe_load(f)) or {}
+
+
+def get_expanded_value(value) -> str | None:
+    """
+    return: the value as a string, or None if it is empty or still holds the ${VAR} placeholder of a variable
+    missing from the environment.
+    """
+    value = str(value) if value is not None else None
+    return value if value and "${" not in value else None
+
+
+@lru_cache(maxsize=4)
+def load_tilecloud_config(path: str | Path | None = None) -> dict:
+    """
+    Load a tilecloud-chain YAML configuration with read_tilecloud_config.
+    The result is cached, it must be considered read-only.
+    """
+    return read_tilecloud_config(path)
+
+
+def get_cache_folder(config: dict, cache_name: str | None = None) -> str | None:
+    """
+    Get the folder of a filesystem cache of a tilecloud-chain configuration.
+    param: cache_name: name of the cache in caches:, defaults to generation.default_cache
+    return: the folder, or None if the cache is not a filesystem cache
+    """
+    cache_name = cache_name or config.get("generation", {}).get("default_cache", "default")
+    cache = config.get("caches", {}).get(cache_name, {})
+    if cache.get("type", "filesystem") != "filesystem":
+        return None
+    return cache.get("folder")
+
+
+def get_cache_http_url(config: dict, cache_name: str | None = None) -> str | None:
+    """
+    Get the url a cache of a tilecloud-chain configuration is published under, the one of its GetCapabilities.
+    param: cache_name: name of the cache in caches:, defaults to generation.default_cache
+    return: the http_url of the cache, or None if it is not set or refers to a missing variable
+    """
+    cache_name = cache_name or config.get("generation", {}).get("default_cache", "default")
+    return get_expanded_value(config.get("caches", {}).get(cache_name, {}).get("http_url"))
+
+
+def get_layer_config(config: dict, layer: str) -> dict:
+    """
+    Get a layer of a tilecloud-chain configuration, with the defaults merged in.
+    raise: ValueError if the layer is not in the configuration.
+    """
+    layers = config.get("layers") or {}
+    if layer not in layers:
+        raise ValueError(f"Unknown layer {layer}. Please choose one of {', '.join(sorted(layers))}.")
+    return layers[layer] or {}
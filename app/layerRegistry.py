@@ -0,0 +1,166 @@
+import logging
+import os
+from typing import Iterator, NamedTuple
+
+from app.cache.tileStore import TileSignature
+from app.config import get_expanded_value
+from app.wms.metaTile import get_meta_settings
+from app.wms.wms import GetMapTemplate
+from app.wmts.tileCoverage import TileCoverage, load_geojson_polygons
+from app.wmts.tileMatrixSet import get_tile_matrix_set
+
+logger = logging.getLogger(__name__)
+
+
+class Layer(NamedTuple):
+    """
+    A layer of the tilecloud-chain configuration, with everything a tile request needs resolved once.
+    get_map is None when neither the url of the layer nor WMS_BACKEND is set, it renders the default value
+    of the dimension, get_maps holds the GetMap of each value served (dimension_values, the default included).
+    A layer without dimension is served for the single value 'default'.
+    coverage holds the tiles of the grid the layer has data for.
+    meta_size and meta_buffer are its metatiles, a meta_size of 1 for the layers rendered tile by tile.
+    """
+    name: str
+    title: str
+    grid: str
+    wms_layers: str
+    get_map: GetMapTemplate | None
+    extension: str
+    mime_type: str
+    bbox: tuple[float, float, float, float] | None
+    dimension_name: str | None
+    dimension_default: str
+    dimension_values: tuple[str, ...]
+    get_maps: dict[str, GetMapTemplate]
+    empty_tile: TileSignature | None
+    empty_metatile: TileSignature | None
+    coverage: TileCoverage
+    meta_size: int
+    meta_buffer: int
+
+    def check_dimension(self, value: str | None) -> str:
+        """
+        param: value: a value of the dimension, None for the default one.
+        return: the value.
+        raise: ValueError if the layer is not served for this value.
+        """
+        if value is None:
+            return self.dimension_default
+        if value not in self.dimension_values:
+            raise ValueError(f"Layer {self.name} is not served for {self.dimension_name or 'dimension'} {value}. "
+                             f"Please choose one of {', '.join(self.dimension_values)}.")
+        return value
+
+    def check_get_map(self, dimension: str | None = None) -> GetMapTemplate:
+        """
+        param: dimension: a value checked by check_dimension, None for the default one.
+        raise: ValueError if the layer has no WMS backend.
+        """
+        if self.get_map is None:
+            raise ValueError(f"The url of layer {self.name} is not set, please set MAPSERVER_URL or WMS_BACKEND.")
+        return self.get_map if dimension is None else self.get_maps[dimension]
+
+
+def _get_signature(layer_config: dict, detection: str) -> TileSignature | None:
+    signature = layer_config.get(detection)
+    if not signature or "size" not in signature or "hash" not in signature:
+        return None
+    return TileSignature(int(signature["size"]), str(signature["hash"]))
+
+
+def build_layer(name: str, layer_config: dict, wms_backend: str | None = None,
+                coverage_folder: str | None = None) -> Layer:
+    """
+    Build a Layer from its tilecloud-chain configuration, the defaults merged in.
+    param: wms_backend: used when the url of the layer is not set or refers to a missing variable.
+    param: coverage_folder: folder of the {layer}.geojson polygons refining the coverage of the bbox of the layers.
+    raise: ValueError if the grid of the layer is unknown, OSError if its GeoJSON cannot be read.
+    """
+    grid = layer_config.get("grid", "swissgrid_05")
+    tile_matrix_set = get_tile_matrix_set(grid)
+    url = get_expanded_value(layer_config.get("url")) or wms_backend
+    extension = layer_config.get("extension", "png")
+    headers = {k: str(v) for k, v in (layer_config.get("headers") or {}).items() if get_expanded_value(v)}
+    # the tilecloud-chain layers of this service have at most one dimension, DATE
+    dimensions = layer_config.get("dimensions") or []
+    dimension = dimensions[0] if dimensions else {}
+    dimension_name = dimension.get("name")
+    dimension_default = str(dimension.get("default", "default"))
+    dimension_values = tuple(str(v) for v in dimension.get("values", []))
+    if dimension_default not in dimension_values:
+        dimension_values = (dimension_default, *dimension_values)
+    get_maps = {}
+    if url is not None and layer_config.get("layers"):
+        get_maps = {value: GetMapTemplate(url, layer_config["layers"], extension, f"EPSG:{tile_matrix_set.srid}",
+                                          headers, {dimension_name: value} if dimension_name else None)
+                    for value in dimension_values}
+    bbox = layer_config.get("bbox")
+    polygons = None
+    if coverage_folder is not None:
+        path = os.path.join(coverage_folder, f"{name}.geojson")
+        if os.path.exists(path):
+            polygons = load_geojson_polygons(path)
+    meta_size, meta_buffer = get_meta_settings(layer_config)
+    return Layer(
+        name=name,
+        title=layer_config.get("title", name),
+        grid=grid,
+        wms_layers=layer_config.get("layers", ""),
+        get_map=get_maps.get(dimension_default),
+        extension=extension,
+        mime_type=layer_config.get("mime_type", f"image/{extension}"),
+        bbox=tuple(float(v) for v in bbox) if bbox else None,
+        dimension_name=dimension_name,
+        dimension_default=dimension_default,
+        dimension_values=dimension_values,
+        get_maps=get_maps,
+        empty_tile=_get_signature(layer_config, "empty_tile_detection"),
+        empty_metatile=_get_signature(layer_config, "empty_metatile_detection"),
+        coverage=TileCoverage(tile_matrix_set.table, bbox, polygons),
+        meta_size=meta_size,
+        meta_buffer=meta_buffer,
+    )
+
+
+class LayerRegistry:
+    """
+    The layers served, built once at startup from the tilecloud-chain configuration and read-only afterwards.
+    """
+
+    def __init__(self, layers: list[Layer]):
+        self._layers = {layer.name: layer for layer in layers}
+
+    @classmethod
+    def from_config(cls, config: dict, wms_backend: str | None = None,
+                    coverage_folder: str | None = None) -> "LayerRegistry":
+        """
+        Build the registry of the layers section, the layers on an unknown grid are left out.
+        param: wms_backend: url of the WMS server of the layers without url.
+        param: coverage_folder: folder of the {layer}.geojson coverage polygons.
+        """
+        layers = []
+        for name, layer_config in (config.get("layers") or {}).items():
+            try:
+                layers.append(build_layer(name, layer_config or {}, wms_backend, coverage_folder))
+            except (ValueError, OSError) as error:
+                logger.warning(f"layer {name} skipped: {error}")
+        return cls(layers)
+
+    def get(self, name: str) -> Layer:
+        """
+        raise: ValueError if the layer is unknown.
+        """
+        layer = self._layers.get(name)
+        if layer is None:
+            raise ValueError(f"Unknown layer {name}. Please choose one of {', '.join(sorted(self._layers))}.")
+        return layer
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._layers
+
+    def __iter__(self) -> Iterator[Layer]:
+        return iter(self._layers.values())
+
+    def __len__(self):
+        return len(self._layers)
@@ -1,24 +1,133 @@
+import asyncio
 import logging
 import os
+import time
+from contextlib import asynccontextmanager
 from typing import Annotated, Optional
+
+import numpy as np
 from dotenv import load_dotenv
 
-from fastapi import FastAPI, status, HTTPException
-from fastapi.encoders import jsonable_encoder
+from fastapi import FastAPI, Request, status, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, conlist
-from starlette.responses import JSONResponse
+from starlette.responses import FileResponse, JSONResponse, Response
 
-from app.wms.wms import get_wms_params
-from app.wmts.lausanneGrid import LausanneGrid
-from app.wmts.utils import BBox
+from app.cache.diskCache import DiskTileCache
+from app.cache.memoryCache import MemoryTileCache
+from app.cache.tileStore import TileStore
+from app.cache.tileStores import open_tile_store
+from app.layerRegistry import Layer, LayerRegistry
+from app.wms.metaTile import MetaTileRenderer
+from app.tileCompositor import COMPOSITE_FORMATS, TileCompositor
+from app.tilePrefetcher import TilePrefetcher
+from app.tileProcessor import VARIANT_FORMATS, TileProcessor, choose_tile_format
+from app.tileService import TileService
+from app.wms.wms import WmsClient, WmsError, add_gutter
+from app.config import get_cache_folder, get_cache_http_url, load_tilecloud_config
+from app.wmts.capabilities import WmtsCapabilities, choose_encoding
+from app.wmts.swissProjection import wgs84_to_lv95
+from app.wmts.tileCoverage import TileCoverage, get_geojson_polygons, get_transparent_tile
+from app.wmts.tileMatrixSet import (get_canonical_matrix, get_equivalent_zoom, get_tile_matrix_set,
+                                    register_tilecloud_grids)
+from app.wmts.utils import TileKey
 
 APP = "wmtsReader"
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(APP)
 
 load_dotenv()
-app = FastAPI()
+# shared keep-alive client to the WMS backend, opened and closed with the application
+wms_client: WmsClient | None = None
+tile_service: TileService | None = None
+tile_compositor: TileCompositor | None = None
+tile_processor: TileProcessor | None = None
+tile_prefetcher: TilePrefetcher | None = None
+
+
+def get_tile_store() -> TileStore | None:
+    """
+    Open the tile store in TILE_CACHE_DIR, defaulting to the default cache folder of the tilecloud-chain config.
+    TILE_STORE chooses between the tilecloud-chain 'directory' layout, 'directory-linked' (the same layout with
+    the identical tiles hard-linked to one blob, for a tree tilecloud-chain does not write to) and 'mbtiles' files.
+    An empty TILE_CACHE_DIR disables it, like a folder that cannot be written.
+    TILE_CACHE_MAX_BYTES bounds a directory store by evicting its least recently used tiles: not in the cache folder
+    of tilecloud-chain, whose seeded tiles would be deleted.
+    raise: ValueError if TILE_CACHE_MAX_BYTES is set for the cache folder of tilecloud-chain.
+    """
+    folder = os.getenv("TILE_CACHE_DIR", tilecloud_cache_folder or "")
+    if not folder:
+        return None
+    store_type = os.getenv("TILE_STORE", "directory")
+    max_bytes = int(os.getenv("TILE_CACHE_MAX_BYTES", "0"))
+    shared = tilecloud_cache_folder and os.path.realpath(folder) == os.path.realpath(tilecloud_cache_folder)
+    if max_bytes > 0 and store_type != "mbtiles" and shared:
+        raise ValueError(f"TILE_CACHE_MAX_BYTES would evict the tiles seeded by tilecloud-chain in {folder}, "
+                         f"please set TILE_CACHE_DIR to a folder of this service only.")
+    try:
+        os.makedirs(folder, exist_ok=True)
+    except OSError as error:
+        logger.warning(f"tile store disabled: {error}")
+        return None
+    if not os.access(folder, os.W_OK):
+        logger.warning(f"tile store disabled: {folder} is not writable")
+        return None
+    return open_tile_store(store_type, folder, max_bytes,
+                           {layer.name: layer.extension for layer in layer_registry})
+
+
+def load_indexes(tile_store: TileStore, service: TileService):
+    if isinstance(tile_store, DiskTileCache):
+        tile_store.load_index()
+    service.index_store()
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    global wms_client, tile_service, tile_compositor, tile_processor, tile_prefetcher
+    wms_client = WmsClient(max_connections=int(os.getenv("WMS_MAX_CONNECTIONS", "100")))
+    tile_store = get_tile_store()
+    index_loading = None
+    # MEMORY_CACHE_MAX_BYTES=0 disables the in-memory cache of hot tiles
+    memory_cache_max_bytes = int(os.getenv("MEMORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    memory_cache = MemoryTileCache(memory_cache_max_bytes) if memory_cache_max_bytes > 0 else None
+    # TILE_PROCESS_WORKERS=0 disables the png optimization and the WebP/JPEG variants
+    process_workers = int(os.getenv("TILE_PROCESS_WORKERS", "2"))
+    if process_workers > 0:
+        variants = [v for v in os.getenv("TILE_VARIANTS", "webp,jpeg").split(",") if v]
+        tile_processor = TileProcessor(process_workers, variants,
+                                       int(os.getenv("VARIANT_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+                                       int(os.getenv("TILE_VARIANT_QUALITY", "85")))
+    # the layers with meta: true are rendered by metatile, with their meta_size and meta_buffer like the seeding
+    tile_service = TileService(wms_client, MetaTileRenderer(wms_client), tile_store, memory_cache,
+                               {layer.name: layer.empty_tile for layer in layer_registry if layer.empty_tile},
+                               {layer.name: layer.empty_metatile for layer in layer_registry if layer.empty_metatile},
+                               tile_processor,
+                               {layer.name: (layer.meta_size, layer.meta_buffer)
+                                for layer in layer_registry if layer.meta_size > 1})
+    if tile_store is not None:
+        # scanning a big tree takes a while, the cache is usable meanwhile
+        index_loading = asyncio.create_task(asyncio.to_thread(load_indexes, tile_store, tile_service))
+    # COMPOSITE_CACHE_MAX_BYTES=0 disables the memory cache of the composited tiles
+    composite_cache_max_bytes = int(os.getenv("COMPOSITE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+    tile_compositor = TileCompositor(tile_service, MemoryTileCache(composite_cache_max_bytes)
+                                     if composite_cache_max_bytes > 0 else None)
+    # PREFETCH_WORKERS=0 disables the prefetch of the viewport endpoint
+    prefetch_workers = int(os.getenv("PREFETCH_WORKERS", "4"))
+    if prefetch_workers > 0:
+        tile_prefetcher = TilePrefetcher(tile_service, prefetch_workers, int(os.getenv("PREFETCH_QUEUE_SIZE", "1024")))
+    yield
+    if tile_prefetcher is not None:
+        await tile_prefetcher.aclose()
+    if index_loading is not None:
+        await index_loading
+    await tile_service.aclose()
+    if tile_processor is not None:
+        tile_processor.close()
+    await wms_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -27,6 +136,32 @@ app.add_middleware(
     allow_methods=["*"],  # List of allowed methods
     allow_headers=["*"],  # List of allowed headers
 )
+# grids of the tilecloud-chain config are added to the built-in swissgrid_05 and 2056_28
+tilecloud_cache_folder = None
+# the layers served, with their GetMap compiled once, the layers without url use WMS_BACKEND,
+# their coverage is the bbox of the layer refined by the polygons of COVERAGE_FOLDER/{layer}.geojson
+layer_registry = LayerRegistry([])
+# GetCapabilities of the layers, rendered once with the tiles under WMTS_BASE_URL,
+# defaulting to the http_url of the default cache of the tilecloud-chain config
+capabilities: WmtsCapabilities | None = None
+try:
+    register_tilecloud_grids(load_tilecloud_config())
+    tilecloud_cache_folder = get_cache_folder(load_tilecloud_config())
+    layer_registry = LayerRegistry.from_config(load_tilecloud_config(), os.getenv("WMS_BACKEND"),
+                                               os.getenv("COVERAGE_FOLDER"))
+    capabilities = WmtsCapabilities(load_tilecloud_config(),
+                                    os.getenv("WMTS_BASE_URL") or get_cache_http_url(load_tilecloud_config()))
+except OSError as error:
+    logger.warning(f"tilecloud-chain config not loaded, using only built-in grids: {error}")
+# process-wide, read-only grid built once at startup and shared by every request
+tile_matrix_set = get_tile_matrix_set(os.getenv("TILE_MATRIX_SET", "swissgrid_05"))
+tile_matrix = tile_matrix_set.table
+# the layer of the /tiles and /getTileByXY routes without layer
+DEFAULT_LAYER = "fonds_geo_osm_bdcad_couleur"
+# the tiles out of the coverage of their layer are answered without any backend request, by a shared
+# transparent tile, or by a 204 No Content with OUT_OF_COVERAGE=204
+OUT_OF_COVERAGE_NO_CONTENT = os.getenv("OUT_OF_COVERAGE", "transparent") == "204"
+out_of_coverage_count = 0
 
 class TileInfo(BaseModel):
     zoom: int
@@ -36,66 +171,522 @@ class TileInfo(BaseModel):
     bbox: conlist(float, min_length=4, max_length=4)
 
 
-def get_wms_backend_url():
-    wms_backend = os.getenv("WMS_BACKEND")
-    if wms_backend is None:
-        raise ValueError("WMS_BACKEND environment variable not set")
-    return wms_backend
+class TilesByXYRequest(BaseModel):
+    x: list[float]
+    y: list[float]
+    zoom: int | list[int]
+
+
+class InvalidateRequest(BaseModel):
+    layer: str
+    dimension: str | None = None
+    bbox: conlist(float, min_length=4, max_length=4) | None = None
+    geometry: dict | None = None
+    min_zoom: int | None = None
+    max_zoom: int | None = None
+
+
+class TilesByLatLonRequest(BaseModel):
+    lat: list[float]
+    lon: list[float]
+    zoom: int | list[int]
+
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"app": APP, "docs_url": "/docs", "redoc_url": "/redoc"}
 
 
-@app.get("/tiles/{zoom}/{col}/{row}",
+TILE_RESPONSES = {
+    200: {"description": "Returns a tile image, transparent out of the coverage of the layer. "
+                         "The png tiles are sent as WebP or JPEG to the clients naming them in Accept",
+          "content": {"image/png": {}, "image/webp": {}, "image/jpeg": {}}},
+    204: {"description": "The tile is out of the coverage of the layer, with OUT_OF_COVERAGE=204"},
+    400: {"description": "ValueError in one of the parameters"},
+    502: {"description": "The WMS backend did not return an image"}
+}
+
+
+@app.get("/tiles/{layer}/{zoom}/{col}/{row}", responses=TILE_RESPONSES, response_class=Response)
+async def read_layer_tiles(
+        request: Request,
+        layer: Annotated[str, "Layer name"],
+        zoom: Annotated[int, "Zoom level"],
+        col: Annotated[int, "Tile Column"],
+        row: Annotated[int, "Tile Row"],
+        dimension: Annotated[Optional[str], "Value of the dimension of the layer, e.g. the DATE"] = None,
+):
+    try:
+        tile_layer = layer_registry.get(layer)
+        dimension = tile_layer.check_dimension(dimension)
+    except ValueError as error:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=f"Error: {error}")
+    if tile_processor is None or not tile_processor.variants:
+        return await get_tile_response(tile_layer, zoom, col, row, dimension=dimension)
+    image_format = choose_tile_format(request.headers.get("accept"), tile_layer.extension, tile_processor.variants)
+    # the url does not tell the format, the caches in between must keep one tile by Accept
+    return await get_tile_response(tile_layer, zoom, col, row, image_format, {"Vary": "Accept"}, dimension,
+                                   request.headers.get("accept"))
+
+
+@app.get("/tiles/{zoom}/{col}/{row}", responses=TILE_RESPONSES, response_class=Response)
+async def read_tiles(
+        request: Request,
+        zoom: Annotated[int, "Zoom level"],
+        col: Annotated[int, "Tile Column"],
+        row: Annotated[int, "Tile Row"],
+        dimension: Annotated[Optional[str], "Value of the dimension of the layer, e.g. the DATE"] = None,
+):
+    return await read_layer_tiles(request, DEFAULT_LAYER, zoom, col, row, dimension)
+
+
+@app.get("/1.0.0/{layer}/{style}/{dimension}/{matrix_set}/{zoom}/{row}/{col}.{extension}",
+         responses=TILE_RESPONSES, response_class=Response)
+@app.get("/tiles/1.0.0/{layer}/{style}/{dimension}/{matrix_set}/{zoom}/{row}/{col}.{extension}",
+         include_in_schema=False, response_class=Response)
+async def read_wmts_tile(
+        layer: Annotated[str, "Layer name"],
+        style: Annotated[str, "Style of the layer, each layer has one"],
+        dimension: Annotated[str, "Value of the dimension of the layer"],
+        matrix_set: Annotated[str, "TileMatrixSet, any one with a TileMatrix identical to the grid of the layer"],
+        zoom: Annotated[int, "TileMatrix"],
+        row: Annotated[int, "Tile Row"],
+        col: Annotated[int, "Tile Column"],
+        extension: Annotated[str, "Image format extension, the one of the layer or a variant like webp"],
+):
+    """
+    The WMTS REST template of the GetCapabilities. The tiles of a TileMatrix identical to one of the grid
+    of the layer (e.g. zoom 18 of 2056_28 and zoom 0 of swissgrid_05) are the same tiles, cached once.
+    Each value of the dimension of the layer (its Value elements) has its own tiles.
+    """
+    try:
+        tile_layer = layer_registry.get(layer)
+        if extension != tile_layer.extension and (tile_processor is None or extension not in tile_processor.variants):
+            raise ValueError(f"Layer {layer} is served in {tile_layer.extension}, not {extension}.")
+        tile_layer.check_dimension(dimension)
+        if matrix_set != tile_layer.grid:
+            layer_zoom = get_equivalent_zoom(matrix_set, zoom, tile_layer.grid)
+            if layer_zoom is None:
+                raise ValueError(f"TileMatrix {zoom} of {matrix_set} is not served for layer {layer}, "
+                                 f"its grid is {tile_layer.grid}.")
+            zoom = layer_zoom
+    except ValueError as error:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=f"Error: {error}")
+    return await get_tile_response(tile_layer, zoom, col, row, extension, dimension=dimension)
+
+
+async def get_tile_response(layer: Layer, zoom: int, col: int, row: int, image_format: str | None = None,
+                            headers: dict[str, str] | None = None, dimension: str | None = None,
+                            accept: str | None = None) -> Response:
+    """
+    param: image_format: extension of the format of the response, defaults to the one of the layer,
+           the VARIANT_FORMATS are transcoded from it by the tile_processor.
+    param: headers: added to the response, like a Vary.
+    param: dimension: a value checked by Layer.check_dimension, defaults to the default value of the layer.
+    param: accept: the Accept header the image_format was chosen from, to choose again when the tile has no
+           variant in it (a tile with transparency has no JPEG), the format of the layer is sent without it.
+    """
+    global out_of_coverage_count
+    dimension = dimension or layer.dimension_default
+    image_format = image_format or layer.extension
+    media_type = layer.mime_type if image_format == layer.extension else VARIANT_FORMATS[image_format][1]
+    if not layer.coverage.contains(zoom, col, row):
+        table = layer.coverage.table
+        try:
+            table.get_tile_bbox(zoom, col, row)  # out of the matrix is still an error
+        except ValueError as error:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=f"Error: {error}")
+        out_of_coverage_count += 1
+        if OUT_OF_COVERAGE_NO_CONTENT:
+            return Response(status_code=status.HTTP_204_NO_CONTENT, headers=headers)
+        return Response(get_transparent_tile(table.tile_width, table.tile_height, image_format),
+                        media_type=media_type, headers=headers)
+    key = TileKey(layer.name, dimension, layer.grid, zoom, col, row)
+    tile = tile_service.get_memory_tile(key)
+    if tile is None and image_format == layer.extension:
+        # hits are sent straight from the file, the server may use sendfile
+        cached_file = tile_service.get_cached_file(key)
+        if cached_file is not None:
+            return FileResponse(cached_file, media_type=media_type, headers=headers)
+    try:
+        if tile is None:
+            tile = await tile_service.get_tile(key, layer.check_get_map(dimension),
+                                               file_checked=image_format == layer.extension)
+        variants = tile_processor.variants if tile_processor is not None else ()
+        while image_format != layer.extension:
+            variant = await tile_processor.get_variant(key, tile, image_format)
+            if variant is not None:
+                tile = variant
+                break
+            variants = tuple(v for v in variants if v != image_format)
+            image_format = choose_tile_format(accept, layer.extension, variants)
+            media_type = layer.mime_type if image_format == layer.extension else VARIANT_FORMATS[image_format][1]
+    except ValueError as error:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=f"Error: {error}")
+    except WmsError as error:
+        logger.error(f"tile {layer.name} {dimension} {zoom}/{col}/{row}: {error}")
+        raise HTTPException(status.HTTP_502_BAD_GATEWAY, detail=f"Error: {error}")
+    return Response(tile, media_type=media_type, headers=headers)
+
+
+@app.get("/composite/{layers}/{zoom}/{col}/{row}.{extension}",
          responses={
-             #200: {"description": "Returns a tile png image", "content": {"image/png": {}}},
-             200: {"description": "Returns url of wms request"},
-             400: {"description": "ValueError in one of the parameters"}
+             200: {"description": "Returns the tiles of the layers blended in one image, the first layer at the bottom",
+                   "content": {"image/png": {}, "image/webp": {}}},
+             400: {"description": "ValueError in one of the parameters"},
+             502: {"description": "The WMS backend did not return an image"}
          },
+         response_class=Response,
          )
-def read_tiles(
+async def read_composite_tile(
+        layers: Annotated[str, "Comma separated layer names, from the bottom to the top"],
         zoom: Annotated[int, "Zoom level"],
         col: Annotated[int, "Tile Column"],
         row: Annotated[int, "Tile Row"],
-        q: str | None = None
+        extension: Annotated[str, "png or webp"],
+        dimension: Annotated[Optional[str], "Value of the dimension of all the layers, e.g. the DATE, "
+                                            "or comma separated values, one by layer, empty for its default"] = None,
 ):
-    ch_grid = LausanneGrid()
-    layers = "osm_bdcad_couleur_msgroup,planville_cs_autres_msgroup,planville_cs_bati_pol_sout,planville_marquage_msgroup,planville_od_objets_msgroup,planville_arbres_goeland_msgroup,planville_cs_bati_msgroup,planville_od_labels_msgroup"
     try:
-        bbox = ch_grid.get_tile_bbox(zoom, col, row)
-        logger.debug(f"bbox={bbox}")
-        params = get_wms_params(bbox, layers,20, ch_grid.get_tile_width(), ch_grid.get_tile_height())
-        wms_url = f"{get_wms_backend_url()}?{'&'.join([f'{k}={v}' for k, v in params.items()])}"
-        logger.debug('Fetching wms image: %s?%s',        wms_url)
-        return {"data": wms_url}
+        tile_layers = [layer_registry.get(name) for name in layers.split(",") if name]
+        dimensions = None if dimension is None else [value or None for value in dimension.split(",")]
+        key = tile_compositor.get_key(tile_layers, extension, zoom, col, row, dimensions)
+    except ValueError as error:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=f"Error: {error}")
+    try:
+        tile = await tile_compositor.get_tile(key, tile_layers)
+    except WmsError as error:
+        logger.error(f"composite {layers} {zoom}/{col}/{row}: {error}")
+        raise HTTPException(status.HTTP_502_BAD_GATEWAY, detail=f"Error: {error}")
+    return Response(tile, media_type=COMPOSITE_FORMATS[extension][1])
+
+
+@app.get("/WMTSCapabilities.xml",
+         responses={
+             200: {"description": "Returns the WMTS GetCapabilities document", "content": {"application/xml": {}}},
+             304: {"description": "The document matches the ETag of If-None-Match"},
+             503: {"description": "The tilecloud-chain configuration or the public url of the service is missing"}
+         },
+         response_class=Response,
+         )
+@app.get("/1.0.0/WMTSCapabilities.xml", include_in_schema=False, response_class=Response)
+async def read_capabilities(request: Request):
+    if capabilities is None:
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, detail="Error: the tilecloud-chain configuration "
+                                                                        "was not loaded.")
+    try:
+        document = await asyncio.to_thread(capabilities.get)
+    except ValueError as error:
+        logger.error(f"capabilities: {error}")
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, detail=f"Error: {error}")
+    encoding = choose_encoding(request.headers.get("accept-encoding"), document.bodies)
+    # clients revalidate every time, a 304 is cheap and the document of a restart is seen at once
+    headers = {"ETag": document.etags[encoding], "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if document.is_not_modified(request.headers.get("if-none-match")):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(document.bodies[encoding], media_type="application/xml", headers=headers)
+
+
+@app.get("/stats",
+         responses={
+             200: {"description": "Returns the counters of the tile fetch path"}
+         },
+         )
+async def read_stats():
+    stats = tile_service.stats() | {"out_of_coverage": out_of_coverage_count, "composites": tile_compositor.stats()}
+    if tile_prefetcher is not None:
+        stats["prefetch"] = tile_prefetcher.stats()
+    return stats
+
+
+@app.get("/nearestZoom/{matrix_set}",
+         responses={
+             200: {"description": "Returns the zoom level the nearest to the resolution or scale denominator, "
+                                  "with the TileMatrix its tiles are stored under"},
+             400: {"description": "ValueError in one of the parameters"}
+         },
+         )
+async def get_nearest_zoom(
+        matrix_set: Annotated[str, "TileMatrixSet"],
+        resolution: Optional[float] = None,
+        scale_denominator: Optional[float] = None,
+):
+    try:
+        tile_matrix_set = get_tile_matrix_set(matrix_set)
+        zoom = tile_matrix_set.get_nearest_zoom(resolution, scale_denominator)
+        canonical = get_canonical_matrix(tile_matrix_set.identifier, zoom)
+    except ValueError as error:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=f"Error: {error}")
+    table = tile_matrix_set.table
+    i = table.check_zoom(zoom)
+    return {"matrix_set": tile_matrix_set.identifier, "zoom": zoom, "cell_size": table.cell_sizes[i],
+            "scale_denominator": table.scale_denominators[i],
+            "canonical": {"matrix_set": canonical[0], "zoom": canonical[1]}}
+
+
+@app.post("/invalidate",
+          responses={
+              200: {"description": "Returns the number of tiles removed from each cache tier"},
+              400: {"description": "ValueError in one of the parameters"}
+          },
+          )
+async def invalidate_tiles(request: InvalidateRequest):
+    """
+    Remove the cached tiles of a layer intersecting a bbox or a GeoJSON geometry (EPSG:2056), at every zoom level
+    between min_zoom and max_zoom, from the memory cache, the tile store, the WebP/JPEG variants and the composites.
+    Only the tiles present in the index of the caches are looked at, the next request renders them again.
+    """
+    started = time.perf_counter()
+    try:
+        tile_layer = layer_registry.get(request.layer)
+        dimension = tile_layer.check_dimension(request.dimension)
+        table = get_tile_matrix_set(tile_layer.grid).table
+        polygons = get_geojson_polygons(request.geometry) if request.geometry is not None else None
+        if request.bbox is not None:
+            bbox = tuple(request.bbox)
+        elif polygons:
+            xs = [x for polygon in polygons for x, _ in polygon[0]]
+            ys = [y for polygon in polygons for _, y in polygon[0]]
+            bbox = (min(xs), min(ys), max(xs), max(ys))
+        else:
+            raise ValueError("Please give a bbox or a geometry with at least one polygon.")
+        min_zoom = table.min_zoom if request.min_zoom is None else request.min_zoom
+        max_zoom = table.max_zoom if request.max_zoom is None else request.max_zoom
+        table.check_zoom(min_zoom)
+        table.check_zoom(max_zoom)
+    except ValueError as error:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=f"Error: {error}")
+    tile_ranges = [tile_range for zoom in range(min_zoom, max_zoom + 1)
+                   if (tile_range := table.get_tile_range(bbox, zoom)) is not None]
+    # the tiles of the geometry, grown by one tile: a tile partly covered is invalidated too
+    contains = TileCoverage(table, bbox, polygons).contains if polygons else None
+    removed = await tile_service.invalidate(tile_layer.name, dimension, tile_layer.grid, tile_ranges, contains,
+                                            tile_layer.get_maps.get(dimension))
+    removed["composites"] = tile_compositor.invalidate(tile_layer.name, dimension, tile_ranges, contains)
+    logger.info(f"invalidated {removed} of {tile_layer.name} {dimension} in {bbox}")
+    return {"layer": tile_layer.name, "dimension": dimension, "bbox": list(bbox),
+            "ranges": [tile_range._asdict() for tile_range in tile_ranges], "removed": removed,
+            "duration_ms": (time.perf_counter() - started) * 1000}
+
+
+# a viewport of a 4K screen at the resolution of its zoom level is about 16 x 9 tiles
+MAX_VIEWPORT_TILES = 1024
+MAX_PREFETCH_RING = 4
+
+
+def parse_bbox(bbox: str) -> tuple[float, float, float, float]:
+    """
+    raise: ValueError if bbox is not 'x_min,y_min,x_max,y_max'.
+    """
+    values = [float(v) for v in bbox.split(",")]
+    if len(values) != 4 or values[0] >= values[2] or values[1] >= values[3]:
+        raise ValueError(f"Invalid bbox {bbox}, it must be x_min,y_min,x_max,y_max.")
+    return values[0], values[1], values[2], values[3]
+
+
+def get_prefetch_keys(layer: Layer, bbox: tuple[float, float, float, float], zoom: int, ring: int):
+    """
+    Iterate over the tiles to prefetch around a viewport, the nearest first: the ring of ring tiles around it,
+    then its tiles at zoom + 1 and at zoom - 1. The tiles out of the coverage of the layer are left out.
+    """
+    table = layer.coverage.table
+    viewport = table.get_tile_range(bbox, zoom)
+    if ring > 0 and viewport is not None:
+        x_min, y_min, x_max, y_max = bbox
+        margin_x = ring * table.spans_x[table.check_zoom(zoom)]
+        margin_y = ring * table.spans_y[table.check_zoom(zoom)]
+        around = table.get_tile_range((x_min - margin_x, y_min - margin_y, x_max + margin_x, y_max + margin_y), zoom)
+        for _, col, row in around.tiles():
+            if not (viewport.min_col <= col <= viewport.max_col and viewport.min_row <= row <= viewport.max_row):
+                yield zoom, col, row
+    for other_zoom in (zoom + 1, zoom - 1):
+        if table.has_zoom(other_zoom):
+            tile_range = table.get_tile_range(bbox, other_zoom)
+            if tile_range is not None:
+                yield from tile_range.tiles()
+
+
+@app.get("/viewport/{layer}",
+         responses={
+             200: {"description": "Returns the tiles covering the bbox at the zoom level, with their url, "
+                                  "covered is false for the tiles out of the coverage of the layer"},
+             400: {"description": "ValueError in one of the parameters"}
+         },
+         )
+async def get_viewport_tiles(
+        layer: Annotated[str, "Layer name"],
+        bbox: Annotated[str, "x_min,y_min,x_max,y_max of the viewport (SwissGrid LV95)"],
+        width: Annotated[int, "Width of the viewport in pixels"],
+        height: Annotated[int, "Height of the viewport in pixels"],
+        zoom: Optional[int] = None,
+        prefetch: bool = False,
+        ring: int = 1,
+        dimension: Optional[str] = None,
+):
+    """
+    The tiles of a viewport in one request. Without zoom, the zoom level is the one the nearest to the
+    resolution of the viewport. With prefetch, the ring tiles around the viewport and its tiles at the
+    zoom levels above and below are fetched into the cache in the background.
+    """
+    try:
+        tile_layer = layer_registry.get(layer)
+        dimension = tile_layer.check_dimension(dimension)
+        viewport = parse_bbox(bbox)
+        if width <= 0 or height <= 0:
+            raise ValueError(f"Invalid viewport size {width}x{height}.")
+        tile_matrix_set = get_tile_matrix_set(tile_layer.grid)
+        if zoom is None:
+            zoom = tile_matrix_set.get_nearest_zoom(max((viewport[2] - viewport[0]) / width,
+                                                        (viewport[3] - viewport[1]) / height))
+        tile_range = tile_matrix_set.table.get_tile_range(viewport, zoom)
+        if tile_range is not None and tile_range.count > MAX_VIEWPORT_TILES:
+            raise ValueError(f"The viewport has {tile_range.count} tiles at zoom {zoom}, "
+                             f"the limit is {MAX_VIEWPORT_TILES}.")
     except ValueError as error:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=f"Error: {error}")
+    prefix = f"/1.0.0/{tile_layer.name}/default/{dimension}/{tile_layer.grid}/{zoom}/"
+    coverage = tile_layer.coverage
+    tiles = [{"col": col, "row": row, "url": f"{prefix}{row}/{col}.{tile_layer.extension}",
+              "covered": coverage.contains(zoom, col, row)}
+             for _, col, row in (tile_range.tiles() if tile_range is not None else ())]
+    prefetched = 0
+    if prefetch and tile_prefetcher is not None and tile_layer.get_map is not None:
+        keys = (TileKey(tile_layer.name, dimension, tile_layer.grid, z, col, row)
+                for z, col, row in get_prefetch_keys(tile_layer, viewport, zoom, min(max(0, ring), MAX_PREFETCH_RING))
+                if coverage.contains(z, col, row))
+        prefetched = tile_prefetcher.schedule(keys, tile_layer.get_maps[dimension])
+    return {"layer": tile_layer.name, "dimension": dimension, "matrix_set": tile_layer.grid, "zoom": zoom,
+            "range": tile_range._asdict() if tile_range is not None else None, "tiles": tiles,
+            "prefetched": prefetched}
 
-@app.get("/getTileByXY/{zoom}/{x}/{y}",
-            responses={
-                200: {"description": "Returns col and row of the tile and url of wms request"},
-                400: {"description": "ValueError in one of the parameters"}
-            },
-            )
-def get_tile_info_by_xy(
+
+TILE_INFO_RESPONSES = {
+    200: {"description": "Returns col and row of the tile and url of wms request", "model": TileInfo},
+    400: {"description": "ValueError in one of the parameters"}
+}
+
+
+@app.get("/getTileByXY/{layer}/{zoom}/{x}/{y}", responses=TILE_INFO_RESPONSES)
+async def get_layer_tile_info_by_xy(
+        layer: Annotated[str, "Layer name"],
         zoom: Annotated[int, "Zoom level"],
         x: Annotated[float, "X coordinate (SwissGrid LV95)"],
         y: Annotated[float, "Y coordinate (SwissGrid LV95)"],
-        gutter: Optional[int] = 0
+        gutter: Optional[int] = 0,
+        dimension: Annotated[Optional[str], "Value of the dimension of the layer, e.g. the DATE"] = None,
 ):
-    ch_grid = LausanneGrid()
-    layers = "osm_bdcad_couleur_msgroup,planville_cs_autres_msgroup,planville_cs_bati_pol_sout,planville_marquage_msgroup,planville_od_objets_msgroup,planville_arbres_goeland_msgroup,planville_cs_bati_msgroup,planville_od_labels_msgroup"
     try:
-        col, row = ch_grid.get_tile(x, y, zoom)
+        tile_layer = layer_registry.get(layer)
+        dimension = tile_layer.check_dimension(dimension)
+        table = get_tile_matrix_set(tile_layer.grid).table
+        col, row = table.get_tile(x, y, zoom)
         logger.debug(f"col={col}, row={row}")
-        bbox = ch_grid.get_tile_bbox(zoom, col, row)
+        bbox = table.get_tile_bbox(zoom, col, row)
         logger.debug(f"bbox={bbox}")
-        params = get_wms_params(bbox, layers,gutter, ch_grid.get_tile_width(), ch_grid.get_tile_height())
-        wms_url = f"{get_wms_backend_url()}?{'&'.join([f'{k}={v}' for k, v in params.items()])}"
-        logger.debug('Fetching wms image: %s?%s',        wms_url)
-        my_tile_info = TileInfo(zoom=zoom, col=col, row=row, wms_url=wms_url, bbox=bbox.bbox)
-        json_my_tile_info = jsonable_encoder(my_tile_info)
-        return JSONResponse(content=json_my_tile_info)
+        # the image grows by gutter pixels on each side, so must the bbox
+        wms_bbox = add_gutter(bbox, gutter, table.cell_sizes[table.check_zoom(zoom)])
+        wms_url = tile_layer.check_get_map(dimension).get_url(wms_bbox, table.tile_width + 2 * gutter,
+                                                              table.tile_height + 2 * gutter)
+        logger.debug('Fetching wms image: %s', wms_url)
+        # plain dict matching TileInfo, no pydantic validation needed on values we computed ourselves
+        return JSONResponse(content={"zoom": zoom, "col": col, "row": row, "wms_url": wms_url, "bbox": list(bbox)})
     except ValueError as error:
-        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=f"Error: {error}")
\ No newline at end of file
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=f"Error: {error}")
+
+
+@app.get("/getTileByXY/{zoom}/{x}/{y}", responses=TILE_INFO_RESPONSES)
+async def get_tile_info_by_xy(
+        zoom: Annotated[int, "Zoom level"],
+        x: Annotated[float, "X coordinate (SwissGrid LV95)"],
+        y: Annotated[float, "Y coordinate (SwissGrid LV95)"],
+        gutter: Optional[int] = 0,
+        dimension: Annotated[Optional[str], "Value of the dimension of the layer, e.g. the DATE"] = None,
+):
+    return await get_layer_tile_info_by_xy(DEFAULT_LAYER, zoom, x, y, gutter, dimension)
+
+
+@app.get("/getTileByLatLon/{layer}/{zoom}/{lat}/{lon}", responses=TILE_INFO_RESPONSES)
+async def get_layer_tile_info_by_lat_lon(
+        layer: Annotated[str, "Layer name"],
+        zoom: Annotated[int, "Zoom level"],
+        lat: Annotated[float, "Latitude (WGS84)"],
+        lon: Annotated[float, "Longitude (WGS84)"],
+        gutter: Optional[int] = 0,
+        dimension: Annotated[Optional[str], "Value of the dimension of the layer, e.g. the DATE"] = None,
+):
+    x, y = wgs84_to_lv95(lon, lat)
+    return await get_layer_tile_info_by_xy(layer, zoom, float(x), float(y), gutter, dimension)
+
+
+@app.get("/getTileByLatLon/{zoom}/{lat}/{lon}", responses=TILE_INFO_RESPONSES)
+async def get_tile_info_by_lat_lon(
+        zoom: Annotated[int, "Zoom level"],
+        lat: Annotated[float, "Latitude (WGS84)"],
+        lon: Annotated[float, "Longitude (WGS84)"],
+        gutter: Optional[int] = 0,
+        dimension: Annotated[Optional[str], "Value of the dimension of the layer, e.g. the DATE"] = None,
+):
+    return await get_layer_tile_info_by_lat_lon(DEFAULT_LAYER, zoom, lat, lon, gutter, dimension)
+
+
+@app.post("/getTilesByXY",
+          responses={
+              200: {"description": "Returns zoom, col, row and bbox of the tile containing each point, "
+                                   "invalid is true for points outside of the grid"},
+              400: {"description": "ValueError in one of the parameters"}
+          },
+          )
+async def get_tiles_info_by_xy(request: TilesByXYRequest):
+    try:
+        check_points("x", request.x, "y", request.y, request.zoom)
+    except ValueError as error:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=f"Error: {error}")
+    return get_tiles_info(request.x, request.y, request.zoom)
+
+
+@app.post("/getTilesByLatLon",
+          responses={
+              200: {"description": "Returns the LV95 x and y, zoom, col, row and bbox of the tile containing each "
+                                   "WGS84 point, invalid is true for points outside of the grid"},
+              400: {"description": "ValueError in one of the parameters"}
+          },
+          )
+async def get_tiles_info_by_lat_lon(request: TilesByLatLonRequest):
+    try:
+        check_points("lat", request.lat, "lon", request.lon, request.zoom)
+        xs, ys = wgs84_to_lv95(request.lon, request.lat)
+    except ValueError as error:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=f"Error: {error}")
+    return get_tiles_info(xs, ys, request.zoom, {"x": xs.tolist(), "y": ys.tolist()})
+
+
+def check_points(x_name: str, xs: list[float], y_name: str, ys: list[float], zoom: int | list[int]):
+    """
+    raise: ValueError if the coordinate lists differ in length or if zoom is a list of another length than 1 or
+    the number of points.
+    """
+    if len(xs) != len(ys):
+        raise ValueError(f"{x_name} has {len(xs)} values and {y_name} {len(ys)}, please give one of each by point.")
+    if isinstance(zoom, list) and len(zoom) not in (1, len(xs)):
+        raise ValueError(f"zoom has {len(zoom)} values for {len(xs)} points, "
+                         f"please give one zoom for all the points or one by point.")
+
+
+def get_tiles_info(xs, ys, zoom: int | list[int], extra: dict | None = None) -> JSONResponse:
+    try:
+        zooms = np.broadcast_to(np.asarray(zoom, dtype=np.int64), (len(xs),))
+        cols, rows = tile_matrix.get_tiles(xs, ys, zooms)
+        valid = tile_matrix.are_valid_tiles(zooms, cols, rows)
+        bboxes = tile_matrix.get_tiles_bbox(zooms, cols, rows)
+    except ValueError as error:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=f"Error: {error}")
+    logger.debug(f"resolved {len(cols)} points, {np.count_nonzero(~valid)} outside of the grid")
+    return JSONResponse(content=(extra or {}) | {
+        "zoom": zooms.tolist(),
+        "col": cols.tolist(),
+        "row": rows.tolist(),
+        "bbox": bboxes.tolist(),
+        "invalid": (~valid).tolist(),
+    })
@@ -0,0 +1,170 @@
+"""
+Build the coarse zoom levels of a layer from its cached finer tiles, without any WMS request.
+
+    python -m app.pyramid fonds_geo_osm_bdcad_couleur --from-zoom 9 --to-zoom 0
+
+Each zoom is derived from the one just below it, once it is complete. The resolutions of swissgrid_05 are not
+powers of two (50, 20, 10, 5, 2.5, 1...), a parent tile covers a fractional block of 2 x 2 to 2.5 x 2.5 children:
+the children of a block of parents are mosaicked and resampled with a sub-pixel box, then cut again.
+
+The parents are written straight into the tile store, behind the back of a running service: its memory caches,
+its variants and its index of the known empty tiles still hold the former tiles of these zooms. Restart it, or
+POST /invalidate with the bbox and the zooms built, for the new tiles to be served.
+"""
+import argparse
+import io
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from dotenv import load_dotenv
+from PIL import Image
+
+from app.cache.tileStore import TileStore
+from app.cache.tileStores import TILE_STORE_TYPES, open_tile_store
+from app.config import get_cache_folder, get_layer_config, get_tilecloud_config_path, load_tilecloud_config
+from app.seed import get_dimension_values
+from app.wms.metaTile import iter_meta_tile_ranges
+from app.wmts.tileMatrix import TileMatrixTable, TileRange
+from app.wmts.tileMatrixSet import get_tile_matrix_set, register_tilecloud_grids
+from app.wmts.utils import TileKey
+
+logger = logging.getLogger("pyramid")
+
+# parents built from one mosaic, per side: 4 x 4 parents need at most 11 x 11 children, about 32 MB of RGBA
+BLOCK_SIZE = 4
+
+
+def build_parent_block(store: TileStore, table: TileMatrixTable, block: TileRange, layer: str, dimension: str,
+                       grid: str, resample=Image.Resampling.LANCZOS) -> dict[TileKey, bytes]:
+    """
+    Render the tiles of a block of parents from their children of the next zoom in the store.
+    The missing children are transparent, the parents without any child are left out.
+    return: dict of png by TileKey
+    """
+    child_zoom = block.zoom + 1
+    block_bbox = table.get_tile_range_bbox(block)
+    children = table.get_tile_range(block_bbox, child_zoom)
+    if children is None:
+        return {}
+    width, height = table.tile_width, table.tile_height
+    mosaic = None
+    for _, col, row in children.tiles():
+        data = store.get(TileKey(layer, dimension, grid, child_zoom, col, row))
+        if data is None:
+            continue
+        if mosaic is None:
+            mosaic = Image.new('RGBA', (children.num_cols * width, children.num_rows * height))
+        with Image.open(io.BytesIO(data)) as child:
+            mosaic.paste(child.convert('RGBA'), ((col - children.min_col) * width, (row - children.min_row) * height))
+    if mosaic is None:
+        return {}
+
+    # the parents block in mosaic pixels, fractional when the zoom ratio is not an integer
+    child_cell = table.cell_sizes[table.check_zoom(child_zoom)]
+    children_bbox = table.get_tile_range_bbox(children)
+    box = ((block_bbox[0] - children_bbox[0]) / child_cell, (children_bbox[3] - block_bbox[3]) / child_cell,
+           (block_bbox[2] - children_bbox[0]) / child_cell, (children_bbox[3] - block_bbox[1]) / child_cell)
+    # RGBA is resampled with premultiplied alpha by Pillow, transparent children do not darken the edges
+    parents = mosaic.resize((block.num_cols * width, block.num_rows * height), resample, box=box)
+    tiles = {}
+    for zoom, col, row in block.tiles():
+        left = (col - block.min_col) * width
+        top = (row - block.min_row) * height
+        tile = parents.crop((left, top, left + width, top + height))
+        if tile.getextrema()[3][1] == 0:
+            continue
+        buffer = io.BytesIO()
+        tile.save(buffer, format='PNG')
+        tiles[TileKey(layer, dimension, grid, zoom, col, row)] = buffer.getvalue()
+    return tiles
+
+
+# state of a worker process, built once by _init_worker
+_worker = {}
+
+
+def _init_worker(config_path: str, grid: str, store_type: str, cache_folder: str):
+    register_tilecloud_grids(load_tilecloud_config(config_path))
+    _worker["table"] = get_tile_matrix_set(grid).table
+    _worker["store"] = open_tile_store(store_type, cache_folder)
+
+
+def _build_block(block: TileRange, layer: str, dimension: str, grid: str) -> int:
+    # written to the store directly, a running service has to be restarted or invalidated (see above)
+    tiles = build_parent_block(_worker["store"], _worker["table"], block, layer, dimension, grid)
+    _worker["store"].put_many(tiles)
+    return len(tiles)
+
+
+def build_pyramid(layer: str, dimension: str, grid: str, bbox, from_zoom: int, to_zoom: int, processes: int,
+                  store_type: str, cache_folder: str) -> int:
+    """
+    Build the zooms from from_zoom - 1 down to to_zoom, each one from the previous.
+    return: the number of tiles written
+    """
+    table = get_tile_matrix_set(grid).table
+    total = 0
+    with ProcessPoolExecutor(processes, initializer=_init_worker,
+                             initargs=(str(get_tilecloud_config_path()), grid, store_type, cache_folder)) as pool:
+        for zoom in range(from_zoom - 1, to_zoom - 1, -1):
+            tile_range = table.get_tile_range(bbox, zoom)
+            if tile_range is None:
+                continue
+            start = time.monotonic()
+            build = partial(_build_block, layer=layer, dimension=dimension, grid=grid)
+            # map consumes the blocks lazily in chunks, the zoom is never held in memory as a whole
+            written = sum(pool.map(build, iter_meta_tile_ranges(tile_range, BLOCK_SIZE), chunksize=8))
+            elapsed = time.monotonic() - start
+            logger.info(f"{dimension} zoom {zoom}: {written}/{tile_range.count} tiles from zoom {zoom + 1}, "
+                        f"{written / elapsed if elapsed > 0 else 0:.0f} tiles/s")
+            total += written
+    return total
+
+
+def main(argv: list[str] | None = None) -> int:
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Build the coarse zooms of a layer from its cached finer tiles.")
+    parser.add_argument("layer", help="name of the layer in the tilecloud-chain configuration")
+    parser.add_argument("--from-zoom", type=int, required=True, help="finest zoom, already cached")
+    parser.add_argument("--to-zoom", type=int, default=0, help="coarsest zoom to build")
+    parser.add_argument("--bbox", type=float, nargs=4, metavar=("X_MIN", "Y_MIN", "X_MAX", "Y_MAX"),
+                        help="defaults to the bbox of the layer")
+    parser.add_argument("--dimension", action="append", help="dimension value, defaults to the generate list")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--store", choices=TILE_STORE_TYPES, default=os.getenv("TILE_STORE", "directory"))
+    parser.add_argument("--cache-dir", help="defaults to TILE_CACHE_DIR or the default cache of the config")
+    args = parser.parse_args(argv)
+
+    config = load_tilecloud_config()
+    register_tilecloud_grids(config)
+    try:
+        layer_config = get_layer_config(config, args.layer)
+        grid = layer_config["grid"]
+        table = get_tile_matrix_set(grid).table
+        table.check_zoom(args.from_zoom)
+        table.check_zoom(args.to_zoom)
+        if args.to_zoom >= args.from_zoom:
+            raise ValueError("--to-zoom must be coarser than --from-zoom.")
+        bbox = args.bbox or layer_config.get("bbox") or get_tile_matrix_set(grid).bbox
+        if bbox is None:
+            raise ValueError(f"No bbox for layer {args.layer}, please set --bbox.")
+        cache_folder = args.cache_dir or os.getenv("TILE_CACHE_DIR") or get_cache_folder(config)
+        if not cache_folder:
+            raise ValueError("No cache folder, please set --cache-dir or TILE_CACHE_DIR.")
+    except ValueError as error:
+        parser.error(str(error))
+    for dimension in args.dimension or get_dimension_values(layer_config):
+        build_pyramid(args.layer, dimension, grid, bbox, args.from_zoom, args.to_zoom, args.processes, args.store,
+                      cache_folder)
+    logger.info(f"zooms {args.to_zoom}-{args.from_zoom - 1} built, restart the running service or POST /invalidate "
+                f"for {args.layer} with this bbox to serve them")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,389 @@
+"""
+Pre-generate the tiles of a layer of the tilecloud-chain configuration, like tilecloud-chain generate_tiles.
+
+    python -m app.seed fonds_geo_osm_bdcad_couleur --zoom 0-7 --processes 8
+
+The bbox of the layer is split into metatile-aligned chunks, rendered by a pool of processes each fetching
+several metatiles at once. Every finished chunk is appended to a checkpoint file, running the same command
+again after an interruption skips them.
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Iterator, NamedTuple
+
+from dotenv import load_dotenv
+
+from app.cache.tileStore import TileSignature
+from app.cache.tileStores import TILE_STORE_TYPES, open_tile_store
+from app.config import (get_cache_folder, get_expanded_value, get_layer_config, get_tilecloud_config_path,
+                        load_tilecloud_config)
+from app.wms.metaTile import get_meta_settings, get_meta_tile_range, iter_meta_tile_ranges, slice_meta_tile
+from app.wms.wms import WmsClient, WmsError, add_gutter, get_wms_params, get_wms_url
+from app.wmts.tileMatrix import TileMatrixTable, TileRange
+from app.wmts.tileMatrixSet import get_tile_matrix_set, register_tilecloud_grids
+from app.wmts.utils import TileKey
+
+logger = logging.getLogger("seed")
+
+
+class SeedOptions(NamedTuple):
+    """
+    Everything a worker process needs to render and store the chunks, it is sent once to each of them.
+    """
+    config_path: str
+    layer: str
+    grid: str
+    wms_url: str
+    wms_layers: str
+    # name of the WMS parameter of the dimension values, None for the layers without dimension
+    dimension_name: str | None
+    headers: dict
+    extension: str
+    meta_size: int
+    meta_buffer: int
+    store_type: str
+    cache_folder: str
+    concurrency: int
+    empty_metatile: TileSignature | None
+
+
+class ChunkResult(NamedTuple):
+    dimension: str
+    chunk: TileRange
+    error: str | None
+
+
+def get_seed_options(config: dict, layer: str, store_type: str, cache_folder: str | None,
+                     concurrency: int) -> SeedOptions:
+    """
+    Read the seeding parameters of a layer from the tilecloud-chain configuration.
+    raise: ValueError if the layer, its grid, its WMS layers, its WMS url or the cache folder cannot be found.
+    """
+    layer_config = get_layer_config(config, layer)
+    for name in ("grid", "layers"):
+        if not layer_config.get(name):
+            raise ValueError(f"Layer {layer} has no {name} in the tilecloud-chain configuration.")
+    wms_url = get_expanded_value(layer_config.get("url")) or os.getenv("WMS_BACKEND")
+    if wms_url is None:
+        raise ValueError(f"The url of layer {layer} is not set, please set MAPSERVER_URL or WMS_BACKEND.")
+    cache_folder = cache_folder or os.getenv("TILE_CACHE_DIR") or get_cache_folder(config)
+    if not cache_folder:
+        raise ValueError("No cache folder, please set --cache-dir or TILE_CACHE_DIR.")
+    empty_metatile = layer_config.get("empty_metatile_detection")
+    # the metatiles of the service too
+    meta_size, meta_buffer = get_meta_settings(layer_config)
+    dimensions = layer_config.get("dimensions") or []
+    return SeedOptions(
+        config_path=str(get_tilecloud_config_path()),
+        layer=layer,
+        grid=layer_config["grid"],
+        wms_url=wms_url,
+        wms_layers=layer_config["layers"],
+        dimension_name=dimensions[0]["name"] if dimensions else None,
+        headers={k: str(v) for k, v in (layer_config.get("headers") or {}).items() if get_expanded_value(v)},
+        extension=layer_config.get("extension", "png"),
+        meta_size=meta_size,
+        meta_buffer=meta_buffer,
+        store_type=store_type,
+        cache_folder=cache_folder,
+        concurrency=concurrency,
+        empty_metatile=TileSignature(int(empty_metatile["size"]), str(empty_metatile["hash"]))
+        if empty_metatile else None,
+    )
+
+
+def get_dimension_values(layer_config: dict) -> list[str]:
+    """
+    Get the dimension values to generate, tilecloud-chain layers have at most one dimension here (DATE).
+    """
+    dimensions = layer_config.get("dimensions") or []
+    if not dimensions:
+        return ["default"]
+    return [str(v) for v in dimensions[0].get("generate", [dimensions[0]["default"]])]
+
+
+def parse_zooms(zooms: str | None, table: TileMatrixTable, min_resolution_seed: float | None = None) -> range:
+    """
+    param: zooms: 'z' or 'min-max', all the zooms of the grid down to min_resolution_seed when None
+    raise: ValueError if a zoom is not in the grid.
+    """
+    if zooms is None:
+        max_zoom = table.max_zoom
+        if min_resolution_seed is not None:
+            max_zoom = max(z for z in range(table.min_zoom, table.max_zoom + 1)
+                           if table.cell_sizes[z - table.min_zoom] >= min_resolution_seed - 1e-9)
+        return range(table.min_zoom, max_zoom + 1)
+    first, _, last = zooms.partition("-")
+    selected = range(int(first), int(last or first) + 1)
+    table.check_zoom(selected.start)
+    table.check_zoom(selected.stop - 1)
+    return selected
+
+
+# state of a worker process, built once by _init_worker
+_worker = {}
+
+
+def _init_worker(options: SeedOptions):
+    register_tilecloud_grids(load_tilecloud_config(options.config_path))
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    _worker.update(
+        options=options,
+        loop=loop,
+        table=get_tile_matrix_set(options.grid).table,
+        store=open_tile_store(options.store_type, options.cache_folder, extensions={options.layer: options.extension}),
+        client=None,
+    )
+
+
+def _seed_batch(batch: list[tuple[str, TileRange]]) -> list[ChunkResult]:
+    return _worker["loop"].run_until_complete(_seed_batch_async(batch))
+
+
+async def _seed_batch_async(batch: list[tuple[str, TileRange]]) -> list[ChunkResult]:
+    options: SeedOptions = _worker["options"]
+    if _worker["client"] is None:
+        # created in the loop of the worker, it keeps its connections between batches
+        _worker["client"] = WmsClient(max_connections=options.concurrency, headers=options.headers)
+    semaphore = asyncio.Semaphore(options.concurrency)
+
+    async def seed_chunk(dimension: str, chunk: TileRange) -> ChunkResult:
+        async with semaphore:
+            try:
+                await _seed_chunk(options, dimension, chunk)
+            except (WmsError, OSError, ValueError) as error:
+                return ChunkResult(dimension, chunk, f"{error!r}")
+            return ChunkResult(dimension, chunk, None)
+
+    return await asyncio.gather(*(seed_chunk(dimension, chunk) for dimension, chunk in batch))
+
+
+async def _seed_chunk(options: SeedOptions, dimension: str, chunk: TileRange):
+    table: TileMatrixTable = _worker["table"]
+    meta_range = get_meta_tile_range(table, chunk.zoom, chunk.min_col, chunk.min_row, options.meta_size)
+    bbox = add_gutter(table.get_tile_range_bbox(meta_range), options.meta_buffer,
+                      table.cell_sizes[table.check_zoom(meta_range.zoom)])
+    params = get_wms_params(bbox, options.wms_layers, options.meta_buffer, meta_range.num_cols * table.tile_width,
+                            meta_range.num_rows * table.tile_height, options.extension,
+                            {options.dimension_name: dimension} if options.dimension_name else None)
+    image_bytes = await _worker["client"].get_image(get_wms_url(options.wms_url, params))
+    tiles = await asyncio.to_thread(slice_meta_tile, image_bytes, meta_range, options.meta_buffer, table.tile_width,
+                                    table.tile_height, options.extension, options.empty_metatile)
+    # the metatile may overflow the bbox, only the tiles of the chunk are stored
+    items = {TileKey(options.layer, dimension, options.grid, chunk.zoom, col, row): tiles[(col, row)]
+             for _, col, row in chunk.tiles()}
+    await asyncio.to_thread(_worker["store"].put_many, items)
+
+
+def get_checkpoint_header(options: SeedOptions, bbox) -> str:
+    """
+    Describe what the chunks of a checkpoint were rendered for: the same chunk of another bbox, metatile size
+    or store holds other tiles.
+    """
+    return (f"# {options.layer} {options.grid} bbox {','.join(str(float(v)) for v in bbox)} "
+            f"meta_size {options.meta_size} {options.store_type} {os.path.abspath(options.cache_folder)}")
+
+
+def get_checkpoint_path(options: SeedOptions, bbox) -> str:
+    """
+    return: seed_<layer>_<digest of the header>.checkpoint, each seeding of a layer has its own.
+    """
+    digest = hashlib.sha1(get_checkpoint_header(options, bbox).encode()).hexdigest()[:8]
+    return f"seed_{options.layer}_{digest}.checkpoint"
+
+
+def check_checkpoint(path: str, header: str):
+    """
+    raise: ValueError if the checkpoint was written by a seeding with another header.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, encoding="utf-8") as f:
+        first_line = f.readline().rstrip("\n")
+    if first_line and first_line != header:
+        raise ValueError(f"The checkpoint {path} is of another seeding ({first_line.lstrip('# ')}), "
+                         f"please remove it or set another --checkpoint.")
+
+
+def load_checkpoint(path: str) -> set[tuple[str, int, int, int]]:
+    """
+    return: the (dimension, zoom, min_col, min_row) of the chunks already done.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            # a run killed while writing may leave a partial last line
+            if len(parts) == 4 and all(p.isdigit() for p in parts[1:]):
+                done.add((parts[0], int(parts[1]), int(parts[2]), int(parts[3])))
+    return done
+
+
+def _batched(iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class ZoomProgress:
+    """
+    Progress of one zoom level, the rate only counts the tiles rendered by this run.
+    """
+
+    def __init__(self, dimension: str, zoom: int, total: int):
+        self.dimension = dimension
+        self.zoom = zoom
+        self.total = total
+        self.done = 0
+        self.rendered = 0
+        self.errors = 0
+        self.start = time.monotonic()
+
+    def report(self) -> str:
+        elapsed = time.monotonic() - self.start
+        rate = self.rendered / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - self.done
+        eta = time.strftime("%H:%M:%S", time.gmtime(remaining / rate)) if rate > 0 else "--:--:--"
+        return (f"{self.dimension} zoom {self.zoom}: {self.done}/{self.total} tiles "
+                f"({100 * self.done / self.total if self.total else 100:.1f}%), {rate:.0f} tiles/s, ETA {eta}, "
+                f"{self.errors} errors")
+
+
+class SeedAborted(Exception):
+    """
+    Too many consecutive errors, like maxconsecutive_errors of tilecloud-chain.
+    """
+
+
+def seed(options: SeedOptions, bbox, zooms: range, dimensions: list[str], processes: int, checkpoint_path: str,
+         max_consecutive_errors: int, batch_size: int = 16, report_every: float = 10.0) -> int:
+    """
+    Render all the tiles of the layer in bbox for the zooms and dimensions, skipping the chunks of the checkpoint.
+    return: the number of chunks in error
+    raise: SeedAborted after more than max_consecutive_errors chunks in error in a row.
+    """
+    table = get_tile_matrix_set(options.grid).table
+    done = load_checkpoint(checkpoint_path)
+    errors = 0
+    consecutive_errors = 0
+    with open(checkpoint_path, "a", encoding="utf-8") as checkpoint, \
+            ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(options,)) as pool:
+        if checkpoint.tell() == 0:
+            checkpoint.write(get_checkpoint_header(options, bbox) + "\n")
+
+        def handle(future: Future, progress: ZoomProgress):
+            nonlocal errors, consecutive_errors
+            for result in future.result():
+                if result.error is not None:
+                    errors += 1
+                    consecutive_errors += 1
+                    progress.errors += 1
+                    logger.error(f"{result.dimension} {result.chunk}: {result.error}")
+                    if consecutive_errors > max_consecutive_errors:
+                        raise SeedAborted(f"{consecutive_errors} consecutive errors, the last one: {result.error}")
+                    continue
+                consecutive_errors = 0
+                progress.done += result.chunk.count
+                progress.rendered += result.chunk.count
+                checkpoint.write(f"{result.dimension} {result.chunk.zoom} {result.chunk.min_col} "
+                                 f"{result.chunk.min_row}\n")
+            checkpoint.flush()
+
+        for dimension in dimensions:
+            for zoom in zooms:
+                tile_range = table.get_tile_range(bbox, zoom)
+                if tile_range is None:
+                    continue
+                progress = ZoomProgress(dimension, zoom, tile_range.count)
+                todo = []
+                for chunk in iter_meta_tile_ranges(tile_range, options.meta_size):
+                    if (dimension, zoom, chunk.min_col, chunk.min_row) in done:
+                        progress.done += chunk.count
+                    else:
+                        todo.append(chunk)
+                if progress.done:
+                    logger.info(f"{dimension} zoom {zoom}: resuming, {progress.done} tiles already done")
+                pending: set[Future] = set()
+                last_report = time.monotonic()
+                try:
+                    for batch in _batched(todo, batch_size):
+                        # a bounded window of batches keeps every process busy without queuing the whole zoom
+                        while len(pending) >= 2 * processes:
+                            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                            for future in finished:
+                                handle(future, progress)
+                        pending.add(pool.submit(_seed_batch, [(dimension, chunk) for chunk in batch]))
+                        if time.monotonic() - last_report >= report_every:
+                            logger.info(progress.report())
+                            last_report = time.monotonic()
+                    while pending:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            handle(future, progress)
+                except BaseException:
+                    pool.shutdown(cancel_futures=True)
+                    raise
+                logger.info(progress.report())
+    return errors
+
+
+def main(argv: list[str] | None = None) -> int:
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    # one line per GetMap would drown the progress
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    parser = argparse.ArgumentParser(description="Pre-generate the tiles of a layer of the tilecloud-chain config.")
+    parser.add_argument("layer", help="name of the layer in the tilecloud-chain configuration")
+    parser.add_argument("--zoom", help="zoom level or range like 3-7, defaults to all the zooms of the grid")
+    parser.add_argument("--bbox", type=float, nargs=4, metavar=("X_MIN", "Y_MIN", "X_MAX", "Y_MAX"),
+                        help="defaults to the bbox of the layer")
+    parser.add_argument("--dimension", action="append", help="dimension value, defaults to the generate list")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--concurrency", type=int, default=4, help="metatiles fetched at once by each process")
+    parser.add_argument("--store", choices=TILE_STORE_TYPES, default=os.getenv("TILE_STORE", "directory"))
+    parser.add_argument("--cache-dir", help="defaults to TILE_CACHE_DIR or the default cache of the config")
+    parser.add_argument("--checkpoint", help="defaults to seed_<layer>_<digest of the bbox, metatile size and "
+                                             "store>.checkpoint")
+    args = parser.parse_args(argv)
+
+    config = load_tilecloud_config()
+    register_tilecloud_grids(config)
+    try:
+        layer_config = get_layer_config(config, args.layer)
+        options = get_seed_options(config, args.layer, args.store, args.cache_dir, args.concurrency)
+        table = get_tile_matrix_set(options.grid).table
+        zooms = parse_zooms(args.zoom, table, layer_config.get("min_resolution_seed"))
+        bbox = args.bbox or layer_config.get("bbox") or get_tile_matrix_set(options.grid).bbox
+        if bbox is None:
+            raise ValueError(f"No bbox for layer {args.layer}, please set --bbox.")
+        checkpoint_path = args.checkpoint or get_checkpoint_path(options, bbox)
+        check_checkpoint(checkpoint_path, get_checkpoint_header(options, bbox))
+    except ValueError as error:
+        parser.error(str(error))
+    max_consecutive_errors = int(config.get("generation", {}).get("maxconsecutive_errors", 10))
+    logger.info(f"seeding {args.layer} on {options.grid}, zooms {zooms.start}-{zooms.stop - 1}, bbox {list(bbox)}, "
+                f"into the {options.store_type} store {options.cache_folder}")
+    try:
+        errors = seed(options, bbox, zooms, args.dimension or get_dimension_values(layer_config), args.processes,
+                      checkpoint_path, max_consecutive_errors)
+    except SeedAborted as error:
+        logger.error(f"aborted: {error}")
+        return 2
+    if errors:
+        logger.warning(f"{errors} chunks in error, run the same command again to retry them")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+import asyncio
+import io
+import logging
+from typing import NamedTuple
+
+import numpy as np
+from PIL import Image
+
+from app.cache.memoryCache import MemoryTileCache
+from app.layerRegistry import Layer
+from app.tileService import TileService
+from app.wms.singleFlight import SingleFlight
+from app.wmts.tileMatrix import TileRange
+from app.wmts.tileMatrixSet import get_tile_matrix_set
+from app.wmts.utils import TileKey
+
+logger = logging.getLogger(__name__)
+
+# extension -> (Pillow format, mime type) of the composited tiles
+COMPOSITE_FORMATS = {"png": ("PNG", "image/png"), "webp": ("WEBP", "image/webp")}
+MAX_COMPOSITE_LAYERS = 8
+
+
+class CompositeKey(NamedTuple):
+    """
+    Identifies one composited tile: the layers from the bottom to the top, with the dimension of each one.
+    """
+    layers: tuple[str, ...]
+    dimensions: tuple[str, ...]
+    image_format: str
+    matrix_set: str
+    zoom: int
+    col: int
+    row: int
+
+
+def composite_tiles(tiles: list[bytes], width: int, height: int) -> np.ndarray:
+    """
+    Blend tiles with the Porter-Duff 'over' operator, the first one at the bottom.
+    The layers below the topmost fully opaque tile are hidden, they are not decoded at all.
+    return: (height, width, 4) uint8 RGBA array, transparent if there is no tile.
+    """
+    images = []
+    for data in reversed(tiles):
+        with Image.open(io.BytesIO(data)) as image:
+            rgba = np.asarray(image.convert("RGBA"), dtype=np.float32) / 255.0
+        images.append(rgba)
+        if rgba[..., 3].min() >= 1.0:
+            break
+    # premultiplied alpha, composited from the lowest visible layer up
+    out = np.zeros((height, width, 4), dtype=np.float32)
+    for rgba in reversed(images):
+        alpha = rgba[..., 3:4]
+        out[..., :3] = rgba[..., :3] * alpha + out[..., :3] * (1.0 - alpha)
+        out[..., 3:4] = alpha + out[..., 3:4] * (1.0 - alpha)
+    alpha = out[..., 3:4]
+    np.divide(out[..., :3], alpha, out=out[..., :3], where=alpha > 0)
+    return np.rint(out * 255.0).astype(np.uint8)
+
+
+def encode_composite(rgba: np.ndarray, image_format: str) -> bytes:
+    """
+    Encode a composited RGBA array, the WebP tiles are lossless like the PNG ones.
+    """
+    buffer = io.BytesIO()
+    pil_format = COMPOSITE_FORMATS[image_format][0]
+    options = {"lossless": True} if pil_format == "WEBP" else {}
+    Image.fromarray(rgba, "RGBA").save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def _blend(tiles: list[bytes], width: int, height: int, image_format: str) -> bytes:
+    return encode_composite(composite_tiles(tiles, width, height), image_format)
+
+
+class TileCompositor:
+    """
+    Blends the tiles of several layers into one, for the clients stacking a base map and overlays.
+    The tile of each layer comes through the TileService, so it is rendered and cached like a single layer tile,
+    and the composited tiles are kept in their own memory_cache, by layer list.
+    The layers out of their coverage are left out, they would only add transparent pixels.
+    """
+
+    def __init__(self, tile_service: TileService, memory_cache: MemoryTileCache | None = None):
+        self.tile_service = tile_service
+        self.memory_cache = memory_cache
+        self.single_flight = SingleFlight("composites")
+
+    @staticmethod
+    def get_key(layers: list[Layer], image_format: str, zoom: int, col: int, row: int,
+                dimensions: list[str | None] | None = None) -> CompositeKey:
+        """
+        param: dimensions: the value of the dimension of each layer, None for its default one,
+        a single value is used for all the layers.
+        raise: ValueError if the layers are not on the same grid or if the format, the dimensions or the tile
+        are not valid.
+        """
+        if not 0 < len(layers) <= MAX_COMPOSITE_LAYERS:
+            raise ValueError(f"Please choose between 1 and {MAX_COMPOSITE_LAYERS} layers.")
+        if image_format not in COMPOSITE_FORMATS:
+            raise ValueError(f"Unsupported format {image_format}. Please choose one of {', '.join(COMPOSITE_FORMATS)}.")
+        if not dimensions:
+            dimensions = [None] * len(layers)
+        elif len(dimensions) == 1:
+            dimensions = dimensions * len(layers)
+        elif len(dimensions) != len(layers):
+            raise ValueError(f"Please give one dimension for all the layers or one by layer, "
+                             f"not {len(dimensions)} for {len(layers)} layers.")
+        grid = layers[0].grid
+        checked = []
+        for layer, dimension in zip(layers, dimensions):
+            if layer.grid != grid:
+                raise ValueError(f"Layer {layer.name} is on grid {layer.grid}, not {grid} like {layers[0].name}.")
+            checked.append(layer.check_dimension(dimension))
+            layer.check_get_map()
+        get_tile_matrix_set(grid).table.get_tile_bbox(zoom, col, row)
+        return CompositeKey(tuple(layer.name for layer in layers), tuple(checked), image_format, grid, zoom, col, row)
+
+    async def get_tile(self, key: CompositeKey, layers: list[Layer]) -> bytes:
+        """
+        Get the composited tile of a key made by get_key for these layers.
+        raise: WmsError if the backend fails for one of the layers.
+        """
+        if self.memory_cache is not None:
+            tile = self.memory_cache.get(key)
+            if tile is not None:
+                return tile
+        return await self.single_flight.do(key, lambda: self._composite(key, layers))
+
+    async def _composite(self, key: CompositeKey, layers: list[Layer]) -> bytes:
+        tiles = await asyncio.gather(*(self._get_layer_tile(layer, dimension, key)
+                                       for layer, dimension in zip(layers, key.dimensions)))
+        table = get_tile_matrix_set(key.matrix_set).table
+        tile = await asyncio.to_thread(_blend, [t for t in tiles if t is not None], table.tile_width,
+                                       table.tile_height, key.image_format)
+        if self.memory_cache is not None:
+            self.memory_cache.put(key, tile)
+        return tile
+
+    async def _get_layer_tile(self, layer: Layer, dimension: str, key: CompositeKey) -> bytes | None:
+        if not layer.coverage.contains(key.zoom, key.col, key.row):
+            return None
+        tile_key = TileKey(layer.name, dimension, layer.grid, key.zoom, key.col, key.row)
+        tile = self.tile_service.get_memory_tile(tile_key)
+        if tile is None:
+            tile = await self.tile_service.get_tile(tile_key, layer.check_get_map(dimension))
+        return tile
+
+    def invalidate(self, layer: str, dimension: str, tile_ranges: list[TileRange], contains=None) -> int:
+        """
+        Remove the composited tiles made with tiles of a layer and dimension inside ranges, like TileService.invalidate.
+        param: contains: (zoom, col, row) -> bool, to keep only the tiles of a geometry within the ranges.
+        return: the number of composited tiles removed.
+        """
+        if self.memory_cache is None:
+            return 0
+        by_zoom = {tile_range.zoom: tile_range for tile_range in tile_ranges}
+        keys = []
+        for key in self.memory_cache.keys():
+            tile_range = by_zoom.get(key.zoom)
+            if (tile_range is not None and (layer, dimension) in zip(key.layers, key.dimensions)
+                    and tile_range.min_col <= key.col <= tile_range.max_col
+                    and tile_range.min_row <= key.row <= tile_range.max_row
+                    and (contains is None or contains(key.zoom, key.col, key.row))):
+                keys.append(key)
+        return sum(self.memory_cache.delete(key) for key in keys)
+
+    def stats(self) -> dict:
+        stats = self.single_flight.stats()
+        if self.memory_cache is not None:
+            stats["memory_cache"] = self.memory_cache.stats()
+        return stats
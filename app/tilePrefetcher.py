@@ -0,0 +1,82 @@
+import asyncio
+import logging
+
+from app.tileService import TileService
+from app.wms.wms import GetMapTemplate, WmsError
+from app.wmts.utils import TileKey
+
+logger = logging.getLogger(__name__)
+
+
+class TilePrefetcher:
+    """
+    Warms the caches with the tiles a client is likely to ask next, with a few background workers.
+    The queue is bounded: when it is full the rest of the tiles are given up, prefetching never delays the tiles
+    requested for real, nor piles up behind a slow backend. A tile already queued is not queued again.
+    """
+
+    def __init__(self, tile_service: TileService, workers: int = 4, max_queued: int = 1024):
+        self.tile_service = tile_service
+        self.scheduled = 0
+        self.truncated = 0
+        self.fetched = 0
+        self.errors = 0
+        self._queue: asyncio.Queue[tuple[TileKey, GetMapTemplate]] = asyncio.Queue(max_queued)
+        self._queued: set[TileKey] = set()
+        self._workers = [asyncio.create_task(self._work()) for _ in range(workers)]
+
+    def schedule(self, keys, get_map: GetMapTemplate) -> int:
+        """
+        Queue tiles of a layer to be fetched in the background, in order, as long as there is room.
+        param: keys: iterable of TileKey, read only until the queue is full.
+        return: the number of tiles queued.
+        """
+        queued = 0
+        for key in keys:
+            if key in self._queued:
+                continue
+            try:
+                self._queue.put_nowait((key, get_map))
+            except asyncio.QueueFull:
+                self.truncated += 1
+                break
+            self._queued.add(key)
+            queued += 1
+        self.scheduled += queued
+        return queued
+
+    async def _work(self):
+        while True:
+            key, get_map = await self._queue.get()
+            try:
+                await self._prefetch(key, get_map)
+            except (ValueError, WmsError) as error:
+                self.errors += 1
+                logger.debug(f"prefetching {key} failed: {error}")
+            except Exception as error:
+                self.errors += 1
+                logger.error(f"prefetching {key} failed: {error!r}")
+            finally:
+                self._queued.discard(key)
+                self._queue.task_done()
+
+    async def _prefetch(self, key: TileKey, get_map: GetMapTemplate):
+        memory_cache = self.tile_service.memory_cache
+        if memory_cache is not None and key in memory_cache:
+            return
+        # a cached file is only read into the memory cache, the others are rendered and stored
+        if self.tile_service.get_cached_file(key) is None:
+            await self.tile_service.get_tile(key, get_map, file_checked=True)
+            self.fetched += 1
+
+    async def aclose(self):
+        """
+        Stop the workers, the tiles still queued are given up.
+        """
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {"scheduled": self.scheduled, "truncated": self.truncated, "fetched": self.fetched,
+                "errors": self.errors, "queued": self._queue.qsize()}
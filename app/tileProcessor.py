@@ -0,0 +1,177 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Hashable
+
+import numpy as np
+from PIL import Image
+
+from app.cache.memoryCache import MemoryTileCache
+
+logger = logging.getLogger(__name__)
+
+# extension -> (Pillow format, mime type) of the variants a tile can be transcoded to
+VARIANT_FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg")}
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def optimize_png(data: bytes) -> bytes:
+    """
+    Re-encode a png losslessly, like optipng of the process: section of tilecloud-chain:
+    the RGB(A) tiles with at most 256 colors become exact palette images, then zlib compresses at its best level.
+    return: the smallest of the original and the optimized png, the other formats are returned as is.
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        return data
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+    if image.mode in ("RGB", "RGBA") and image.getcolors(256) is not None:
+        pixels = np.asarray(image.convert("RGBA"))
+        packed = pixels.view(np.uint32).reshape(pixels.shape[:2])
+        colors, indices = np.unique(packed, return_inverse=True)
+        palette = colors.view(np.uint8).reshape(-1, 4)
+        image = Image.fromarray(indices.reshape(packed.shape).astype(np.uint8), "P")
+        image.putpalette(palette[:, :3].tobytes())
+        if palette[:, 3].min() < 255:
+            image.info["transparency"] = palette[:, 3].tobytes()
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG", optimize=True)
+    optimized = buffer.getvalue()
+    return optimized if len(optimized) < len(data) else data
+
+
+def optimize_pngs(tiles: list[bytes]) -> list[bytes]:
+    return [optimize_png(data) for data in tiles]
+
+
+def transcode(data: bytes, image_format: str, quality: int = 85) -> bytes | None:
+    """
+    Transcode a tile to one of the VARIANT_FORMATS.
+    return: the transcoded tile, None for JPEG when the tile is not fully opaque: JPEG has no alpha channel,
+            the transparent parts would hide the layers below in the clients.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGBA")
+    buffer = io.BytesIO()
+    if image_format == "jpeg":
+        if image.getchannel("A").getextrema()[0] < 255:
+            return None
+        image.convert("RGB").save(buffer, "JPEG", quality=quality, optimize=True)
+    else:
+        image.save(buffer, VARIANT_FORMATS[image_format][0], quality=quality, method=4)
+    return buffer.getvalue()
+
+
+def choose_tile_format(accept: str | None, original: str, variants) -> str:
+    """
+    Choose the format of a tile from an Accept header: a variant is served only when the client names it
+    explicitly with a q-value higher than (or equal to) the one of the original format, image/* and */*
+    only give the original. The variant with the highest q-value wins, WebP over JPEG at the same q-value.
+    return: the extension of the format, original when no variant is better.
+    """
+    accepted = {}
+    for item in (accept or "").split(","):
+        mime, _, params = item.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[mime.strip().lower()] = q
+    if not accepted:
+        return original
+    original_q = accepted.get(f"image/{original}", max(accepted.get("image/*", 0.0), accepted.get("*/*", 0.0)))
+    candidates = [(accepted.get(VARIANT_FORMATS[extension][1], 0.0), extension) for extension in ("webp", "jpeg")
+                  if extension in variants and extension != original]
+    candidates = [(q, extension) for q, extension in candidates if q > 0 and q >= original_q]
+    if not candidates:
+        return original
+    # max keeps the first of the equal q-values, webp
+    return max(candidates, key=lambda candidate: candidate[0])[1]
+
+
+class TileProcessor:
+    """
+    The post-processing of the tiles, in a pool of worker processes so the event loop never encodes an image:
+    - the rendered png tiles are optimized in the background, the raw tile is answered at once and its
+      cached copies are replaced by the optimized one when it is smaller;
+    - the tiles are transcoded on demand to the variants accepted by the client, each variant is kept
+      in its own memory cache by (tile key, format).
+    """
+
+    def __init__(self, max_workers: int = 2, variants=("webp", "jpeg"), variant_cache_max_bytes: int = 0,
+                 quality: int = 85):
+        self.variants = tuple(v for v in variants if v in VARIANT_FORMATS)
+        self.quality = quality
+        self.variant_cache = MemoryTileCache(variant_cache_max_bytes) if variant_cache_max_bytes > 0 else None
+        self.optimized = 0
+        self.saved_bytes = 0
+        self.transcoded = 0
+        self.max_workers = max_workers
+        self._executor = self._new_executor()
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # the pool is created in a running event loop, with the threads of asyncio.to_thread alive:
+        # forking them could copy a held lock into the workers, they start from a clean forkserver instead
+        return ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("forkserver"))
+
+    async def _run(self, function, *args):
+        executor = self._executor
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+        except BrokenProcessPool:
+            # a worker died, e.g. killed by the OOM killer: the next calls get a new pool
+            if self._executor is executor:
+                logger.error("the tile processing pool is broken, starting a new one")
+                self._executor = self._new_executor()
+                executor.shutdown(wait=False)
+            raise
+
+    async def optimize(self, tiles: list[bytes]) -> list[bytes]:
+        """
+        Optimize a batch of png tiles in one worker, the tiles sharing the same bytes object
+        (a uniform metatile) are optimized once.
+        return: the tiles in the same order, each one the same object as before when it was not improved.
+        """
+        unique = list({id(data): data for data in tiles}.values())
+        optimized = await self._run(optimize_pngs, unique)
+        by_id = {}
+        for before, after in zip(unique, optimized):
+            if len(after) < len(before):
+                self.optimized += 1
+                self.saved_bytes += len(before) - len(after)
+                by_id[id(before)] = after
+        return [by_id.get(id(data), data) for data in tiles]
+
+    async def get_variant(self, key: Hashable, data: bytes, image_format: str) -> bytes | None:
+        """
+        Get a tile in one of the variants, transcoded only on the first request.
+        param: key: identifies the tile, usually its TileKey.
+        return: the variant, None when the tile has none, like the JPEG of a tile with transparency.
+        """
+        variant_key = (key, image_format)
+        if self.variant_cache is not None:
+            variant = self.variant_cache.get(variant_key)
+            if variant is not None:
+                # an empty variant marks the tiles that have none
+                return variant or None
+        variant = await self._run(transcode, data, image_format, self.quality)
+        self.transcoded += 1
+        if self.variant_cache is not None:
+            self.variant_cache.put(variant_key, variant or b"")
+        return variant
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+
+    def stats(self) -> dict:
+        stats = {"optimized": self.optimized, "saved_bytes": self.saved_bytes, "transcoded": self.transcoded}
+        if self.variant_cache is not None:
+            stats["variant_cache"] = self.variant_cache.stats()
+        return stats
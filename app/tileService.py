@@ -0,0 +1,273 @@
+import asyncio
+import logging
+
+from app.cache.memoryCache import MemoryTileCache
+from app.cache.tileIndex import TileIndex
+from app.cache.tileStore import TileSignature, TileStore
+from app.tileProcessor import TileProcessor
+from app.wms.metaTile import MetaTileRenderer
+from app.wms.singleFlight import SingleFlight
+from app.wms.wms import GetMapTemplate, WmsClient
+from app.wmts.tileMatrix import TileRange
+from app.wmts.tileMatrixSet import get_tile_matrix_set
+from app.wmts.utils import TileKey
+
+logger = logging.getLogger(__name__)
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class TileService:
+    """
+    The tile fetch path shared by all the endpoints and layers: concurrent requests for the same tile
+    are coalesced into one fetch. With a MetaTileRenderer, the layers of meta_settings, (meta_size, meta_buffer)
+    by layer name, are rendered by metatile, the other ones tile by tile.
+    With a tile_store (the directory cache or MBTiles files), every rendered tile (all the tiles of a metatile)
+    is written to it in the background. The routes send the hits of a directory cache themselves with
+    get_cached_file, the other stores are read by get_tile.
+    The memory_cache in front of both keeps the hot tiles: every fetched tile goes in, and so do the file hits,
+    read in the background while the file itself is being sent.
+    Identical tiles are kept once by the memory_cache, by the mbtiles store across the vintages of a layer and by
+    the directory-linked store, which hard-links them to one blob; the directory store writes a file per tile.
+    The empty_tiles and empty_metatiles signatures by layer (the empty_tile_detection of tilecloud-chain) recognize
+    the empty tiles without decoding them: like tilecloud-chain, they are not stored in any cache. The empty_index
+    remembers them instead, they are answered with the empty tile of their layer without asking the backend again.
+    The grid of a tile is the registered TileMatrixSet named by the matrix_set of its key.
+    With a tile_processor, the rendered tiles are answered as they are and optimized in the background:
+    the optimized tiles are the ones written to the tile_store, and replace their copy in the memory_cache.
+    The tile_index knows the tiles present in the caches, the ones of the tile_store once index_store ran
+    and all the tiles fetched since. invalidate also asks the tile_store and the memory_cache for the tiles of
+    the ranges, the index misses the tiles written by other processes, like the seeding or the other workers.
+    """
+
+    def __init__(self, wms_client: WmsClient, meta_tile_renderer: MetaTileRenderer | None = None,
+                 tile_store: TileStore | None = None, memory_cache: MemoryTileCache | None = None,
+                 empty_tiles: dict[str, TileSignature] | None = None,
+                 empty_metatiles: dict[str, TileSignature] | None = None,
+                 tile_processor: TileProcessor | None = None,
+                 meta_settings: dict[str, tuple[int, int]] | None = None):
+        self.wms_client = wms_client
+        self.meta_tile_renderer = meta_tile_renderer
+        self.tile_store = tile_store
+        self.memory_cache = memory_cache
+        self.empty_tiles = empty_tiles or {}
+        self.empty_metatiles = empty_metatiles or {}
+        self.tile_processor = tile_processor
+        self.meta_settings = meta_settings or {}
+        self.tile_index = TileIndex()
+        self.empty_index = TileIndex()
+        # an empty tile by layer, the answer to all the tiles of the empty_index
+        self._empty_data: dict[str, bytes] = {}
+        self.single_flight = SingleFlight("tiles")
+        self._pending_writes: set[asyncio.Task] = set()
+        self._promoting: dict[TileKey, asyncio.Task] = {}
+
+    def get_memory_tile(self, key: TileKey) -> bytes | None:
+        """
+        Get a tile from the memory cache, without validating the key: only valid tiles are ever stored.
+        return: the tile bytes, or None on a miss or without memory cache.
+        """
+        if self.memory_cache is None:
+            return None
+        return self.memory_cache.get(key)
+
+    def get_cached_file(self, key: TileKey) -> str | None:
+        """
+        Get the path of a tile in a directory cache, without validating the key: only valid tiles are ever written.
+        return: the path, or None on a miss or when the tiles are not stored as files.
+        """
+        if self.tile_store is None:
+            return None
+        path = self.tile_store.get_file(key)
+        if path is not None and self.memory_cache is not None and key not in self._promoting:
+            task = asyncio.create_task(self._promote(key, path))
+            self._promoting[key] = task
+            task.add_done_callback(lambda _: self._promoting.pop(key, None))
+        return path
+
+    async def _promote(self, key: TileKey, path: str):
+        try:
+            data = await asyncio.to_thread(_read_file, path)
+        except OSError as error:
+            logger.warning(f"reading {path} for the memory cache failed: {error!r}")
+            return
+        self.memory_cache.put(key, data)
+
+    async def get_tile(self, key: TileKey, get_map: GetMapTemplate, file_checked: bool = False) -> bytes:
+        """
+        Get the png of a tile.
+        param: get_map: the GetMap of the layer of the key.
+        param: file_checked: True when the caller already looked for the tile file with get_cached_file.
+        raise: ValueError if the tile is not valid, WmsError if the backend fails.
+        """
+        # validate before coalescing, so invalid requests never wait on anything
+        get_tile_matrix_set(key.matrix_set).table.get_tile_bbox(key.zoom, key.col, key.row)
+        if key in self.empty_index:
+            return self._empty_data[key.layer]
+        return await self.single_flight.do(key, lambda: self._fetch(key, get_map, file_checked))
+
+    async def _fetch(self, key: TileKey, get_map: GetMapTemplate, file_checked: bool) -> bytes:
+        if self.tile_store is not None and not (file_checked and self.tile_store.stores_files):
+            tile = await asyncio.to_thread(self.tile_store.get, key)
+            if tile is not None:
+                if self.memory_cache is not None:
+                    self.memory_cache.put(key, tile)
+                return tile
+        table = get_tile_matrix_set(key.matrix_set).table
+        meta_settings = self.meta_settings.get(key.layer)
+        if self.meta_tile_renderer is not None and meta_settings is not None:
+            def on_rendered(meta_range: TileRange, tiles: dict[tuple[int, int], bytes], empty: bool):
+                self._rendered({key._replace(col=col, row=row): data for (col, row), data in tiles.items()}, empty)
+            tile = await self.meta_tile_renderer.get_tile(get_map, table, key.zoom, key.col, key.row, *meta_settings,
+                                                          on_rendered=on_rendered,
+                                                          empty_metatile=self.empty_metatiles.get(key.layer))
+            self._fetched(key, tile)
+            return tile
+        wms_url = get_map.get_url(table.get_tile_bbox(key.zoom, key.col, key.row), table.tile_width, table.tile_height)
+        logger.debug('Fetching wms image: %s', wms_url)
+        tile = await self.wms_client.get_image(wms_url, get_map.headers)
+        self._rendered({key: tile})
+        self._fetched(key, tile)
+        return tile
+
+    def _fetched(self, key: TileKey, tile: bytes):
+        if self.memory_cache is not None and key not in self.empty_index:
+            self.memory_cache.put(key, tile)
+
+    def _rendered(self, tiles: dict[TileKey, bytes], empty: bool = False):
+        """
+        Index and store the tiles of a GetMap, all of the same layer, but the empty ones.
+        param: empty: True when they are the tiles of an empty metatile.
+        """
+        signature = self.empty_tiles.get(next(iter(tiles)).layer)
+        if empty or signature is not None:
+            # the tiles of a uniform metatile share their bytes, they are checked once
+            matches: dict[int, bool] = {}
+            empties = {key for key, data in tiles.items()
+                       if empty or matches.setdefault(id(data), signature.matches(data))}
+            if empties:
+                self.empty_index.add_many(empties)
+                key = next(iter(empties))
+                self._empty_data.setdefault(key.layer, tiles[key])
+                tiles = {key: data for key, data in tiles.items() if key not in empties}
+                if not tiles:
+                    return
+        self.tile_index.add_many(tiles)
+        # the response does not wait for the disk, requests arriving meanwhile still hit the metatile renderer
+        if self.tile_processor is not None:
+            task = asyncio.create_task(self._post_process(tiles))
+        elif self.tile_store is not None:
+            task = asyncio.create_task(asyncio.to_thread(self.tile_store.put_many, tiles))
+        else:
+            return
+        self._pending_writes.add(task)
+        task.add_done_callback(self._stored)
+
+    async def _post_process(self, tiles: dict[TileKey, bytes]):
+        try:
+            optimized = dict(zip(tiles, await self.tile_processor.optimize(list(tiles.values()))))
+        except Exception as error:
+            # a tile that cannot be optimized is still stored, as rendered
+            logger.warning(f"optimizing {len(tiles)} tiles failed, storing them as rendered: {error!r}")
+            optimized = tiles
+        if self.memory_cache is not None:
+            for key, data in optimized.items():
+                if data is not tiles[key] and key in self.memory_cache:
+                    self.memory_cache.put(key, data)
+        if self.tile_store is not None:
+            await asyncio.to_thread(self.tile_store.put_many, optimized)
+
+    def _stored(self, task: asyncio.Task):
+        self._pending_writes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"post-processing or writing tiles to the tile store failed: {task.exception()!r}")
+
+    def index_store(self) -> int:
+        """
+        Add the tiles of the tile_store to the tile_index. Blocking, run it in a thread at startup.
+        return: the number of tiles indexed.
+        """
+        if self.tile_store is None:
+            return 0
+        count = 0
+        for key in self.tile_store.iter_keys():
+            self.tile_index.add(key)
+            count += 1
+        logger.info(f"tile index: {count} stored tiles")
+        return count
+
+    async def invalidate(self, layer: str, dimension: str, matrix_set: str, tile_ranges: list[TileRange],
+                         contains=None, get_map: GetMapTemplate | None = None) -> dict:
+        """
+        Remove the tiles of a layer inside ranges from all the caches, only the tiles present are touched:
+        the indexed ones, and the ones the tile_store and the memory_cache hold in the ranges.
+        The known empty tiles are forgotten too, they are asked to the backend again.
+        The rendering in flight is not interrupted, a tile being written right now may be stored after this.
+        param: contains: (zoom, col, row) -> bool, to keep only the tiles of a geometry within the ranges.
+        param: get_map: the GetMap of the layer, its kept metatiles are dropped too.
+        return: the number of tiles found and removed by cache tier.
+        """
+        indexed = {key for tile_range in tile_ranges
+                   for key in self.tile_index.query(layer, dimension, matrix_set, tile_range)}
+        empties = [key for tile_range in tile_ranges
+                   for key in self.empty_index.query(layer, dimension, matrix_set, tile_range)
+                   if contains is None or contains(key.zoom, key.col, key.row)]
+        for key in empties:
+            self.empty_index.discard(key)
+        keys = set(indexed)
+        # the tiles promoted from files are in the memory_cache without being indexed
+        if self.memory_cache is not None:
+            keys.update(self._find_keys(self.memory_cache, layer, dimension, matrix_set, tile_ranges))
+        if self.tile_store is not None:
+            keys.update(await asyncio.to_thread(self._find_keys, self.tile_store, layer, dimension, matrix_set,
+                                                tile_ranges))
+        if contains is not None:
+            keys = {key for key in keys if contains(key.zoom, key.col, key.row)}
+        removed = {"indexed": len(indexed & keys), "found": len(keys), "empty": len(empties), "memory_cache": 0,
+                   "tile_store": 0, "variants": 0, "meta_tiles": 0}
+        for key in keys:
+            self.tile_index.discard(key)
+            if self.memory_cache is not None:
+                removed["memory_cache"] += self.memory_cache.delete(key)
+        variant_cache = self.tile_processor.variant_cache if self.tile_processor is not None else None
+        if variant_cache is not None:
+            removed["variants"] = sum(variant_cache.delete((key, variant)) for key in [*keys, *empties]
+                                      for variant in self.tile_processor.variants)
+        if self.meta_tile_renderer is not None and get_map is not None:
+            removed["meta_tiles"] = self.meta_tile_renderer.forget(get_map)
+        if self.tile_store is not None and keys:
+            removed["tile_store"] = await asyncio.to_thread(self.tile_store.delete_many, keys)
+        return removed
+
+    @staticmethod
+    def _find_keys(store: TileStore, layer: str, dimension: str, matrix_set: str,
+                   tile_ranges: list[TileRange]) -> list[TileKey]:
+        return [key for tile_range in tile_ranges
+                for key in store.iter_keys_in_range(layer, dimension, matrix_set, tile_range)]
+
+    async def aclose(self):
+        """
+        Wait for the pending cache writes and close the tile store.
+        """
+        pending = [*self._pending_writes, *self._promoting.values()]
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        if self.tile_store is not None:
+            await asyncio.to_thread(self.tile_store.close)
+
+    def stats(self) -> dict:
+        stats = {"tiles": self.single_flight.stats() | {"empty": len(self.empty_index)}}
+        if self.memory_cache is not None:
+            stats["memory_cache"] = self.memory_cache.stats()
+        if self.meta_tile_renderer is not None:
+            stats["meta_tiles"] = self.meta_tile_renderer.stats()
+        stats["tile_index"] = self.tile_index.stats()
+        if self.tile_processor is not None:
+            stats["tile_processor"] = self.tile_processor.stats()
+        if self.tile_store is not None:
+            stats["tile_store"] = ({"type": type(self.tile_store).__name__} | self.tile_store.stats()
+                                   | {"pending_writes": len(self._pending_writes)})
+        return stats
@@ -0,0 +1,171 @@
+import asyncio
+import io
+import logging
+from collections import OrderedDict
+from typing import Callable, Iterator
+
+from PIL import Image
+
+from app.cache.tileStore import TileSignature
+from app.wms.singleFlight import SingleFlight
+from app.wms.wms import GetMapTemplate, WmsClient, add_gutter
+from app.wmts.tileMatrix import TileMatrixTable, TileRange
+
+logger = logging.getLogger(__name__)
+
+# the meta_size and meta_buffer of tilecloud-chain for the layers with meta: true that do not set them
+META_SIZE = 8
+META_BUFFER = 128
+
+
+def get_meta_settings(layer_config: dict) -> tuple[int, int]:
+    """
+    Get the metatiles of a layer of the tilecloud-chain configuration, the service and the seeding read them here
+    so that both cut the same metatiles.
+    return: (meta_size, meta_buffer), (1, 0) for the layers without meta: true, rendered tile by tile.
+    """
+    if not layer_config.get("meta", False):
+        return 1, 0
+    return int(layer_config.get("meta_size", META_SIZE)), int(layer_config.get("meta_buffer", META_BUFFER))
+
+
+def get_meta_tile_range(tile_matrix: TileMatrixTable, zoom: int, col: int, row: int, meta_size: int) -> TileRange:
+    """
+    Get the metatile containing a tile: the meta_size x meta_size block aligned on multiples of meta_size,
+    clipped to the matrix.
+    raise: ValueError if the tile is not valid.
+    """
+    tile_matrix.get_tile_bbox(zoom, col, row)  # validates zoom, col and row
+    i = tile_matrix.check_zoom(zoom)
+    min_col = col - col % meta_size
+    min_row = row - row % meta_size
+    return TileRange(zoom, min_col, min_row, min(min_col + meta_size, tile_matrix.matrix_widths[i]) - 1,
+                     min(min_row + meta_size, tile_matrix.matrix_heights[i]) - 1)
+
+
+def iter_meta_tile_ranges(tile_range: TileRange, meta_size: int) -> Iterator[TileRange]:
+    """
+    Split a range of tiles into the parts of the metatiles it intersects, row of metatiles by row of metatiles.
+    Each part is aligned on the metatile grid, so it is rendered by a single GetMap.
+    """
+    first_col = tile_range.min_col - tile_range.min_col % meta_size
+    first_row = tile_range.min_row - tile_range.min_row % meta_size
+    for meta_row in range(first_row, tile_range.max_row + 1, meta_size):
+        for meta_col in range(first_col, tile_range.max_col + 1, meta_size):
+            yield TileRange(tile_range.zoom, max(meta_col, tile_range.min_col), max(meta_row, tile_range.min_row),
+                            min(meta_col + meta_size - 1, tile_range.max_col),
+                            min(meta_row + meta_size - 1, tile_range.max_row))
+
+
+def slice_meta_tile(image_bytes: bytes, meta_range: TileRange, gutter: int, tile_width: int, tile_height: int,
+                    image_format: str = 'png', empty_metatile: TileSignature | None = None) -> dict[tuple[int, int], bytes]:
+    """
+    Cut a rendered metatile image into its tiles, dropping the gutter around it.
+    An empty metatile (matching empty_metatile) or a uniform one (a lake, a forest fill) is encoded only once,
+    all its tiles share the same bytes object.
+    return: dict of encoded tile bytes by (col, row)
+    """
+    tiles = {}
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image.load()
+        if (empty_metatile is not None and empty_metatile.matches(image_bytes)) or _is_uniform(image):
+            buffer = io.BytesIO()
+            image.crop((gutter, gutter, gutter + tile_width, gutter + tile_height)).save(buffer, format=image_format)
+            tile = buffer.getvalue()
+            return {(col, row): tile for _, col, row in meta_range.tiles()}
+        for _, col, row in meta_range.tiles():
+            left = gutter + (col - meta_range.min_col) * tile_width
+            top = gutter + (row - meta_range.min_row) * tile_height
+            buffer = io.BytesIO()
+            image.crop((left, top, left + tile_width, top + tile_height)).save(buffer, format=image_format)
+            tiles[(col, row)] = buffer.getvalue()
+    return tiles
+
+
+def _is_uniform(image: Image.Image) -> bool:
+    # (min, max) per band, or a single (min, max) for the one band modes like L and P
+    extrema = image.getextrema()
+    if not isinstance(extrema[0], tuple):
+        extrema = (extrema,)
+    return all(low == high for low, high in extrema)
+
+
+class MetaTileRenderer:
+    """
+    Render tiles by metatiles, like tilecloud-chain does with meta: true.
+    A single buffered GetMap covers meta_size x meta_size tiles, it is then cropped into individual tiles.
+    The meta_buffer is a gutter in pixels added on each side, so labels crossing tile edges are not clipped.
+    Both are given with each tile, they are settings of the layers (see get_meta_settings).
+    Concurrent requests for any tile of a metatile being rendered wait for the same GetMap,
+    and the tiles of the last keep_rendered metatiles are kept to answer the requests arriving right after.
+    """
+
+    def __init__(self, client: WmsClient, keep_rendered: int = 4):
+        self.client = client
+        self.keep_rendered = keep_rendered
+        self.single_flight = SingleFlight("meta_tiles")
+        self._rendered: OrderedDict[tuple, dict[tuple[int, int], bytes]] = OrderedDict()
+
+    @staticmethod
+    def get_meta_tile_url(get_map: GetMapTemplate, tile_matrix: TileMatrixTable, meta_range: TileRange,
+                          meta_buffer: int) -> str:
+        t = tile_matrix
+        bbox = add_gutter(t.get_tile_range_bbox(meta_range), meta_buffer, t.cell_sizes[t.check_zoom(meta_range.zoom)])
+        return get_map.get_url(bbox, meta_range.num_cols * t.tile_width + 2 * meta_buffer,
+                               meta_range.num_rows * t.tile_height + 2 * meta_buffer)
+
+    async def get_tile(self, get_map: GetMapTemplate, tile_matrix: TileMatrixTable, zoom: int, col: int, row: int,
+                       meta_size: int = META_SIZE, meta_buffer: int = META_BUFFER, image_format: str = 'png',
+                       on_rendered: Callable[[TileRange, dict[tuple[int, int], bytes], bool], None] | None = None,
+                       empty_metatile: TileSignature | None = None) -> bytes:
+        """
+        Get one tile of a layer, rendering its whole metatile if needed.
+        param: get_map: the GetMap of the layer, in image_format.
+        param: tile_matrix: the grid of the layer.
+        param: meta_size, meta_buffer: the metatiles of the layer.
+        param: empty_metatile: size and hash of the empty metatiles of the layer.
+        param: on_rendered: called once with all the tiles of the metatile when this call triggers its rendering,
+        e.g. to write them to a cache, and True when the metatile matched empty_metatile.
+        raise: ValueError if the tile is not valid, WmsError if the backend fails.
+        """
+        meta_range = get_meta_tile_range(tile_matrix, zoom, col, row, meta_size)
+        key = (get_map.prefix, tile_matrix, meta_range, meta_buffer)
+        tiles = self._rendered.get(key)
+        if tiles is not None:
+            self._rendered.move_to_end(key)
+            return tiles[(col, row)]
+        tiles = await self.single_flight.do(
+            key, lambda: self._render(key, get_map, tile_matrix, meta_range, meta_buffer, image_format, on_rendered,
+                                      empty_metatile))
+        return tiles[(col, row)]
+
+    def forget(self, get_map: GetMapTemplate) -> int:
+        """
+        Drop the kept metatiles of a GetMap, after their tiles were invalidated.
+        return: the number of metatiles dropped.
+        """
+        keys = [key for key in self._rendered if key[0] == get_map.prefix]
+        for key in keys:
+            del self._rendered[key]
+        return len(keys)
+
+    def stats(self) -> dict:
+        return {"kept": len(self._rendered), **self.single_flight.stats()}
+
+    async def _render(self, key: tuple, get_map: GetMapTemplate, tile_matrix: TileMatrixTable, meta_range: TileRange,
+                      meta_buffer: int, image_format: str, on_rendered: Callable | None,
+                      empty_metatile: TileSignature | None) -> dict[tuple[int, int], bytes]:
+        wms_url = self.get_meta_tile_url(get_map, tile_matrix, meta_range, meta_buffer)
+        logger.debug('Fetching wms metatile: %s', wms_url)
+        image_bytes = await self.client.get_image(wms_url, get_map.headers)
+        # decoding and encoding 256 tiles is CPU bound, keep it off the event loop
+        tiles = await asyncio.to_thread(slice_meta_tile, image_bytes, meta_range, meta_buffer,
+                                        tile_matrix.tile_width, tile_matrix.tile_height, image_format,
+                                        empty_metatile)
+        if self.keep_rendered > 0:
+            self._rendered[key] = tiles
+            while len(self._rendered) > self.keep_rendered:
+                self._rendered.popitem(last=False)
+        if on_rendered is not None:
+            on_rendered(meta_range, tiles, empty_metatile is not None and empty_metatile.matches(image_bytes))
+        return tiles
@@ -0,0 +1,58 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    In-process single-flight: concurrent calls with the same key share one execution.
+    The first caller (the leader) starts the work in its own task, the callers arriving while
+    it is running wait on that task instead of starting the same work again.
+    A caller going away does not cancel the work for the others.
+    """
+
+    def __init__(self, name: str = "single_flight"):
+        self.name = name
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.errors = 0
+        self._in_flight: dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, work: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run work() unless a call with the same key is already in flight, then share its result or exception.
+        """
+        self.calls += 1
+        task = self._in_flight.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.ensure_future(work())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._done(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        del self._in_flight[key]
+        # retrieving the exception also avoids the 'exception was never retrieved' warning
+        if task.cancelled() or task.exception() is not None:
+            self.errors += 1
+
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "in_flight": len(self._in_flight),
+            "coalesced_ratio": self.coalesced / self.calls if self.calls else 0.0,
+        }
@@ -1,8 +1,28 @@
+import logging
+from typing import Sequence
+from urllib.parse import urlencode
+
+import httpx
+
 from app.wmts.utils import BBox
 
+logger = logging.getLogger(__name__)
+
+
+class WmsError(Exception):
+    """
+    The WMS backend did not return an image.
+    """
+
 
-def get_wms_params(bbox: BBox, layers: str, gutter:int, width:int=256, height:int=256, image_format:str='png'):
-    return {
+def get_wms_params(bbox: BBox | Sequence[float], layers: str, gutter:int, width:int=256, height:int=256, image_format:str='png',
+                   dimensions: dict[str, str] | None = None):
+    """
+    param: dimensions: the WMTS dimensions of the layer by name, e.g. {'DATE': '2021'}, sent as parameters
+           of the same name like tilecloud-chain does.
+    """
+    coords = bbox.bbox if isinstance(bbox, BBox) else bbox
+    return (dimensions or {}) | {
         'SERVICE': 'WMS',
         'VERSION': '1.3.0',
         'REQUEST': 'GetMap',
@@ -13,11 +33,85 @@ def get_wms_params(bbox: BBox, layers: str, gutter:int, width:int=256, height:in
         'HEIGHT': f'{height + (gutter * 2)}',
         'CRS': f'EPSG:2056',
         'STYLES': '',
-        #'TIME': request.view_args['time'],
-        'BBOX': ','.join([str(b) for b in bbox.bbox])
+        'BBOX': ','.join([str(b) for b in coords])
     }
 
 
-def get_wms_resource(bbox, gutter, width=256, height=256):
-    params = get_wms_params(bbox, gutter, width, height)
-    return get_wms_image(settings.WMS_BACKEND, params)
+def add_gutter(bbox: Sequence[float], gutter: int, cell_size: float) -> tuple[float, float, float, float]:
+    """
+    Grow a bbox by gutter pixels on each side, to go with the WIDTH/HEIGHT + 2 * gutter of get_wms_params.
+    param: cell_size: resolution in meters per pixel.
+    """
+    margin = gutter * cell_size
+    return bbox[0] - margin, bbox[1] - margin, bbox[2] + margin, bbox[3] + margin
+
+
+def get_wms_url(wms_backend: str, params: dict) -> str:
+    """
+    Build a GetMap url, the parameters are url-encoded and appended to any query string already in wms_backend.
+    """
+    separator = '&' if '?' in wms_backend else '?'
+    return f"{wms_backend}{separator}{urlencode(params)}"
+
+
+class GetMapTemplate:
+    """
+    A GetMap url of a layer compiled once: the parameters that never change are url-encoded into a prefix,
+    only the size and the BBOX are formatted for each request.
+    The headers go with every request of the layer, e.g. the Host of a virtual host.
+    Each value of the dimensions of a layer has its own template, so its own prefix.
+    """
+    __slots__ = ('prefix', 'headers')
+
+    def __init__(self, wms_backend: str, layers: str, image_format: str = 'png', crs: str = 'EPSG:2056',
+                 headers: dict[str, str] | None = None, dimensions: dict[str, str] | None = None):
+        params = get_wms_params((0, 0, 0, 0), layers, 0, image_format=image_format, dimensions=dimensions)
+        for name in ('WIDTH', 'HEIGHT', 'BBOX'):
+            del params[name]
+        params['CRS'] = crs
+        self.prefix = get_wms_url(wms_backend, params) + '&'
+        self.headers = headers or None
+
+    def get_url(self, bbox: Sequence[float], width: int, height: int) -> str:
+        """
+        return: the GetMap url of an image of width x height pixels covering bbox.
+        """
+        return f"{self.prefix}WIDTH={width}&HEIGHT={height}&BBOX={bbox[0]}%2C{bbox[1]}%2C{bbox[2]}%2C{bbox[3]}"
+
+    def __repr__(self):
+        return f"GetMapTemplate({self.prefix!r})"
+
+
+class WmsClient:
+    """
+    Shared async HTTP client for the WMS backend, one per process.
+    Connections are kept alive and pooled, max_connections bounds the number of requests in flight
+    to the backend, the other ones wait for a free connection.
+    """
+
+    def __init__(self, max_connections: int = 100, max_keepalive_connections: int = 20, timeout: float = 60.0,
+                 headers: dict[str, str] | None = None):
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections),
+            timeout=httpx.Timeout(timeout, pool=None),
+            headers=headers,
+        )
+
+    async def get_image(self, wms_url: str, headers: dict[str, str] | None = None) -> bytes:
+        """
+        Fetch a whole GetMap image in memory.
+        param: headers: added to the headers of the client for this request.
+        raise: WmsError if the backend is unreachable or does not answer with an image.
+        """
+        try:
+            response = await self.client.get(wms_url, headers=headers)
+        except httpx.HTTPError as error:
+            raise WmsError(f"WMS backend request failed: {error!r}") from error
+        content_type = response.headers.get("content-type", "")
+        if response.status_code != 200 or not content_type.startswith("image/"):
+            # mapserver answers errors with a 200 and an xml ServiceExceptionReport
+            raise WmsError(f"WMS backend returned {response.status_code} {content_type}: {response.content[:500]!r}")
+        return response.content
+
+    async def aclose(self):
+        await self.client.aclose()
@@ -0,0 +1,128 @@
+import gzip
+import hashlib
+import logging
+import threading
+from math import ceil
+from pathlib import Path
+from types import SimpleNamespace
+from typing import NamedTuple
+
+from jinja2 import Environment, FileSystemLoader
+
+try:
+    import brotli
+except ImportError:  # optional, the document is still served gzipped
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES_FOLDER = Path(__file__).resolve().parent / "templates"
+CAPABILITIES_TEMPLATE = "wmts_get_capabilities.jinja"
+# defaults of tilecloud-chain, used by the template for the values missing in the config
+TILECLOUD_DEFAULTS = SimpleNamespace(SERVICE_TYPE_DEFAULT="OGC WMTS", SRS_DEFAULT="EPSG:2056", TILE_SIZE_DEFAULT=256)
+LAYER_DEFAULTS = {"wmts_style": "default", "mime_type": "image/png", "extension": "png", "dimensions": []}
+
+
+class CapabilitiesDocument(NamedTuple):
+    """
+    A rendered GetCapabilities document, with its compressed variants and their strong ETags by content-encoding.
+    """
+    bodies: dict[str, bytes]
+    etags: dict[str, str]
+
+    def is_not_modified(self, if_none_match: str | None) -> bool:
+        """
+        return: True if the If-None-Match header holds the ETag of any variant of the document.
+        """
+        if not if_none_match:
+            return False
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or not tags.isdisjoint(self.etags.values())
+
+
+def choose_encoding(accept_encoding: str | None, available) -> str:
+    """
+    Choose the best content-encoding of an Accept-Encoding header, brotli first, then gzip.
+    return: 'br', 'gzip' or 'identity'
+    """
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name.strip().lower()] = q
+    for encoding in ("br", "gzip"):
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return "identity"
+
+
+def _get_tile_matrix_identifier(grid: dict, resolution: float, zoom: int) -> str:
+    return str(zoom)
+
+
+class WmtsCapabilities:
+    """
+    The GetCapabilities document of the layers of a tilecloud-chain configuration.
+    The template is compiled once, the document is rendered on the first request and kept with its gzip and
+    brotli variants: like the layers served, the configuration is read at startup and a change needs a restart.
+    The tiles are announced under base_url, the public url of the service, never under the url of a request:
+    its Host header is chosen by the client and the document is served to all the others.
+    """
+
+    def __init__(self, config: dict, base_url: str | None):
+        self.config = config
+        self.base_url = base_url.rstrip("/") + "/" if base_url else None
+        self.renders = 0
+        self._template = Environment(loader=FileSystemLoader(TEMPLATES_FOLDER), autoescape=True,
+                                     keep_trailing_newline=True).get_template(CAPABILITIES_TEMPLATE)
+        self._lock = threading.Lock()
+        self._document: CapabilitiesDocument | None = None
+
+    def render(self) -> bytes:
+        """
+        Render the document with the tiles served under base_url.
+        """
+        config = self.config
+        layers = {name: {**LAYER_DEFAULTS, **(layer or {})} for name, layer in (config.get("layers") or {}).items()}
+        return self._template.render(
+            has_metadata="metadata" in config, metadata=config.get("metadata") or {},
+            has_provider="provider" in config, provider=config.get("provider") or {},
+            # the tiles are served in REST only, there is no KVP endpoint
+            server=False, base_urls=[self.base_url], base_url_postfix="",
+            getcapabilities=f"{self.base_url}1.0.0/WMTSCapabilities.xml",
+            layers=layers, layer_legends={name: layer.get("legends", []) for name, layer in layers.items()},
+            grids=config.get("grids") or {}, configuration=TILECLOUD_DEFAULTS,
+            get_tile_matrix_identifier=_get_tile_matrix_identifier,
+            sorted=sorted, enumerate=enumerate, int=int, ceil=ceil,
+        ).encode("utf-8")
+
+    def get(self) -> CapabilitiesDocument:
+        """
+        Get the document, rendered on the first call.
+        raise: ValueError if the public url of the service is not set.
+        """
+        if self.base_url is None:
+            raise ValueError("The public url of the service is not set, please set WMTS_BASE_URL or the http_url "
+                             "of the cache.")
+        with self._lock:
+            if self._document is not None:
+                return self._document
+            logger.info(f"rendering the capabilities of {self.base_url}")
+            body = self.render()
+            self.renders += 1
+            digest = hashlib.sha1(body).hexdigest()[:20]
+            bodies = {"identity": body, "gzip": gzip.compress(body, 9, mtime=0)}
+            if brotli is not None:
+                bodies["br"] = brotli.compress(body)
+            # the variants are different representations, each one has its own strong ETag
+            etags = {encoding: f'"{digest}"' if encoding == "identity" else f'"{digest}-{encoding}"'
+                     for encoding in bodies}
+            self._document = CapabilitiesDocument(bodies, etags)
+            return self._document
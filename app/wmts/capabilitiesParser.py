@@ -0,0 +1,167 @@
+"""
+Streaming reader of WMTS GetCapabilities documents.
+
+The document is read with iterparse in a single pass: each Layer and TileMatrixSet is turned into its model as soon
+as its end tag is read, then removed from the tree, so the memory used does not grow with the size of the document.
+"""
+import io
+import logging
+import re
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import IO, NamedTuple
+
+from pydantic import BaseModel
+
+from app.wmts.tileMatrixSet import OWS_NS, WMTS_NS, TileMatrixSet, tile_matrix_set_from_element
+
+logger = logging.getLogger(__name__)
+
+
+class ResourceUrl(NamedTuple):
+    format: str
+    resource_type: str
+    template: str
+
+
+class WmtsDimension(BaseModel):
+    identifier: str
+    default: str | None = None
+    values: list[str] = []
+
+
+class WmtsLayer(BaseModel):
+    """
+    A layer of a WMTS capabilities document.
+    """
+    identifier: str
+    title: str | None = None
+    styles: list[str] = []
+    default_style: str | None = None
+    formats: list[str] = []
+    dimensions: dict[str, WmtsDimension] = {}
+    resource_urls: list[ResourceUrl] = []
+    tile_matrix_sets: list[str] = []
+
+    def get_tile_url(self, matrix_set: str, zoom: int, col: int, row: int, style: str | None = None,
+                     image_format: str | None = None, **dimensions: str) -> str:
+        """
+        Fill the REST template of the layer, the missing dimensions take their default value.
+        raise: ValueError if the layer has no tile template for the format.
+        """
+        template = next((r.template for r in self.resource_urls if r.resource_type == "tile"
+                         and (image_format is None or r.format == image_format)), None)
+        if template is None:
+            raise ValueError(f"Layer {self.identifier} has no tile ResourceURL for format {image_format}.")
+        values = {name: dimensions.get(name, dimension.default) for name, dimension in self.dimensions.items()}
+        values.update(Style=style or self.default_style or "default", TileMatrixSet=matrix_set,
+                      TileMatrix=str(zoom), TileRow=str(row), TileCol=str(col))
+        return re.sub(r"\{(\w+)}", lambda match: str(values.get(match.group(1), match.group(0))), template)
+
+
+class WmtsCapabilitiesIndex(BaseModel):
+    """
+    The layers and TileMatrixSets of a capabilities document, by identifier.
+    """
+    title: str | None = None
+    layers: dict[str, WmtsLayer] = {}
+    tile_matrix_sets: dict[str, TileMatrixSet] = {}
+
+    def get_layer(self, identifier: str) -> WmtsLayer:
+        """
+        raise: ValueError if the layer is not in the document.
+        """
+        layer = self.layers.get(identifier)
+        if layer is None:
+            raise ValueError(f"Unknown layer {identifier}.")
+        return layer
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def _child_text(element: ET.Element, name: str) -> str | None:
+    for child in element:
+        if _local_name(child.tag) == name:
+            return (child.text or '').strip()
+    return None
+
+
+def _layer_from_element(element: ET.Element) -> WmtsLayer:
+    layer = WmtsLayer(identifier=_child_text(element, 'Identifier'), title=_child_text(element, 'Title'))
+    for child in element:
+        tag = _local_name(child.tag)
+        if tag == 'Style':
+            style = _child_text(child, 'Identifier')
+            layer.styles.append(style)
+            if child.get('isDefault') == 'true' or layer.default_style is None:
+                layer.default_style = style
+        elif tag == 'Format':
+            layer.formats.append(child.text.strip())
+        elif tag == 'Dimension':
+            dimension = WmtsDimension(identifier=_child_text(child, 'Identifier'), default=_child_text(child, 'Default'),
+                                      values=[(v.text or '').strip() for v in child if _local_name(v.tag) == 'Value'])
+            layer.dimensions[dimension.identifier] = dimension
+        elif tag == 'ResourceURL':
+            layer.resource_urls.append(ResourceUrl(child.get('format'), child.get('resourceType'),
+                                                   child.get('template')))
+        elif tag == 'TileMatrixSetLink':
+            layer.tile_matrix_sets.append(_child_text(child, 'TileMatrixSet'))
+    return layer
+
+
+def _iterparse(source: IO[bytes], index: WmtsCapabilitiesIndex):
+    # elements being read, from the root, the finished Layer and TileMatrixSet are removed from their parent
+    stack: list[ET.Element] = []
+    for event, element in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            stack.append(element)
+            continue
+        stack.pop()
+        tag = _local_name(element.tag)
+        parent = _local_name(stack[-1].tag) if stack else None
+        if tag == 'Layer':
+            layer = _layer_from_element(element)
+            index.layers[layer.identifier] = layer
+        elif tag == 'TileMatrixSet' and parent != 'TileMatrixSetLink' and len(element):
+            try:
+                tile_matrix_set = tile_matrix_set_from_element(element)
+            except ValueError as error:
+                logger.warning(f"TileMatrixSet skipped: {error}")
+            else:
+                index.tile_matrix_sets[tile_matrix_set.identifier] = tile_matrix_set
+        elif tag == 'Title' and parent == 'ServiceIdentification':
+            index.title = (element.text or '').strip()
+            continue
+        else:
+            continue
+        if stack:
+            stack[-1].remove(element)
+
+
+def parse_capabilities(source: str | Path | IO[bytes]) -> WmtsCapabilitiesIndex:
+    """
+    Read the layers and the TileMatrixSets of a WMTS capabilities document in one streaming pass.
+    Fragments holding only TileMatrixSet elements, like data/tileMatrixSet.xml, are accepted too.
+    param: source: path or binary file object
+    raise: ET.ParseError if the document is not well-formed XML.
+    """
+    index = WmtsCapabilitiesIndex()
+    if isinstance(source, (str, Path)):
+        with open(source, 'rb') as f:
+            return parse_capabilities(f)
+    start = source.tell() if source.seekable() else None
+    try:
+        _iterparse(source, index)
+    except ET.ParseError:
+        if start is None:
+            raise
+        # fragments have several roots and use ows: without declaring it, they are small enough to be wrapped
+        source.seek(start)
+        body = re.sub(rb'^\s*<\?xml[^>]*\?>', b'', source.read())
+        index = WmtsCapabilitiesIndex()
+        _iterparse(io.BytesIO(b'<root xmlns="' + WMTS_NS.encode() + b'" xmlns:ows="' + OWS_NS.encode() + b'">'
+                              + body + b'</root>'), index)
+    logger.debug(f"capabilities: {len(index.layers)} layers, {len(index.tile_matrix_sets)} TileMatrixSets")
+    return index
@@ -0,0 +1,49 @@
+"""
+WGS84 <-> LV95 (EPSG:4326 <-> EPSG:2056) with the approximate formulas of swisstopo, vectorized with NumPy.
+https://www.swisstopo.admin.ch/en/transformation-calculation-services ("Approximate formulas for the transformation
+between Swiss projection coordinates and WGS84"): about 1 m in Switzerland, no GDAL/PROJ needed.
+"""
+import numpy as np
+
+
+def wgs84_to_lv95(longitudes, latitudes) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Project WGS84 coordinates to LV95.
+    param: longitudes: degrees, a float or an array-like.
+    param: latitudes: degrees, same shape as longitudes.
+    return: Tuple of (eastings, northings) as float64 numpy arrays.
+    raise: ValueError if the shapes differ.
+    """
+    lon = np.asarray(longitudes, dtype=np.float64)
+    lat = np.asarray(latitudes, dtype=np.float64)
+    if lon.shape != lat.shape:
+        raise ValueError(f"lon and lat must have the same length, got {lon.size} and {lat.size}.")
+    # auxiliary values, in 10000" from Bern
+    phi = (lat * 3600.0 - 169028.66) / 10000.0
+    lam = (lon * 3600.0 - 26782.5) / 10000.0
+    lam2 = lam * lam
+    east = 2600072.37 + lam * (211455.93 - phi * (10938.51 + 0.36 * phi) - 44.54 * lam2)
+    north = 1200147.07 + phi * (308807.95 + phi * (76.63 + 119.79 * phi)) + lam2 * (3745.25 - 194.56 * phi)
+    return east, north
+
+
+def lv95_to_wgs84(eastings, northings) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Unproject LV95 coordinates to WGS84.
+    param: eastings: meters, a float or an array-like.
+    param: northings: meters, same shape as eastings.
+    return: Tuple of (longitudes, latitudes) in degrees as float64 numpy arrays.
+    raise: ValueError if the shapes differ.
+    """
+    east = np.asarray(eastings, dtype=np.float64)
+    north = np.asarray(northings, dtype=np.float64)
+    if east.shape != north.shape:
+        raise ValueError(f"x and y must have the same length, got {east.size} and {north.size}.")
+    # auxiliary values, in 1000 km from Bern
+    y = (east - 2600000.0) / 1000000.0
+    x = (north - 1200000.0) / 1000000.0
+    y2 = y * y
+    lam = 2.6779094 + y * (4.728982 + x * (0.791484 + 0.1306 * x) - 0.0436 * y2)
+    phi = 16.9023892 + x * (3.238272 - x * (0.002528 + 0.0140 * x)) - y2 * (0.270978 + 0.0447 * x)
+    # from 10000" to degrees
+    return lam * (100.0 / 36.0), phi * (100.0 / 36.0)
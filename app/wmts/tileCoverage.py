@@ -0,0 +1,149 @@
+import io
+import json
+import math
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from app.wmts.tileMatrix import TileMatrixTable, TileRange
+
+# the polygons are drawn with SUPERSAMPLE x SUPERSAMPLE pixels per tile, so thin parts still mark their tiles
+SUPERSAMPLE = 4
+
+Polygon = list[list[tuple[float, float]]]
+
+
+def load_geojson_polygons(path: str) -> list[Polygon]:
+    """
+    Read the polygons of a GeoJSON file in the coordinates of the grid (EPSG:2056), as lists of rings.
+    """
+    with open(path, encoding="utf-8") as f:
+        return get_geojson_polygons(json.load(f))
+
+
+def get_geojson_polygons(document: dict) -> list[Polygon]:
+    """
+    Get the polygons of a GeoJSON object as lists of rings.
+    Features, FeatureCollections, Polygons and MultiPolygons are accepted, the other geometries are ignored.
+    raise: ValueError if a polygon is malformed.
+    """
+    polygons = []
+
+    def visit(item: dict):
+        kind = item.get("type")
+        if kind == "FeatureCollection":
+            for feature in item.get("features", []):
+                visit(feature)
+        elif kind == "Feature":
+            if item.get("geometry"):
+                visit(item["geometry"])
+        elif kind == "GeometryCollection":
+            for geometry in item.get("geometries", []):
+                visit(geometry)
+        elif kind == "Polygon":
+            polygons.append([[(float(x), float(y)) for x, y, *_ in ring] for ring in item["coordinates"]])
+        elif kind == "MultiPolygon":
+            for polygon in item["coordinates"]:
+                polygons.append([[(float(x), float(y)) for x, y, *_ in ring] for ring in polygon])
+
+    try:
+        visit(document)
+    except (KeyError, TypeError, ValueError) as error:
+        raise ValueError(f"Invalid GeoJSON geometry: {error!r}")
+    return polygons
+
+
+class TileCoverage:
+    """
+    The tiles of a grid a layer has data for: at each zoom the range of the tiles of its bbox, computed once,
+    refined by a bitmap of the tiles touching its polygons when some are given.
+    The bitmaps are built for the zooms up to max_bitmap_cells tiles, the finer zooms look up the centre of their
+    tiles in the finest bitmap. They are grown by one tile, a tile is never left out because of the sampling.
+    """
+    __slots__ = ('table', 'ranges', 'bitmaps', 'finest_bitmap')
+
+    def __init__(self, table: TileMatrixTable, bbox=None, polygons: list[Polygon] | None = None,
+                 max_bitmap_cells: int = 1 << 20):
+        self.table = table
+        self.ranges: list[TileRange | None] = []
+        for zoom in range(table.min_zoom, table.max_zoom + 1):
+            i = zoom - table.min_zoom
+            if bbox is None:
+                self.ranges.append(TileRange(zoom, 0, 0, table.matrix_widths[i] - 1, table.matrix_heights[i] - 1))
+            else:
+                self.ranges.append(table.get_tile_range(bbox, zoom))
+        self.bitmaps: list[np.ndarray | None] = [None] * len(self.ranges)
+        self.finest_bitmap = None
+        if polygons:
+            for i, tile_range in enumerate(self.ranges):
+                if tile_range is None or tile_range.count > max_bitmap_cells:
+                    break
+                self.bitmaps[i] = self._rasterize(tile_range, polygons)
+                self.finest_bitmap = i
+
+    def _rasterize(self, tile_range: TileRange, polygons: list[Polygon]) -> np.ndarray:
+        t = self.table
+        x_min, _, _, y_max = t.get_tile_range_bbox(tile_range)
+        i = t.check_zoom(tile_range.zoom)
+        pixel_x = t.spans_x[i] / SUPERSAMPLE
+        pixel_y = t.spans_y[i] / SUPERSAMPLE
+        image = Image.new('1', (tile_range.num_cols * SUPERSAMPLE, tile_range.num_rows * SUPERSAMPLE), 0)
+        draw = ImageDraw.Draw(image)
+        for polygon in polygons:
+            for hole, ring in enumerate(polygon):
+                points = [((x - x_min) / pixel_x, (y_max - y) / pixel_y) for x, y in ring]
+                if len(points) >= 3:
+                    # the outline of the holes stays marked, the tiles along their edges are partly covered
+                    draw.polygon(points, fill=0 if hole else 1, outline=1)
+        pixels = np.asarray(image, dtype=bool)
+        tiles = pixels.reshape(tile_range.num_rows, SUPERSAMPLE, tile_range.num_cols, SUPERSAMPLE).any(axis=(1, 3))
+        grown = np.pad(tiles, 1)
+        return (grown[1:-1, 1:-1] | grown[:-2, 1:-1] | grown[2:, 1:-1] | grown[1:-1, :-2] | grown[1:-1, 2:]
+                | grown[:-2, :-2] | grown[:-2, 2:] | grown[2:, :-2] | grown[2:, 2:])
+
+    def contains(self, zoom: int, col: int, row: int) -> bool:
+        """
+        return: False if the tile is out of the matrix or out of the coverage of the layer.
+        """
+        t = self.table
+        if not t.min_zoom <= zoom <= t.max_zoom:
+            return False
+        i = zoom - t.min_zoom
+        tile_range = self.ranges[i]
+        if (tile_range is None or not tile_range.min_col <= col <= tile_range.max_col
+                or not tile_range.min_row <= row <= tile_range.max_row):
+            return False
+        bitmap = self.bitmaps[i]
+        if bitmap is not None:
+            return bool(bitmap[row - tile_range.min_row, col - tile_range.min_col])
+        if self.finest_bitmap is None:
+            return True
+        # finer than the finest bitmap: the tile is in the coverage if its centre is in a covered coarser tile
+        j = self.finest_bitmap
+        coarse = self.ranges[j]
+        x = t.origin_x + (col + 0.5) * t.spans_x[i]
+        y = t.origin_y - (row + 0.5) * t.spans_y[i]
+        coarse_col = math.floor((x - t.origin_x) / t.spans_x[j]) - coarse.min_col
+        coarse_row = math.floor((t.origin_y - y) / t.spans_y[j]) - coarse.min_row
+        bitmap = self.bitmaps[j]
+        return 0 <= coarse_row < bitmap.shape[0] and 0 <= coarse_col < bitmap.shape[1] \
+            and bool(bitmap[coarse_row, coarse_col])
+
+    def stats(self) -> dict:
+        return {"tiles": sum(r.count for r in self.ranges if r is not None),
+                "bitmap_zooms": [self.table.min_zoom + i for i, b in enumerate(self.bitmaps) if b is not None]}
+
+
+@lru_cache(maxsize=8)
+def get_transparent_tile(width: int = 256, height: int = 256, image_format: str = 'png') -> bytes:
+    """
+    The fully transparent tile answered out of the coverage, encoded once and shared by all the layers.
+    The formats without alpha, like jpeg, get a white tile.
+    """
+    buffer = io.BytesIO()
+    if image_format in ('jpeg', 'jpg'):
+        Image.new('RGB', (width, height), (255, 255, 255)).save(buffer, 'jpeg')
+    else:
+        Image.new('RGBA', (width, height), (0, 0, 0, 0)).save(buffer, image_format)
+    return buffer.getvalue()
@@ -0,0 +1,231 @@
+import bisect
+import math
+from typing import Iterator, NamedTuple
+
+import numpy as np
+
+# tolerance used when snapping bbox coordinates to tile edges, absorbs float noise like 10859.999999999998
+EDGE_EPSILON = 1e-9
+
+
+class TileRange(NamedTuple):
+    """
+    Inclusive range of tile columns and rows of one zoom level.
+    """
+    zoom: int
+    min_col: int
+    min_row: int
+    max_col: int
+    max_row: int
+
+    @property
+    def num_cols(self) -> int:
+        return self.max_col - self.min_col + 1
+
+    @property
+    def num_rows(self) -> int:
+        return self.max_row - self.min_row + 1
+
+    @property
+    def count(self) -> int:
+        return self.num_cols * self.num_rows
+
+    def tiles(self) -> Iterator[tuple[int, int, int]]:
+        """
+        Lazily iterate over the (zoom, col, row) of the range, row by row.
+        """
+        cols = range(self.min_col, self.max_col + 1)
+        for row in range(self.min_row, self.max_row + 1):
+            for col in cols:
+                yield self.zoom, col, row
+
+
+class TileMatrixTable:
+    """
+    Compiled, read-only lookup tables of a tile matrix set, one entry per zoom level.
+    The tables are built once from a resolutions dict like LausanneGrid.resolutions
+    ({zoom: {'cellSize': ..., 'MatrixWidth': ..., 'MatrixHeight': ...}}) and never change afterward,
+    so a single instance can be shared by every request of the process.
+    Computing a tile bbox is a handful of multiply-adds on tuples, without any pydantic validation.
+    """
+    __slots__ = ('origin_x', 'origin_y', 'tile_width', 'tile_height', 'min_zoom', 'max_zoom',
+                 'cell_sizes', 'spans_x', 'spans_y', 'matrix_widths', 'matrix_heights', 'scale_denominators',
+                 'ascending_cell_sizes', 'np_cell_sizes', 'np_matrix_widths', 'np_matrix_heights')
+
+    def __init__(self, resolutions: dict, origin_x: float, origin_y: float, tile_width: int = 256,
+                 tile_height: int = 256):
+        zooms = sorted(resolutions.keys())
+        if zooms != list(range(zooms[0], zooms[0] + len(zooms))):
+            raise ValueError(f"Zoom levels must be contiguous, got {zooms}.")
+        cell_sizes = tuple(float(resolutions[z]['cellSize']) for z in zooms)
+        setattr_ = super().__setattr__
+        setattr_('origin_x', float(origin_x))
+        setattr_('origin_y', float(origin_y))
+        setattr_('tile_width', int(tile_width))
+        setattr_('tile_height', int(tile_height))
+        setattr_('min_zoom', zooms[0])
+        setattr_('max_zoom', zooms[-1])
+        setattr_('cell_sizes', cell_sizes)
+        setattr_('spans_x', tuple(tile_width * c for c in cell_sizes))
+        setattr_('spans_y', tuple(tile_height * c for c in cell_sizes))
+        setattr_('matrix_widths', tuple(int(resolutions[z]['MatrixWidth']) for z in zooms))
+        setattr_('matrix_heights', tuple(int(resolutions[z]['MatrixHeight']) for z in zooms))
+        setattr_('scale_denominators', tuple(float(resolutions[z]['ScaleDenominator']) for z in zooms))
+        # sorted copy for the bisect of get_nearest_zoom, the cell sizes do not have to decrease with the zoom
+        setattr_('ascending_cell_sizes', tuple(sorted((c, zooms[0] + i) for i, c in enumerate(cell_sizes))))
+        setattr_('np_cell_sizes', self._read_only(np.array(cell_sizes)))
+        setattr_('np_matrix_widths', self._read_only(np.array(self.matrix_widths, dtype=np.int64)))
+        setattr_('np_matrix_heights', self._read_only(np.array(self.matrix_heights, dtype=np.int64)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    @staticmethod
+    def _read_only(array: np.ndarray) -> np.ndarray:
+        array.flags.writeable = False
+        return array
+
+    def __len__(self):
+        return len(self.cell_sizes)
+
+    def has_zoom(self, zoom_level: int) -> bool:
+        return self.min_zoom <= zoom_level <= self.max_zoom
+
+    def check_zoom(self, zoom_level: int) -> int:
+        """
+        Check the zoom level and return its index in the tables.
+        raise: ValueError if the zoom level is not supported.
+        """
+        if not self.min_zoom <= zoom_level <= self.max_zoom:
+            raise ValueError(f"Unsupported zoom level : {zoom_level}. "
+                             f"Please choose between {self.min_zoom} and {self.max_zoom}.")
+        return zoom_level - self.min_zoom
+
+    def get_nearest_zoom(self, cell_size: float) -> int:
+        """
+        Get the zoom level whose cell size is the nearest to cell_size, by ratio: 3.5 is nearer to 2.5 than to 5.
+        Out of the range of the table, the first or last zoom level is returned. O(log n) with a bisect.
+        raise: ValueError if cell_size is not positive.
+        """
+        if not cell_size > 0:
+            raise ValueError(f"Invalid cell size {cell_size}, it must be positive.")
+        cells = self.ascending_cell_sizes
+        i = bisect.bisect_left(cells, (cell_size,))
+        if i == 0:
+            return cells[0][1]
+        if i == len(cells):
+            return cells[-1][1]
+        (smaller, smaller_zoom), (larger, larger_zoom) = cells[i - 1], cells[i]
+        return smaller_zoom if cell_size / smaller <= larger / cell_size else larger_zoom
+
+    def get_tile(self, coord_x: float, coord_y: float, zoom_level: int) -> tuple[int, int]:
+        """
+        Get the tile indices containing a point, points outside the matrix give out-of-range indices.
+        return: Tuple of (col, row).
+        """
+        i = self.check_zoom(zoom_level)
+        return (math.floor((coord_x - self.origin_x) / self.spans_x[i]),
+                math.floor((self.origin_y - coord_y) / self.spans_y[i]))
+
+    def is_valid_tile(self, zoom_level: int, tile_col: int, tile_row: int) -> bool:
+        if not self.min_zoom <= zoom_level <= self.max_zoom:
+            return False
+        i = zoom_level - self.min_zoom
+        return 0 <= tile_col < self.matrix_widths[i] and 0 <= tile_row < self.matrix_heights[i]
+
+    def get_tile_bbox(self, zoom_level: int, tile_col: int, tile_row: int) -> tuple[float, float, float, float]:
+        """
+        Get the bounding box of a tile.
+        return: Tuple of (x_min, y_min, x_max, y_max).
+        raise: ValueError if the zoom level or the tile indices are not valid.
+        """
+        i = self.check_zoom(zoom_level)
+        if not 0 <= tile_col < self.matrix_widths[i]:
+            raise ValueError(f"Invalid column index. Please choose between 0 and {self.matrix_widths[i] - 1}.")
+        if not 0 <= tile_row < self.matrix_heights[i]:
+            raise ValueError(f"Invalid row index. Please choose between 0 and {self.matrix_heights[i] - 1}.")
+        span_x = self.spans_x[i]
+        span_y = self.spans_y[i]
+        x_min = self.origin_x + tile_col * span_x
+        y_max = self.origin_y - tile_row * span_y
+        return x_min, y_max - span_y, x_min + span_x, y_max
+
+    def check_zoom_levels(self, zoom_levels) -> np.ndarray:
+        """
+        Vectorized version of check_zoom.
+        return: numpy array of indices in the tables.
+        """
+        zooms = np.asarray(zoom_levels, dtype=np.int64)
+        if zooms.size and (zooms.min() < self.min_zoom or zooms.max() > self.max_zoom):
+            raise ValueError(f"Unsupported zoom level. Please choose between {self.min_zoom} and {self.max_zoom}.")
+        return zooms - self.min_zoom
+
+    def get_tiles(self, coords_x, coords_y, zoom_levels) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Vectorized version of get_tile.
+        param: zoom_levels: Zoom level, either a single int or an array-like with one zoom per point.
+        return: Tuple of (cols, rows) as int64 numpy arrays.
+        """
+        xs = np.asarray(coords_x, dtype=np.float64)
+        ys = np.asarray(coords_y, dtype=np.float64)
+        if xs.shape != ys.shape:
+            raise ValueError(f"x and y must have the same length, got {xs.size} and {ys.size}.")
+        cell_sizes = self.np_cell_sizes[self.check_zoom_levels(zoom_levels)]
+        cols = np.floor((xs - self.origin_x) / (self.tile_width * cell_sizes)).astype(np.int64)
+        rows = np.floor((self.origin_y - ys) / (self.tile_height * cell_sizes)).astype(np.int64)
+        return cols, rows
+
+    def get_tiles_bbox(self, zoom_levels, tile_cols, tile_rows) -> np.ndarray:
+        """
+        Vectorized version of get_tile_bbox, without any validation of the tile indices.
+        return: (n, 4) float64 numpy array of [x_min, y_min, x_max, y_max] per tile.
+        """
+        cell_sizes = self.np_cell_sizes[self.check_zoom_levels(zoom_levels)]
+        spans_x = self.tile_width * cell_sizes
+        spans_y = self.tile_height * cell_sizes
+        bboxes = np.empty((np.size(tile_cols), 4), dtype=np.float64)
+        bboxes[:, 0] = self.origin_x + np.asarray(tile_cols) * spans_x
+        bboxes[:, 3] = self.origin_y - np.asarray(tile_rows) * spans_y
+        bboxes[:, 2] = bboxes[:, 0] + spans_x
+        bboxes[:, 1] = bboxes[:, 3] - spans_y
+        return bboxes
+
+    def are_valid_tiles(self, zoom_levels, tile_cols, tile_rows) -> np.ndarray:
+        """
+        Vectorized version of is_valid_tile.
+        return: Boolean numpy array, True where the tile lies inside the matrix of its zoom level.
+        """
+        i = self.check_zoom_levels(zoom_levels)
+        cols = np.asarray(tile_cols)
+        rows = np.asarray(tile_rows)
+        return (cols >= 0) & (cols < self.np_matrix_widths[i]) & (rows >= 0) & (rows < self.np_matrix_heights[i])
+
+    def get_tile_range(self, bbox, zoom_level: int) -> TileRange | None:
+        """
+        Get the range of tiles intersecting a bbox, clipped to the matrix.
+        A bbox edge lying exactly on a tile edge does not pull in the neighbouring tile.
+        param: bbox: [x_min, y_min, x_max, y_max]
+        return: TileRange, or None if the bbox does not intersect the matrix.
+        """
+        i = self.check_zoom(zoom_level)
+        x_min, y_min, x_max, y_max = bbox
+        span_x = self.spans_x[i]
+        span_y = self.spans_y[i]
+        min_col = max(0, math.floor((x_min - self.origin_x) / span_x + EDGE_EPSILON))
+        min_row = max(0, math.floor((self.origin_y - y_max) / span_y + EDGE_EPSILON))
+        max_col = min(self.matrix_widths[i] - 1, math.ceil((x_max - self.origin_x) / span_x - EDGE_EPSILON) - 1)
+        max_row = min(self.matrix_heights[i] - 1, math.ceil((self.origin_y - y_min) / span_y - EDGE_EPSILON) - 1)
+        if min_col > max_col or min_row > max_row:
+            return None
+        return TileRange(zoom_level, min_col, min_row, max_col, max_row)
+
+    def get_tile_range_bbox(self, tile_range: TileRange) -> tuple[float, float, float, float]:
+        """
+        Get the bounding box covered by all the tiles of a range.
+        return: Tuple of (x_min, y_min, x_max, y_max).
+        """
+        i = self.check_zoom(tile_range.zoom)
+        span_x = self.spans_x[i]
+        span_y = self.spans_y[i]
+        return (self.origin_x + tile_range.min_col * span_x, self.origin_y - (tile_range.max_row + 1) * span_y,
+                self.origin_x + (tile_range.max_col + 1) * span_x, self.origin_y - tile_range.min_row * span_y)
@@ -0,0 +1,468 @@
+import json
+import logging
+import math
+import re
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Any, ClassVar, Iterator
+
+from pydantic import BaseModel, PrivateAttr, conlist
+
+from app.wmts.tileMatrix import TileMatrixTable, TileRange
+from app.wmts.utils import BBox, WMTS_REF_PIXEL_SIZE_M, get_scale_denominator
+
+logger = logging.getLogger(__name__)
+
+OWS_NS = "http://www.opengis.net/ows/1.1"
+WMTS_NS = "http://www.opengis.net/wmts/1.0"
+
+
+class TileMatrix(BaseModel):
+    """
+    One zoom level of a TileMatrixSet, as described in the WMTS capabilities or in eCH-0056.
+    """
+    identifier: str
+    scale_denominator: float
+    cell_size: float
+    top_left_corner: conlist(float, min_length=2, max_length=2)
+    tile_width: int = 256
+    tile_height: int = 256
+    matrix_width: int
+    matrix_height: int
+
+
+class TileMatrixSet(BaseModel):
+    """
+    Generic WMTS TileMatrixSet, the zoom level of a tile is the position of its TileMatrix in the set.
+    Definitions can be loaded from the tilecloud-chain grids, from WMTS TileMatrixSet XML or
+    from the eCH-0056 JSON, and are compiled once into a TileMatrixTable used for all the col/row/bbox math.
+    """
+    identifier: str
+    srid: int
+    matrices: list[TileMatrix]
+    bbox: conlist(float, min_length=4, max_length=4) | None = None
+    UNIT: ClassVar[str] = 'meters'
+    MetersPerUnit: ClassVar[int] = 1
+    _table: TileMatrixTable = PrivateAttr()
+
+    def model_post_init(self, __context: Any) -> None:
+        if not self.matrices:
+            raise ValueError(f"TileMatrixSet {self.identifier} has no TileMatrix.")
+        first = self.matrices[0]
+        for matrix in self.matrices[1:]:
+            if (matrix.top_left_corner != first.top_left_corner or matrix.tile_width != first.tile_width
+                    or matrix.tile_height != first.tile_height):
+                raise ValueError(f"TileMatrixSet {self.identifier}: all TileMatrix must share "
+                                 f"the same TopLeftCorner and tile size.")
+        self._table = TileMatrixTable(self.resolutions, first.top_left_corner[0], first.top_left_corner[1],
+                                      first.tile_width, first.tile_height)
+
+    @classmethod
+    def from_resolutions(cls, identifier: str, resolutions: list[float], bbox: list[float], srs: str = 'EPSG:2056',
+                         tile_size: int = 256) -> "TileMatrixSet":
+        """
+        Build a TileMatrixSet from a tilecloud-chain grid definition, the matrix sizes are
+        computed like tilecloud-chain does for the GetCapabilities.
+        param: resolutions: cell size of each zoom level in meters per pixel.
+        param: bbox: [x_min, y_min, x_max, y_max] of the grid, the top-left corner is the origin.
+        """
+        matrices = [
+            TileMatrix(identifier=str(zoom), scale_denominator=get_scale_denominator(resolution),
+                       cell_size=resolution, top_left_corner=[bbox[0], bbox[3]],
+                       tile_width=tile_size, tile_height=tile_size,
+                       matrix_width=math.ceil((bbox[2] - bbox[0]) / resolution / tile_size),
+                       matrix_height=math.ceil((bbox[3] - bbox[1]) / resolution / tile_size))
+            for zoom, resolution in enumerate(resolutions)
+        ]
+        return cls(identifier=identifier, srid=parse_srid(srs), matrices=matrices, bbox=bbox)
+
+    @property
+    def table(self) -> TileMatrixTable:
+        return self._table
+
+    @property
+    def resolutions(self) -> dict:
+        """
+        Per zoom dict in the same shape as the historical LausanneGrid.resolutions.
+        """
+        return {zoom: {'ScaleDenominator': m.scale_denominator, 'cellSize': m.cell_size,
+                       'MatrixWidth': m.matrix_width, 'MatrixHeight': m.matrix_height}
+                for zoom, m in enumerate(self.matrices)}
+
+    @property
+    def top_left_x(self) -> float:
+        return self._table.origin_x
+
+    @property
+    def top_left_y(self) -> float:
+        return self._table.origin_y
+
+    @property
+    def tile_size(self) -> int:
+        return self._table.tile_width
+
+    def get_tile(self, coord_x: float, coord_y: float, zoom_level: int):
+        """
+        Get the indices of the tile containing a point.
+        param: coord_x: X coordinate.
+        param: coord_y: Y coordinate.
+        param: zoom_level: Zoom level of the tile.
+        return: Tuple of (col, row).
+        """
+        return self._table.get_tile(coord_x, coord_y, zoom_level)
+
+    def get_tiles(self, coords_x, coords_y, zoom_levels):
+        """
+        Vectorized version of get_tile, computing the tile indices of many points in one NumPy pass.
+        param: coords_x: Array-like of X coordinates.
+        param: coords_y: Array-like of Y coordinates.
+        param: zoom_levels: Zoom level, either a single int or an array-like with one zoom per point.
+        return: Tuple of (cols, rows) as int64 numpy arrays.
+        """
+        return self._table.get_tiles(coords_x, coords_y, zoom_levels)
+
+    def get_tiles_bbox(self, zoom_levels, tile_cols, tile_rows):
+        """
+        Vectorized version of get_tile_bbox, without any validation of the tile indices.
+        param: zoom_levels: Zoom level, either a single int or an array-like with one zoom per tile.
+        param: tile_cols: Array-like of column indices.
+        param: tile_rows: Array-like of row indices.
+        return: (n, 4) float64 numpy array of [x_min, y_min, x_max, y_max] per tile.
+        """
+        return self._table.get_tiles_bbox(zoom_levels, tile_cols, tile_rows)
+
+    def are_valid_tiles(self, zoom_levels, tile_cols, tile_rows):
+        """
+        Vectorized version of is_valid_tile.
+        param: zoom_levels: Zoom level, either a single int or an array-like with one zoom per tile.
+        param: tile_cols: Array-like of column indices.
+        param: tile_rows: Array-like of row indices.
+        return: Boolean numpy array, True where the tile lies inside the matrix of its zoom level.
+        """
+        return self._table.are_valid_tiles(zoom_levels, tile_cols, tile_rows)
+
+    def get_cell_sizes(self, zoom_levels):
+        """
+        Get the cell size (resolution in meters per pixel) for one or many zoom levels.
+        param: zoom_levels: Zoom level, either a single int or an array-like of zoom levels.
+        return: numpy array (or scalar) of cell sizes.
+        """
+        return self._table.np_cell_sizes[self._table.check_zoom_levels(zoom_levels)]
+
+    def get_nearest_zoom(self, resolution: float | None = None, scale_denominator: float | None = None) -> int:
+        """
+        Get the zoom level the nearest to a resolution or to a scale denominator, for the clients asking by scale.
+        param: resolution: cell size in meters per pixel.
+        param: scale_denominator: WMTS scale denominator, used when resolution is None.
+        raise: ValueError if neither is given or if the value is not positive.
+        """
+        if resolution is None:
+            if scale_denominator is None:
+                raise ValueError("Please give a resolution or a scale denominator.")
+            resolution = scale_denominator * WMTS_REF_PIXEL_SIZE_M
+        return self._table.get_nearest_zoom(resolution)
+
+    def max_zoom(self):
+        return self._table.max_zoom
+
+    def num_zoom_levels(self):
+        return len(self._table)
+
+    def min_zoom(self):
+        return self._table.min_zoom
+
+    def is_valid_tile(self, zoom_level: int, tile_col: int, tile_row: int):
+        """
+        Check if the tile indices are valid.
+        param: zoom_level: Zoom level of the tile.
+        param: tile_col: Column index of the tile.
+        param: tile_row: Row index of the tile.
+        return: True if the tile indices are valid, False otherwise.
+        """
+        return self._table.is_valid_tile(zoom_level, tile_col, tile_row)
+
+    def get_tile_bbox(self, zoom_level: int, tile_col: int, tile_row: int) -> BBox | None:
+        """
+        Get the bounding box of a tile, raise a ValueError if the tile indices are not valid.
+        param: zoom_level: Zoom level of the tile.
+        param: tile_col: Column index of the tile.
+        param: tile_row: Row index of the tile.
+        return: BBox of the tile.
+        """
+        # the table already checked the values, no need to validate them again
+        return BBox.model_construct(bbox=list(self._table.get_tile_bbox(zoom_level, tile_col, tile_row)))
+
+    def get_tile_range(self, bbox, zoom_level: int) -> TileRange | None:
+        """
+        Get the range of tiles covering a bbox at one zoom level.
+        param: bbox: [x_min, y_min, x_max, y_max]
+        param: zoom_level: Zoom level of the tiles.
+        return: TileRange clipped to the matrix, or None if the bbox is outside of it.
+        """
+        return self._table.get_tile_range(bbox, zoom_level)
+
+    def get_tile_ranges(self, bbox, min_zoom: int | None = None, max_zoom: int | None = None) -> dict[int, TileRange]:
+        """
+        Get the range of tiles covering a bbox for every zoom level between min_zoom and max_zoom (inclusive).
+        param: bbox: [x_min, y_min, x_max, y_max]
+        param: min_zoom: first zoom level, defaults to the first of the grid.
+        param: max_zoom: last zoom level, defaults to the last of the grid.
+        return: dict of TileRange by zoom level, zoom levels without any tile are left out.
+        """
+        min_zoom = self.min_zoom() if min_zoom is None else min_zoom
+        max_zoom = self.max_zoom() if max_zoom is None else max_zoom
+        ranges = {}
+        for zoom in range(min_zoom, max_zoom + 1):
+            tile_range = self._table.get_tile_range(bbox, zoom)
+            if tile_range is not None:
+                ranges[zoom] = tile_range
+        return ranges
+
+    def iter_tiles(self, bbox, min_zoom: int | None = None, max_zoom: int | None = None) -> Iterator[tuple[int, int, int]]:
+        """
+        Lazily iterate over every (zoom, col, row) covering a bbox, zoom by zoom and row by row.
+        The tiles are generated on the fly, memory use does not depend on their number.
+        """
+        for tile_range in self.get_tile_ranges(bbox, min_zoom, max_zoom).values():
+            yield from tile_range.tiles()
+
+    def count_tiles(self, bbox, min_zoom: int | None = None, max_zoom: int | None = None) -> int:
+        """
+        Get the exact number of tiles covering a bbox, without enumerating them.
+        """
+        return sum(tile_range.count for tile_range in self.get_tile_ranges(bbox, min_zoom, max_zoom).values())
+
+    def get_bbox(self):
+        """
+        Get the bounding box of the grid, defaults to the extent of the finest TileMatrix.
+        return: List of [x_min, y_min, x_max, y_max]
+        """
+        if self.bbox is not None:
+            return list(self.bbox)
+        t = self._table
+        return [t.origin_x, t.origin_y - t.matrix_heights[-1] * t.spans_y[-1],
+                t.origin_x + t.matrix_widths[-1] * t.spans_x[-1], t.origin_y]
+
+    def get_tile_width(self):
+        """
+        Get the width of the tile in pixels.
+        """
+        return self._table.tile_width * self.MetersPerUnit
+
+    def get_tile_height(self):
+        """
+        Get the height of the tile in pixels.
+        """
+        return self._table.tile_height * self.MetersPerUnit
+
+    def get_height(self):
+        """
+        Get the total height of the Grid in meters.
+        """
+        x1, y1, x2, y2 = self.get_bbox()
+        return y2 - y1
+
+    def get_width(self):
+        """
+        Get the total width of the Grid in meters.
+        """
+        x1, y1, x2, y2 = self.get_bbox()
+        return x2 - x1
+
+    def get_max_num_rows(self, zoom_level: int):
+        """
+        Get the number of rows of the TileMatrix at this zoom level.
+        """
+        return self._table.matrix_heights[self._table.check_zoom(zoom_level)]
+
+    def get_max_num_cols(self, zoom_level: int):
+        """
+        Get the number of columns of the TileMatrix at this zoom level.
+        """
+        return self._table.matrix_widths[self._table.check_zoom(zoom_level)]
+
+
+def parse_srid(crs: str | int) -> int:
+    """
+    Extract the EPSG code from 'EPSG:2056', 'urn:ogc:def:crs:EPSG::2056' or 'http://www.opengis.net/def/crs/EPSG/0/2056'.
+    """
+    if isinstance(crs, int):
+        return crs
+    match = re.search(r'(\d+)\s*$', crs)
+    if match is None:
+        raise ValueError(f"Cannot find an EPSG code in crs {crs}.")
+    return int(match.group(1))
+
+
+def _cell_size_from_scale(scale_denominator: float) -> float:
+    # round away the float noise of ScaleDenominator * 0.00028, e.g. 50.00000000000001
+    return float(f"{scale_denominator * WMTS_REF_PIXEL_SIZE_M:.10g}")
+
+
+def load_ech0056_json(path: str | Path) -> TileMatrixSet:
+    """
+    Load an OGC TileMatrixSet JSON like data/eCH-0056-LV95CellSizes-4-0.json.
+    """
+    with open(path, encoding="utf-8") as f:
+        definition = json.load(f)
+    matrices = [
+        TileMatrix(identifier=str(m['id']), scale_denominator=m['scaleDenominator'], cell_size=m['cellSize'],
+                   top_left_corner=m['pointOfOrigin'], tile_width=m['tileWidth'], tile_height=m['tileHeight'],
+                   matrix_width=m['matrixWidth'], matrix_height=m['matrixHeight'])
+        for m in definition['tileMatrices']
+    ]
+    return TileMatrixSet(identifier=definition['id'], srid=parse_srid(definition['crs']), matrices=matrices)
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def tile_matrix_set_from_element(element: ET.Element) -> TileMatrixSet:
+    """
+    Build a TileMatrixSet from a complete <TileMatrixSet> element of a WMTS capabilities document,
+    or of an OGC TileMatrixSet 2.0 XML like data/eCH-0056-LV95CellSizes-4-0.xml.
+    raise: ValueError if the definition is incomplete or not supported by the TileMatrixTable.
+    """
+    identifier = None
+    srid = None
+    matrices = []
+    for child in element:
+        tag = _local_name(child.tag)
+        if tag == 'Identifier':
+            identifier = child.text.strip()
+        elif tag == 'SupportedCRS':
+            srid = parse_srid(child.text.strip())
+        elif tag == 'CRS':
+            srid = parse_srid(''.join(child.itertext()).strip())
+        elif tag == 'TileMatrix':
+            values = {_local_name(e.tag): (e.text or '').strip() for e in child}
+            try:
+                scale_denominator = float(values['ScaleDenominator'])
+                cell_size = values.get('CellSize')
+                corner = values.get('TopLeftCorner') or values['PointOfOrigin']
+                matrices.append(TileMatrix(
+                    identifier=values['Identifier'], scale_denominator=scale_denominator,
+                    cell_size=float(cell_size) if cell_size else _cell_size_from_scale(scale_denominator),
+                    top_left_corner=[float(v) for v in corner.split()],
+                    tile_width=int(values['TileWidth']), tile_height=int(values['TileHeight']),
+                    matrix_width=int(values['MatrixWidth']), matrix_height=int(values['MatrixHeight'])))
+            except KeyError as error:
+                raise ValueError(f"TileMatrixSet {identifier}: TileMatrix without {error}.")
+    return TileMatrixSet(identifier=identifier, srid=srid, matrices=matrices)
+
+
+def load_tile_matrix_sets_xml(path: str | Path) -> list[TileMatrixSet]:
+    """
+    Load every TileMatrixSet of a WMTS capabilities document or of a TileMatrixSet XML fragment.
+    """
+    # imported here, the capabilities parser builds its TileMatrixSet with this module
+    from app.wmts.capabilitiesParser import parse_capabilities
+    return list(parse_capabilities(path).tile_matrix_sets.values())
+
+
+def load_tilecloud_grids(config: dict) -> list[TileMatrixSet]:
+    """
+    Build a TileMatrixSet for every entry of the grids: section of a tilecloud-chain configuration.
+    """
+    return [
+        TileMatrixSet.from_resolutions(name, grid['resolutions'], grid['bbox'], grid.get('srs', 'EPSG:2056'),
+                                       grid.get('tile_size', 256))
+        for name, grid in config.get('grids', {}).items()
+    ]
+
+
+_tile_matrix_sets: dict[str, TileMatrixSet] = {}
+_default_by_srid: dict[int, str] = {}
+# (matrix_set, zoom) of every registered TileMatrix -> (matrix_set, zoom) of the first registered identical one
+_canonical_matrices: dict[tuple[str, int], tuple[str, int]] = {}
+# canonical (matrix_set, zoom) -> {matrix_set: zoom} of all its identical TileMatrix
+_equivalent_matrices: dict[tuple[str, int], dict[str, int]] = {}
+
+
+def _matrix_signature(tile_matrix_set: TileMatrixSet, zoom: int) -> tuple:
+    # two TileMatrix with the same signature have the same tiles under the same (col, row)
+    t = tile_matrix_set.table
+    i = zoom - t.min_zoom
+    return (tile_matrix_set.srid, float(f"{t.cell_sizes[i]:.10g}"), t.origin_x, t.origin_y, t.tile_width,
+            t.tile_height, t.matrix_widths[i], t.matrix_heights[i])
+
+
+def _index_matrices():
+    # a handful of sets of a few dozen zoom levels, rebuilt from scratch on every registration
+    _canonical_matrices.clear()
+    _equivalent_matrices.clear()
+    by_signature: dict[tuple, tuple[str, int]] = {}
+    for identifier, tile_matrix_set in _tile_matrix_sets.items():
+        table = tile_matrix_set.table
+        for zoom in range(table.min_zoom, table.max_zoom + 1):
+            canonical = by_signature.setdefault(_matrix_signature(tile_matrix_set, zoom), (identifier, zoom))
+            _canonical_matrices[(identifier, zoom)] = canonical
+            _equivalent_matrices.setdefault(canonical, {})[identifier] = zoom
+
+
+def register_tile_matrix_set(tile_matrix_set: TileMatrixSet, default_for_srid: bool = False) -> TileMatrixSet:
+    """
+    Add (or replace) a TileMatrixSet in the process-wide registry.
+    param: default_for_srid: make it the one returned by get_tile_matrix_set(srid),
+           the first one registered for a srid is the default otherwise.
+    """
+    _tile_matrix_sets[tile_matrix_set.identifier] = tile_matrix_set
+    if default_for_srid or tile_matrix_set.srid not in _default_by_srid:
+        _default_by_srid[tile_matrix_set.srid] = tile_matrix_set.identifier
+    _index_matrices()
+    return tile_matrix_set
+
+
+def get_tile_matrix_set(name_or_srid: str | int) -> TileMatrixSet:
+    """
+    Get a registered TileMatrixSet by identifier (e.g. 'swissgrid_05') or by srid (2056 or 'EPSG:2056').
+    raise: ValueError if nothing matches.
+    """
+    if isinstance(name_or_srid, str) and name_or_srid in _tile_matrix_sets:
+        return _tile_matrix_sets[name_or_srid]
+    try:
+        srid = parse_srid(name_or_srid)
+    except ValueError:
+        srid = None
+    if srid in _default_by_srid:
+        return _tile_matrix_sets[_default_by_srid[srid]]
+    raise ValueError(f"Unknown TileMatrixSet {name_or_srid}. Available: {', '.join(_tile_matrix_sets)}.")
+
+
+def get_canonical_matrix(matrix_set: str, zoom: int) -> tuple[str, int]:
+    """
+    Get the (matrix_set, zoom) under which the tiles of a TileMatrix are stored: the first registered TileMatrix
+    with the same cell size, origin, tile size and matrix size, e.g. ('swissgrid_05', 0) for ('2056_28', 18).
+    raise: ValueError if the TileMatrixSet or its zoom level is unknown.
+    """
+    canonical = _canonical_matrices.get((matrix_set, zoom))
+    if canonical is None:
+        get_tile_matrix_set(matrix_set).table.check_zoom(zoom)
+        raise ValueError(f"Unknown TileMatrixSet {matrix_set}.")
+    return canonical
+
+
+def get_equivalent_zoom(matrix_set: str, zoom: int, target: str) -> int | None:
+    """
+    Get the zoom level of target whose TileMatrix is identical to the zoom level of matrix_set,
+    the tiles have the same col and row in both.
+    return: the zoom level, or None if target has no identical TileMatrix.
+    raise: ValueError if the TileMatrixSet or its zoom level is unknown.
+    """
+    return _equivalent_matrices[get_canonical_matrix(matrix_set, zoom)].get(target)
+
+
+def register_tilecloud_grids(config: dict) -> list[TileMatrixSet]:
+    return [register_tile_matrix_set(tms) for tms in load_tilecloud_grids(config)]
+
+
+SWISS_BBOX = [2420000.0, 1030000.0, 2900000.0, 1350000.0]
+
+# swissgrid_05, the grid of tilesmn95.lausanne.ch, see the grids: section of data/tilecloud-chain_config.yaml
+register_tile_matrix_set(TileMatrixSet.from_resolutions(
+    'swissgrid_05', [50, 20, 10, 5, 2.5, 1, 0.5, 0.25, 0.1, 0.05], SWISS_BBOX), default_for_srid=True)
+# 2056_28, the TileMatrixSet of https://wmts.geo.admin.ch/EPSG/2056/1.0.0/WMTSCapabilities.xml
+register_tile_matrix_set(TileMatrixSet.from_resolutions(
+    '2056_28', [4000, 3750, 3500, 3250, 3000, 2750, 2500, 2250, 2000, 1750, 1500, 1250, 1000, 750, 650, 500, 250,
+                100, 50, 20, 10, 5, 2.5, 2, 1.5, 1, 0.5, 0.25, 0.1], SWISS_BBOX))
@@ -1,5 +1,7 @@
 # Constants
 # based on the OGC standard, which is based on the assumption of a screen resolution of 90.7 DPI (dots per inch).
+from typing import NamedTuple
+
 from pydantic import conlist, BaseModel
 
 WMTS_REF_PIXEL_SIZE_M = 0.00028  # Reference pixel size in meters
@@ -11,6 +13,18 @@ class BBox(BaseModel):
         return f"{self.bbox[0]},{self.bbox[1]},{self.bbox[2]},{self.bbox[3]}"
 
 
+class TileKey(NamedTuple):
+    """
+    Identifies one tile image: the same key always designates the same bytes.
+    """
+    layer: str
+    dimension: str
+    matrix_set: str
+    zoom: int
+    col: int
+    row: int
+
+
 def get_scale_denominator(cell_size):
     """
     Get the scale denominator for a given cell_size (by zoom).
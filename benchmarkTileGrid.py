@@ -0,0 +1,68 @@
+"""
+Microbenchmark of the per-request tile bbox computation.
+ before: what the endpoints used to do, a new LausanneGrid per request, dict-of-dicts lookups,
+         float MatrixWidth comparisons and a validated pydantic BBox.
+ after:  the shared, read-only TileMatrixTable built once at startup.
+usage: python benchmarkTileGrid.py
+"""
+import timeit
+from typing import ClassVar
+
+from pydantic import BaseModel
+
+from app.wmts.tileMatrixSet import get_tile_matrix_set
+from app.wmts.utils import BBox
+
+zoom = 7
+col = 1838
+row = 3083
+coordinate_x = 2538817.0
+coordinate_y = 1163422.0
+number = 100_000
+
+
+class LegacyGrid(BaseModel):
+    # the shape of the historical LausanneGrid: class attributes and a dict-of-dicts of resolutions
+    top_left_x: ClassVar[float] = 2420000.0
+    top_left_y: ClassVar[float] = 1350000.0
+    tile_size: ClassVar[float] = 256
+    resolutions: ClassVar[dict] = get_tile_matrix_set('swissgrid_05').resolutions
+
+
+def legacy_tile_bbox(zoom_level: int, tile_col: int, tile_row: int) -> BBox:
+    grid = LegacyGrid()
+    resolutions = grid.resolutions
+    if zoom_level not in resolutions:
+        raise ValueError("Unsupported zoom level")
+    if tile_col < 0 or tile_col > resolutions[zoom_level]['MatrixWidth']:
+        raise ValueError("Invalid column index")
+    if tile_row < 0 or tile_row > resolutions[zoom_level]['MatrixHeight']:
+        raise ValueError("Invalid row index")
+    resolution = resolutions[zoom_level]['cellSize']
+    x_min = grid.top_left_x + tile_col * grid.tile_size * resolution
+    y_max = grid.top_left_y - tile_row * grid.tile_size * resolution
+    x_max = x_min + grid.tile_size * resolution
+    y_min = y_max - grid.tile_size * resolution
+    return BBox(bbox=[x_min, y_min, x_max, y_max])
+
+
+def legacy_tile_by_xy(x: float, y: float, zoom_level: int) -> BBox:
+    grid = LegacyGrid()
+    resolution = grid.resolutions[zoom_level]['cellSize']
+    tile_col = int((x - grid.top_left_x) / (grid.tile_size * resolution))
+    tile_row = int((grid.top_left_y - y) / (grid.tile_size * resolution))
+    return legacy_tile_bbox(zoom_level, tile_col, tile_row)
+
+
+def report(name: str, before, after):
+    t_before = min(timeit.repeat(before, number=number, repeat=3)) / number * 1e9
+    t_after = min(timeit.repeat(after, number=number, repeat=3)) / number * 1e9
+    print(f"{name:<22} before: {t_before:8.0f} ns/call  after: {t_after:8.0f} ns/call  speedup: x{t_before / t_after:.1f}")
+
+
+if __name__ == "__main__":
+    table = get_tile_matrix_set('swissgrid_05').table
+    assert list(legacy_tile_bbox(zoom, col, row).bbox) == list(table.get_tile_bbox(zoom, col, row))
+    report("get_tile_bbox", lambda: legacy_tile_bbox(zoom, col, row), lambda: table.get_tile_bbox(zoom, col, row))
+    report("get_tile + bbox by xy", lambda: legacy_tile_by_xy(coordinate_x, coordinate_y, zoom),
+           lambda: table.get_tile_bbox(zoom, *table.get_tile(coordinate_x, coordinate_y, zoom)))
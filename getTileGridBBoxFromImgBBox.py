@@ -19,30 +19,14 @@ logger.setLevel(logging.WARNING)         # Set the logger's level
 grid = LausanneGrid()
 
 
+imgBBox = [imgXMin, imgYMin, imgXMax, imgYMax]
 my_tileGridBboxByZoom = {}
-for currentZoom in range(0, grid.num_zoom_levels()):
-    logger.debug(f"## currentZoom={currentZoom}")
-    col,row = grid.get_tile(imgXMin, imgYMax, currentZoom)
-    logger.debug(f"col={col}, row={row}")
-    myBBox = grid.get_tile_bbox(currentZoom, col, row)
-    bbox = myBBox.bbox
-    #get the minX and maxY of the tile
-    tileGridMinX = bbox[0]
-    tileGridMaxY = bbox[3]
-    logger.info(f"## bboxTopLeft={bbox}")
-    col,row = grid.get_tile(imgXMax, imgYMin, currentZoom)
-    logger.debug(f"col={col}, row={row}")
-    myBBox = grid.get_tile_bbox(currentZoom, col, row)
-    bbox = myBBox.bbox
-    #get the maxX and minY of the tile
-    tileGridMaxX = bbox[2]
-    tileGridMinY = bbox[1]
-    logger.info(f"## bboxBottomRight={bbox}")
-    my_tileGridBboxByZoom[currentZoom] = [tileGridMinX, tileGridMinY, tileGridMaxX, tileGridMaxY]
+for currentZoom, tileRange in grid.get_tile_ranges(imgBBox).items():
+    logger.debug(f"## currentZoom={currentZoom}, tileRange={tileRange}")
+    my_tileGridBboxByZoom[currentZoom] = list(grid.table.get_tile_range_bbox(tileRange))
 
 logger.info(f"## imgBBox={imgXMin},{imgYMin},{imgXMax},{imgYMax}")
 print(f"## imgBBox={imgXMin},{imgYMin},{imgXMax},{imgYMax}")
-for z in range(0, grid.num_zoom_levels()):
-    print(f"## zoom={z}, bbox={my_tileGridBboxByZoom[z]}")
-
-
+for z, bbox in my_tileGridBboxByZoom.items():
+    print(f"## zoom={z}, bbox={bbox}")
+print(f"## number of tiles for all zoom levels: {grid.count_tiles(imgBBox)}")
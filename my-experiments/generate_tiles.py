@@ -1,150 +1,228 @@
+import argparse
+import io
+import math
 import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
+import numpy as np
 from osgeo import gdal
-import math
+from PIL import Image
 
-# Define the WMTS parameters
-TILE_SIZE = 256
-TILE_FORMAT = "image/png"
-WMS_VERSION = "1.3.0"
-SRS = "EPSG:2056"
-LAYER_NAME = "swissgrid"  # Replace with your layer name
-
-TOP_LEFT_X = 2420000
-TOP_LEFT_Y = 1350000
+# the experiments are run from this folder, the grid and the tile store come from the app package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
+from app.cache.diskCache import DiskTileCache  # noqa: E402
+from app.wms.metaTile import iter_meta_tile_ranges  # noqa: E402
+from app.wmts.lausanneGrid import LausanneGrid  # noqa: E402
+from app.wmts.tileMatrix import TileMatrixTable, TileRange  # noqa: E402
+from app.wmts.utils import TileKey  # noqa: E402
 
 # Define the GeoTIFF file path
 GEOTIFF_PATH = "../orthophotos/2538000_1152000.tif"  # Replace with your GeoTIFF file path
+LAYER_NAME = "orthophoto"
+# tiles read and resampled in one window by a worker, per side
+BLOCK_SIZE = 8
+
+
+class Source:
+    """
+    A GeoTIFF opened once per process, with its overviews.
+    The image must be in EPSG:2056 like the grid, reproject it once with gdalwarp otherwise.
+    """
+
+    def __init__(self, path: str):
+        self.dataset = gdal.Open(path, gdal.GA_ReadOnly)
+        self.x0, self.pixel_width, _, self.y0, _, pixel_height = self.dataset.GetGeoTransform()
+        self.pixel_height = -pixel_height
+        self.width = self.dataset.RasterXSize
+        self.height = self.dataset.RasterYSize
+        bands = [self.dataset.GetRasterBand(i + 1) for i in range(self.dataset.RasterCount)]
+        self.alpha_index = next((i for i, b in enumerate(bands) if b.GetColorInterpretation() == gdal.GCI_AlphaBand),
+                                None)
+        self.nodata = bands[0].GetNoDataValue()
+        # (decimation factor, bands) of the full resolution image and of each overview, finest first
+        self.levels = [(1.0, bands)]
+        for i in range(bands[0].GetOverviewCount()):
+            overviews = [b.GetOverview(i) for b in bands]
+            self.levels.append((self.width / overviews[0].XSize, overviews))
+        self.levels.sort(key=lambda level: level[0])
+
+    @property
+    def bbox(self) -> tuple[float, float, float, float]:
+        return (self.x0, self.y0 - self.height * self.pixel_height,
+                self.x0 + self.width * self.pixel_width, self.y0)
+
+    def get_srid(self) -> str | None:
+        srs = self.dataset.GetSpatialRef()
+        if srs is None:
+            return None
+        srs.AutoIdentifyEPSG()
+        return srs.GetAuthorityCode(None)
+
+    def read_rgba(self, bbox, cell_size: float, width: int, height: int) -> np.ndarray | None:
+        """
+        Resample the image on a grid of width x height pixels of cell_size meters covering bbox.
+        The coarsest overview still finer than cell_size is read in a single multi-band window,
+        averaged by the whole part of the remaining ratio and sampled to the target pixels.
+        return: (height, width, 4) uint8 RGBA array, transparent outside of the image, None if bbox misses it.
+        """
+        x_min, _, _, y_max = bbox
+        factor, bands = next(((f, b) for f, b in reversed(self.levels) if self.pixel_width * f <= cell_size * 1.001),
+                             self.levels[0])
+        res_x = self.pixel_width * factor
+        res_y = self.pixel_height * factor
+        level_width = bands[0].XSize
+        level_height = bands[0].YSize
+        col_min = max(0, math.floor((x_min - self.x0) / res_x))
+        col_max = min(level_width, math.ceil((x_min + width * cell_size - self.x0) / res_x))
+        row_min = max(0, math.floor((self.y0 - y_max) / res_y))
+        row_max = min(level_height, math.ceil((self.y0 - y_max + height * cell_size) / res_y))
+        if col_min >= col_max or row_min >= row_max:
+            return None
+        window = np.dstack([b.ReadAsArray(col_min, row_min, col_max - col_min, row_max - row_min) for b in bands])
+        valid = np.ones(window.shape[:2], dtype=bool)
+        if self.alpha_index is not None:
+            valid &= window[:, :, self.alpha_index] > 0
+            window = np.delete(window, self.alpha_index, axis=2)
+        if self.nodata is not None:
+            valid &= ~np.all(window == self.nodata, axis=2)
+        if window.shape[2] < 3:
+            window = np.repeat(window[:, :, :1], 3, axis=2)
+        window = window[:, :, :3]
+
+        # box filter by the whole part of the ratio, the rest is nearest neighbour
+        k = max(1, int(cell_size / res_x + 1e-6))
+        if k > 1:
+            h, w = window.shape[0] // k, window.shape[1] // k
+            if h == 0 or w == 0:
+                k = 1
+            else:
+                blocks = window[:h * k, :w * k].reshape(h, k, w, k, 3).astype(np.float32)
+                counts = valid[:h * k, :w * k].reshape(h, k, w, k).sum(axis=(1, 3))
+                weights = valid[:h * k, :w * k].reshape(h, k, w, k, 1)
+                sums = (blocks * weights).sum(axis=(1, 3))
+                window = np.where(counts[..., None] > 0, sums / np.maximum(counts, 1)[..., None], 0)
+                valid = counts > 0
+
+        # source index of the center of each target pixel
+        read_x0 = self.x0 + col_min * res_x
+        read_y0 = self.y0 - row_min * res_y
+        cols = np.floor((x_min + (np.arange(width) + 0.5) * cell_size - read_x0) / (res_x * k)).astype(np.int64)
+        rows = np.floor((read_y0 - (y_max - (np.arange(height) + 0.5) * cell_size)) / (res_y * k)).astype(np.int64)
+        col_ok = (cols >= 0) & (cols < window.shape[1])
+        row_ok = (rows >= 0) & (rows < window.shape[0])
+        cols = np.clip(cols, 0, window.shape[1] - 1)
+        rows = np.clip(rows, 0, window.shape[0] - 1)
+        rgba = np.zeros((height, width, 4), dtype=np.uint8)
+        rgba[:, :, :3] = np.clip(np.rint(window[rows[:, None], cols[None, :]]), 0, 255)
+        alpha = valid[rows[:, None], cols[None, :]] & row_ok[:, None] & col_ok[None, :]
+        rgba[:, :, 3] = np.where(alpha, 255, 0)
+        return rgba
+
+
+def encode_png(rgba: np.ndarray) -> bytes | None:
+    """
+    return: the png of a tile, RGB when fully opaque, None when fully transparent.
+    """
+    alpha = rgba[:, :, 3]
+    if not alpha.any():
+        return None
+    buffer = io.BytesIO()
+    if alpha.all():
+        Image.fromarray(rgba[:, :, :3], 'RGB').save(buffer, format='PNG')
+    else:
+        Image.fromarray(rgba, 'RGBA').save(buffer, format='PNG')
+    return buffer.getvalue()
 
-# Function to generate a WMTS tile from the GeoTIFF
-def generate_wmts_tile(geotiff_path, zoom, x, y):
-    # Open the GeoTIFF dataset
-    dataset = gdal.Open(geotiff_path, gdal.GA_ReadOnly)
-    geotransform = dataset.GetGeoTransform()
-    projection = dataset.GetProjection()
-
-    # Calculate tile bounds in EPSG:2056
-    tile_bbox = tile_to_bbox(zoom, x, y)
-
-    # Reproject tile bounds to GeoTIFF projection
-    source_srs = gdal.osr.SpatialReference()
-    source_srs.ImportFromEPSG(2056)
-    target_srs = gdal.osr.SpatialReference(wkt=projection)
-    transform = gdal.osr.CoordinateTransformation(source_srs, target_srs)
-    minX, minY, _ = transform.TransformPoint(tile_bbox[0], tile_bbox[1])
-    maxX, maxY, _ = transform.TransformPoint(tile_bbox[2], tile_bbox[3])
-
-    # Calculate pixel size and offset
-    pixel_size_x = (maxX - minX) / TILE_SIZE
-    pixel_size_y = (maxY - minY) / TILE_SIZE
-    offset_x = (minX - geotransform[0]) / geotransform[1]
-    offset_y = (minY - geotransform[3]) / geotransform[5]
-
-    # Read raster data for the tile
-    band = dataset.GetRasterBand(1)
-    tile_data = band.ReadAsArray(
-        int(offset_x), int(offset_y), TILE_SIZE, TILE_SIZE
-    )
-
-    # Create a new GeoTIFF dataset for the tile
-    driver = gdal.GetDriverByName("GTiff")
-    tile_dataset = driver.Create(
-        f"tile_{zoom}_{x}_{y}.tif",
-        TILE_SIZE,
-        TILE_SIZE,
-        1,
-        gdal.GDT_Byte,
-    )
-    tile_dataset.SetGeoTransform(
-        (
-            tile_bbox[0],
-            pixel_size_x,
-            0,
-            tile_bbox[3],
-            0,
-            -pixel_size_y,
-        )
-    )
-    tile_dataset.SetProjection(source_srs.ExportToWkt())
-    tile_band = tile_dataset.GetRasterBand(1)
-    tile_band.WriteArray(tile_data)
-    tile_band.FlushCache()
-
-    # Translate the tile to PNG
-    gdal.Translate(f"tile_{zoom}_{x}_{y}.png", tile_dataset, format="PNG")
-
-    # Close the datasets
-    tile_dataset = None
-    dataset = None
-
-# Function to calculate tile bounding box in EPSG:2056
-def tile_to_bbox(zoom, x, y):
-    # Define the origin and resolution for Swissgrid
-    origin_x = TOP_LEFT_X
-    origin_y = TOP_LEFT_Y
-    resolution = 1000 / math.pow(2, zoom)
-
-    minX = origin_x + x * TILE_SIZE * resolution
-    maxY = origin_y - y * TILE_SIZE * resolution
-    maxX = minX + TILE_SIZE * resolution
-    minY = maxY - TILE_SIZE * resolution
-    return [minX, minY, maxX, maxY]
 
+# state of a worker process, built once by _init_worker
+_worker = {}
+
+
+def _init_worker(geotiff_path: str, out_folder: str):
+    gdal.UseExceptions()
+    _worker["source"] = Source(geotiff_path)
+    _worker["table"] = LausanneGrid().table
+    _worker["store"] = DiskTileCache(out_folder)
+
+
+def cut_block(block: TileRange, layer: str, dimension: str, grid: str) -> int:
+    """
+    Read, resample and store the tiles of a block.
+    return: the number of tiles written, the transparent ones are skipped.
+    """
+    table: TileMatrixTable = _worker["table"]
+    i = table.check_zoom(block.zoom)
+    rgba = _worker["source"].read_rgba(table.get_tile_range_bbox(block), table.cell_sizes[i],
+                                       block.num_cols * table.tile_width, block.num_rows * table.tile_height)
+    if rgba is None:
+        return 0
+    tiles = {}
+    for zoom, col, row in block.tiles():
+        top = (row - block.min_row) * table.tile_height
+        left = (col - block.min_col) * table.tile_width
+        png = encode_png(rgba[top:top + table.tile_height, left:left + table.tile_width])
+        if png is not None:
+            tiles[TileKey(layer, dimension, grid, zoom, col, row)] = png
+    _worker["store"].put_many(tiles)
+    return len(tiles)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cut a GeoTIFF in EPSG:2056 into swissgrid_05 WMTS tiles, "
+                                                 "without any WMS server.")
+    parser.add_argument("geotiff", nargs="?", default=GEOTIFF_PATH)
+    parser.add_argument("--out", default="tiles", help="tile cache folder, in the tilecloud-chain layout")
+    parser.add_argument("--layer", default=LAYER_NAME)
+    parser.add_argument("--dimension", default="default")
+    parser.add_argument("--zoom", help="zoom level or range like 3-7, defaults to all the zooms "
+                                       "down to the resolution of the image")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
 
-# Example usage
-if __name__ == "__main__":
-    # open the GeoTIFF file passed as first argument if any
-    if len(sys.argv) > 1:
-        geotiff_path = sys.argv[1]
-    else:
-        # if no file is passed, use the default
-        geotiff_path = GEOTIFF_PATH
     # verify file is readable
-    if not os.access(geotiff_path, os.R_OK):
-        print(f"File {geotiff_path} not readable")
+    if not os.access(args.geotiff, os.R_OK):
+        print(f"File {args.geotiff} not readable")
         sys.exit(1)
     gdal.UseExceptions()
-    # try to open the dataset
     try:
-        dataset = gdal.Open(geotiff_path, gdal.GA_ReadOnly)
-        # get the projection
-        projection = dataset.GetProjection()
-        print(f"Projection: {projection}")
-        # get the geotransform
-        geotransform = dataset.GetGeoTransform()
-        print(f"GeoTransform: {geotransform}")
-        # get the top left corner and pixel size and convert to number
-        topLeftImgX = geotransform[0]
-        topLeftImgY = geotransform[3]
-        pixelSizeX = geotransform[1]
-        pixelSizeY = geotransform[5]
-        #check if the geotransform is valid and equal to swiss srid 2056
-        if topLeftImgX < TOP_LEFT_X and topLeftImgY > TOP_LEFT_Y:
-            print(f"Geotransform not valid, expected {topLeftImgX} >= {TOP_LEFT_X}, and {topLeftImgY} <= {TOP_LEFT_Y}")
-            sys.exit(1)
-        # get the width and height
-        width = dataset.RasterXSize
-        height = dataset.RasterYSize
-        print(f"Width: {width} pixel, Height: {height}")
-        #get the bounding box of the image
-        minX = topLeftImgX
-        maxY = topLeftImgY
-        maxX = topLeftImgX + width * pixelSizeX
-        minY = topLeftImgY + height * pixelSizeY
-        print(f"Image bounding box minX,minY,maxX,maxY : {minX}, {minY}, {maxX}, {maxY}")
-    except Exception as e:
+        source = Source(args.geotiff)
+    except RuntimeError as e:
         print(f"Error opening gdal dataset: {e}")
         sys.exit(1)
+    srid = source.get_srid()
+    if srid != "2056":
+        print(f"Projection EPSG:{srid} not supported, reproject the image to EPSG:2056 first with gdalwarp")
+        sys.exit(1)
+    grid = LausanneGrid()
+    table = grid.table
+    print(f"Image bounding box minX,minY,maxX,maxY : {source.bbox}, pixel size {source.pixel_width}, "
+          f"{len(source.levels) - 1} overviews")
+    if args.zoom:
+        first, _, last = args.zoom.partition("-")
+        zooms = range(int(first), int(last or first) + 1)
+    else:
+        finest = next((z for z in range(table.min_zoom, table.max_zoom + 1)
+                       if table.cell_sizes[z - table.min_zoom] <= source.pixel_width * 1.001), table.max_zoom)
+        zooms = range(table.min_zoom, finest + 1)
+
+    start = time.monotonic()
+    total = 0
+    with ProcessPoolExecutor(args.processes, initializer=_init_worker, initargs=(args.geotiff, args.out)) as pool:
+        for zoom in zooms:
+            tile_range = table.get_tile_range(source.bbox, zoom)
+            if tile_range is None:
+                continue
+            cut = partial(cut_block, layer=args.layer, dimension=args.dimension, grid=grid.identifier)
+            written = sum(pool.map(cut, iter_meta_tile_ranges(tile_range, BLOCK_SIZE), chunksize=4))
+            total += written
+            print(f"zoom {zoom}: {written}/{tile_range.count} tiles, "
+                  f"{total / (time.monotonic() - start):.0f} tiles/s")
 
 
-    # for now exit
-    sys.exit(0)
-    # Generate tiles for zoom levels 0 to 5 and a specific tile range
-    #for zoom in range(0, 2):
-    #    for x in range(0, 2**zoom):
-    #        for y in range(0, 2**zoom):
-    #            generate_wmts_tile(GEOTIFF_PATH, zoom, x, y)
-
-    # Generate GetCapabilities XML
+# Example usage
+if __name__ == "__main__":
+    main()
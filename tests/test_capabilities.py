@@ -0,0 +1,61 @@
+import gzip
+
+import pytest
+
+from app.config import get_cache_http_url, load_tilecloud_config
+from app.wmts.capabilities import WmtsCapabilities, choose_encoding
+
+
+def test_base_url_of_the_configuration():
+    config = {"generation": {"default_cache": "local"},
+              "caches": {"local": {"http_url": "${VISIBLE_WEB_PROTOCOL}://${VISIBLE_WEB_HOST}/"},
+                         "public": {"http_url": "https://tiles.example.ch/"}}}
+    assert get_cache_http_url(config, "public") == "https://tiles.example.ch/"
+    # a variable missing from the environment
+    assert get_cache_http_url(config) is None
+    assert get_cache_http_url(config, "unknown") is None
+
+
+def test_document_is_rendered_once_under_the_base_url():
+    capabilities = WmtsCapabilities(load_tilecloud_config(), "https://tiles.example.ch/service")
+    document = capabilities.get()
+    assert capabilities.get() is document
+    assert capabilities.renders == 1
+    body = document.bodies["identity"].decode()
+    assert 'template="https://tiles.example.ch/service/1.0.0/fonds_geo_osm_bdcad_couleur/' in body
+    assert "https://tiles.example.ch/service/1.0.0/WMTSCapabilities.xml" in body
+
+
+def test_no_base_url():
+    with pytest.raises(ValueError):
+        WmtsCapabilities(load_tilecloud_config(), None).get()
+
+
+def test_etag_by_encoding():
+    document = WmtsCapabilities(load_tilecloud_config(), "https://tiles.example.ch/").get()
+    assert gzip.decompress(document.bodies["gzip"]) == document.bodies["identity"]
+    assert len(set(document.etags.values())) == len(document.bodies)
+    assert document.etags["gzip"] == document.etags["identity"][:-1] + '-gzip"'
+    for etag in document.etags.values():
+        assert document.is_not_modified(etag)
+        assert document.is_not_modified(f'"other", W/{etag}')
+    assert document.is_not_modified("*")
+    assert not document.is_not_modified('"other"')
+    assert not document.is_not_modified(None)
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    (None, "identity"),
+    ("gzip, deflate", "gzip"),
+    ("gzip, deflate, br", "br"),
+    ("br;q=0, gzip", "gzip"),
+    ("*", "br"),
+    ("*, br;q=0", "gzip"),
+    ("identity", "identity"),
+])
+def test_choose_encoding(accept_encoding, expected):
+    assert choose_encoding(accept_encoding, ("identity", "gzip", "br")) == expected
+
+
+def test_choose_encoding_without_brotli():
+    assert choose_encoding("br, gzip", ("identity", "gzip")) == "gzip"
@@ -0,0 +1,44 @@
+import io
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import pytest
+
+from app.wmts.capabilitiesParser import parse_capabilities
+
+DATA = Path(__file__).parent.parent / "data"
+
+
+def test_layers_and_tile_matrix_sets_of_the_document():
+    index = parse_capabilities(DATA / "WMTSCapabilities.xml")
+    assert index.title == "WMTS Lausanne"
+    assert len(index.layers) == 97
+    layer = index.get_layer("fonds_geo_osm_bdcad_couleur")
+    assert layer.title == "Plan ville"
+    assert layer.formats == ["image/png"] and layer.tile_matrix_sets == ["swissgrid_05"]
+    assert layer.dimensions["DATE"].default == "2021"
+    table = index.tile_matrix_sets["swissgrid_05"].table
+    assert (table.origin_x, table.origin_y) == (2420000.0, 1350000.0)
+    assert table.cell_sizes[0] == 50.0 and table.cell_sizes[-1] == 0.05
+    with pytest.raises(ValueError):
+        index.get_layer("unknown")
+
+
+def test_get_tile_url_fills_the_defaults():
+    layer = parse_capabilities(DATA / "WMTSCapabilities.xml").get_layer("fonds_geo_osm_bdcad_couleur")
+    assert layer.get_tile_url("swissgrid_05", 3, 4, 5) == \
+        "https://cartotest.lausanne.ch/tiles/1.0.0/fonds_geo_osm_bdcad_couleur/default/2021/swissgrid_05/3/5/4.png"
+    assert "/default/2019/swissgrid_05/" in layer.get_tile_url("swissgrid_05", 3, 4, 5, DATE="2019")
+    with pytest.raises(ValueError):
+        layer.get_tile_url("swissgrid_05", 3, 4, 5, image_format="image/jpeg")
+
+
+def test_fragment_of_tile_matrix_sets():
+    index = parse_capabilities(DATA / "tileMatrixSet.xml")
+    assert index.layers == {}
+    assert list(index.tile_matrix_sets) == ["swissgrid_05", "swissgrid_05_zoom0_8", "testgrid_zoom0_9"]
+
+
+def test_not_well_formed():
+    with pytest.raises(ET.ParseError):
+        parse_capabilities(io.BytesIO(b"<Capabilities><Contents></Capabilities>"))
@@ -0,0 +1,141 @@
+import os
+
+from app.cache.diskCache import DiskTileCache
+from app.cache.tileStore import tile_digest
+from app.wmts.utils import TileKey
+
+
+def key(col: int, row: int = 0, zoom: int = 5) -> TileKey:
+    return TileKey("layer", "2021", "swissgrid_05", zoom, col, row)
+
+
+def tile(n: int, size: int = 100) -> bytes:
+    return bytes([n % 256]) * size
+
+
+def test_put_get_in_the_tilecloud_chain_layout(tmp_path):
+    cache = DiskTileCache(str(tmp_path))
+    cache.put(key(3, 7), tile(1))
+    path = tmp_path / "1.0.0" / "layer" / "default" / "2021" / "swissgrid_05" / "5" / "7" / "3.png"
+    assert cache.get_file(key(3, 7)) == str(path)
+    assert path.read_bytes() == tile(1)
+    assert cache.get(key(3, 7)) == tile(1)
+    assert cache.get(key(4, 7)) is None
+    assert list(cache.iter_keys()) == [key(3, 7)]
+    assert cache.delete(key(3, 7))
+    assert not cache.delete(key(3, 7))
+    assert cache.get(key(3, 7)) is None
+
+
+def test_unbounded_cache_keeps_no_index(tmp_path):
+    cache = DiskTileCache(str(tmp_path))
+    for col in range(10):
+        cache.put(key(col), tile(col))
+    assert cache.stats()["tiles"] is None
+    assert cache.evictions == 0
+
+
+def test_eviction_of_the_least_recently_used(tmp_path):
+    cache = DiskTileCache(str(tmp_path), max_bytes=350)
+    for col in range(3):
+        cache.put(key(col), tile(col))
+    # the first tile is used again, the second one is now the oldest
+    assert cache.get(key(0)) == tile(0)
+    cache.put(key(3), tile(3))
+    assert cache.evictions == 1
+    assert cache.size_bytes == 300
+    assert cache.get(key(1)) is None
+    assert not os.path.exists(cache.get_path(key(1)))
+    assert all(cache.get(key(col)) == tile(col) for col in (0, 2, 3))
+
+
+def test_rewriting_a_tile_counts_it_once(tmp_path):
+    cache = DiskTileCache(str(tmp_path), max_bytes=1000)
+    cache.put(key(0), tile(0))
+    cache.put(key(0), tile(1, 200))
+    assert cache.size_bytes == 200
+    assert cache.stats()["tiles"] == 1
+    assert cache.delete(key(0))
+    assert cache.size_bytes == 0
+
+
+def test_load_index_evicts_down_to_the_budget(tmp_path):
+    writer = DiskTileCache(str(tmp_path))
+    for col in range(5):
+        writer.put(key(col), tile(col))
+        path = writer.get_path(key(col))
+        # col 0 is the least recently accessed
+        os.utime(path, (1000 + col, 1000 + col))
+    cache = DiskTileCache(str(tmp_path), max_bytes=300)
+    cache.load_index()
+    assert cache.stats()["tiles"] == 3
+    assert cache.size_bytes == 300
+    assert sorted(k.col for k in cache.iter_keys()) == [2, 3, 4]
+
+
+def test_evicted_tile_written_again_is_kept(tmp_path):
+    cache = DiskTileCache(str(tmp_path), max_bytes=150)
+    cache.put(key(0), tile(0))
+    victims = [(key(0), os.stat(cache.get_path(key(0))).st_ino)]
+    # written again by another worker between the eviction and the removal of its file
+    cache.put(key(0), tile(5))
+    cache._remove_evicted(victims)
+    assert cache.get(key(0)) == tile(5)
+
+
+def test_identical_tiles_share_one_blob(tmp_path):
+    cache = DiskTileCache(str(tmp_path), max_bytes=1000, link_blobs=True)
+    for col in range(5):
+        cache.put(key(col), tile(0))
+    cache.put(key(5), tile(1))
+    inodes = {os.stat(cache.get_path(key(col))).st_ino for col in range(5)}
+    assert len(inodes) == 1
+    assert cache.linked == 6
+    # the budget counts each distinct tile once
+    assert cache.size_bytes == 200
+    assert cache.stats()["distinct_tiles"] == 2
+
+
+def test_blob_goes_with_its_last_tile(tmp_path):
+    cache = DiskTileCache(str(tmp_path), max_bytes=1000, link_blobs=True)
+    cache.put(key(0), tile(0))
+    cache.put(key(1), tile(0))
+    blob_path = cache.get_blob_path(tile_digest(tile(0)))
+    assert os.path.isfile(blob_path)
+    assert cache.delete(key(0))
+    assert os.path.isfile(blob_path)
+    assert cache.size_bytes == 100
+    assert cache.delete(key(1))
+    assert not os.path.exists(blob_path)
+    assert cache.size_bytes == 0
+
+
+def test_eviction_of_shared_blobs(tmp_path):
+    cache = DiskTileCache(str(tmp_path), max_bytes=250, link_blobs=True)
+    cache.put(key(0), tile(0))
+    cache.put(key(1), tile(1))
+    cache.put(key(2), tile(0))
+    # the shared blob is still used by key(2) after the eviction of key(0)
+    cache.put(key(3), tile(3))
+    assert cache.get(key(0)) is None
+    assert cache.get(key(2)) == tile(0)
+    assert cache.size_bytes <= 250
+
+
+def test_remove_orphan_blobs(tmp_path):
+    cache = DiskTileCache(str(tmp_path), link_blobs=True)
+    cache.put(key(0), tile(0))
+    cache.put(key(1), tile(1))
+    # removed by another tool, the blob is left alone
+    os.unlink(cache.get_path(key(0)))
+    assert cache.remove_orphan_blobs() == 1
+    assert not os.path.exists(cache.get_blob_path(tile_digest(tile(0))))
+    assert cache.get(key(1)) == tile(1)
+
+
+def test_blobs_are_opt_in(tmp_path):
+    cache = DiskTileCache(str(tmp_path))
+    cache.put(key(0), tile(0))
+    cache.put(key(1), tile(0))
+    assert not (tmp_path / "blobs").exists()
+    assert os.stat(cache.get_path(key(0))).st_nlink == 1
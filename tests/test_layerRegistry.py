@@ -0,0 +1,65 @@
+import pytest
+
+from app.config import load_tilecloud_config
+from app.layerRegistry import LayerRegistry, build_layer
+
+CONFIG = {"grid": "swissgrid_05", "layers": "a,b", "bbox": [2530000, 1145000, 2550000, 1165000],
+          "empty_tile_detection": {"size": 116, "hash": "abc"}, "headers": {"Host": "wms.example.ch"}}
+
+
+def test_build_layer():
+    layer = build_layer("layer", CONFIG, "http://wms.test/wms")
+    assert (layer.title, layer.grid, layer.wms_layers, layer.extension, layer.mime_type) == \
+        ("layer", "swissgrid_05", "a,b", "png", "image/png")
+    assert layer.bbox == (2530000.0, 1145000.0, 2550000.0, 1165000.0)
+    assert layer.empty_tile.size == 116 and layer.empty_metatile is None
+    assert layer.get_map.prefix.startswith("http://wms.test/wms?SERVICE=WMS&")
+    assert "LAYERS=a%2Cb" in layer.get_map.prefix and "CRS=EPSG%3A2056" in layer.get_map.prefix
+    assert layer.get_map.headers == {"Host": "wms.example.ch"}
+
+
+def test_url_of_the_layer_before_the_backend():
+    layer = build_layer("layer", CONFIG | {"url": "http://mapserver.test/wms"}, "http://wms.test/wms")
+    assert layer.get_map.prefix.startswith("http://mapserver.test/wms?")
+
+
+def test_layer_without_backend():
+    layer = build_layer("layer", CONFIG)
+    assert layer.get_map is None
+    with pytest.raises(ValueError):
+        layer.check_get_map()
+
+
+def test_unknown_grid():
+    with pytest.raises(ValueError):
+        build_layer("layer", CONFIG | {"grid": "unknown"}, "http://wms.test/wms")
+
+
+def test_registry_of_the_configuration():
+    registry = LayerRegistry.from_config(load_tilecloud_config(), "http://wms.test/wms")
+    assert "fonds_geo_osm_bdcad_couleur" in registry
+    assert all(layer.get_map is not None for layer in registry if layer.wms_layers)
+    with pytest.raises(ValueError):
+        registry.get("unknown")
+
+
+def test_dimension_values():
+    dimensions = [{"name": "DATE", "default": 2021, "values": ["2019", "2025"]}]
+    layer = build_layer("layer", CONFIG | {"dimensions": dimensions}, "http://wms.test/wms")
+    # the default value is served even when the values do not list it
+    assert layer.dimension_values == ("2021", "2019", "2025")
+    assert layer.check_dimension(None) == "2021"
+    assert layer.check_dimension("2019") == "2019"
+    with pytest.raises(ValueError):
+        layer.check_dimension("2020")
+    assert "DATE=2021" in layer.check_get_map().prefix
+    assert "DATE=2025" in layer.check_get_map("2025").prefix
+
+
+def test_layer_without_dimension():
+    layer = build_layer("layer", CONFIG, "http://wms.test/wms")
+    assert (layer.dimension_name, layer.dimension_values) == (None, ("default",))
+    assert layer.check_dimension(None) == "default"
+    with pytest.raises(ValueError):
+        layer.check_dimension("2021")
+    assert "DATE" not in layer.get_map.prefix
@@ -0,0 +1,84 @@
+import io
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app import main
+from app.cache.diskCache import DiskTileCache
+from app.layerRegistry import LayerRegistry, build_layer
+from app.wms.wms import WmsClient
+
+
+def test_no_budget_in_the_cache_folder_of_tilecloud_chain(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "tilecloud_cache_folder", str(tmp_path / "tilecloud"))
+    monkeypatch.delenv("TILE_CACHE_DIR", raising=False)
+    monkeypatch.delenv("TILE_STORE", raising=False)
+    monkeypatch.setenv("TILE_CACHE_MAX_BYTES", "1000000")
+    with pytest.raises(ValueError):
+        main.get_tile_store()
+    monkeypatch.setenv("TILE_CACHE_DIR", str(tmp_path / "service"))
+    store = main.get_tile_store()
+    assert isinstance(store, DiskTileCache) and store.max_bytes == 1000000
+    # without budget, the tree of tilecloud-chain is shared
+    monkeypatch.delenv("TILE_CACHE_DIR")
+    monkeypatch.setenv("TILE_CACHE_MAX_BYTES", "0")
+    assert main.get_tile_store().folder == str(tmp_path / "tilecloud")
+
+
+def png_of_the_date(request: httpx.Request) -> httpx.Response:
+    # a uniform tile whose red is the last two digits of the DATE asked
+    buffer = io.BytesIO()
+    Image.new("RGBA", (256, 256), (int(request.url.params["DATE"]) % 100, 0, 0, 255)).save(buffer, "PNG")
+    return httpx.Response(200, content=buffer.getvalue(), headers={"content-type": "image/png"})
+
+
+def red(data: bytes) -> int:
+    with Image.open(io.BytesIO(data)) as image:
+        return image.convert("RGBA").getpixel((0, 0))[0]
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    urls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        urls.append(str(request.url))
+        return png_of_the_date(request)
+
+    def wms_client(**kwargs) -> WmsClient:
+        client = WmsClient(**kwargs)
+        client.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        return client
+
+    layer = build_layer("dated", {"grid": "swissgrid_05", "layers": "a", "bbox": [2530000, 1145000, 2550000, 1165000],
+                                  "dimensions": [{"name": "DATE", "default": "2021", "values": ["2019", "2021"]}]},
+                        "http://wms.test/wms")
+    monkeypatch.setattr(main, "WmsClient", wms_client)
+    monkeypatch.setattr(main, "layer_registry", LayerRegistry([layer]))
+    monkeypatch.setattr(main, "tilecloud_cache_folder", None)
+    monkeypatch.setenv("TILE_CACHE_DIR", str(tmp_path))
+    monkeypatch.delenv("TILE_STORE", raising=False)
+    monkeypatch.delenv("TILE_CACHE_MAX_BYTES", raising=False)
+    monkeypatch.setenv("TILE_PROCESS_WORKERS", "0")
+    monkeypatch.setenv("PREFETCH_WORKERS", "0")
+    with TestClient(main.app) as test_client:
+        test_client.urls = urls
+        yield test_client
+
+
+def test_each_value_of_the_dimension_has_its_tiles(client, tmp_path):
+    assert red(client.get("/tiles/dated/5/457/773").content) == 21
+    assert red(client.get("/tiles/dated/5/457/773", params={"dimension": "2019"}).content) == 19
+    assert red(client.get("/1.0.0/dated/default/2019/swissgrid_05/5/773/457.png").content) == 19
+    assert red(client.get("/1.0.0/dated/default/2021/swissgrid_05/5/773/457.png").content) == 21
+    # one GetMap by value, then the caches
+    assert len(client.urls) == 2
+    assert sorted(path.name for path in (tmp_path / "1.0.0" / "dated" / "default").iterdir()) == ["2019", "2021"]
+
+
+def test_value_not_served(client):
+    assert client.get("/tiles/dated/5/457/773", params={"dimension": "2020"}).status_code == 400
+    assert client.get("/1.0.0/dated/default/2020/swissgrid_05/5/773/457.png").status_code == 400
+    assert client.urls == []
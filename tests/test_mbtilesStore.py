@@ -0,0 +1,186 @@
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from app.cache.diskCache import DiskTileCache
+from app.cache.mbtilesStore import MBTilesStore, convert_directory
+from app.wmts.tileMatrix import TileRange
+from app.wmts.utils import TileKey
+
+
+def key(col: int, row: int = 0, zoom: int = 5, dimension: str = "2021") -> TileKey:
+    return TileKey("layer", dimension, "swissgrid_05", zoom, col, row)
+
+
+def count(store: MBTilesStore, table: str, dimension: str = "2021") -> int:
+    with sqlite3.connect(store.get_path(key(0, dimension=dimension))) as conn:
+        conn.execute("ATTACH DATABASE ? AS shared", (os.path.join(store.folder, "layer", "images.db"),))
+        return conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+
+
+def refs(store: MBTilesStore) -> dict[bytes, int]:
+    with sqlite3.connect(os.path.join(store.folder, "layer", "images.db")) as conn:
+        return dict(conn.execute("SELECT tile_data, refs FROM images"))
+
+
+def test_put_get_one_file_by_layer_dimension_and_grid(tmp_path):
+    store = MBTilesStore(str(tmp_path))
+    store.put(key(1, 2), b"a")
+    store.put(key(1, 2, dimension="2025"), b"b")
+    assert store.get(key(1, 2)) == b"a"
+    assert store.get(key(1, 2, dimension="2025")) == b"b"
+    assert store.get(key(2, 2)) is None
+    store.close()
+    assert (tmp_path / "layer" / "2021" / "swissgrid_05.mbtiles").is_file()
+    assert (tmp_path / "layer" / "2025" / "swissgrid_05.mbtiles").is_file()
+    # the images of the layer are in a database of their own, named by the metadata
+    with sqlite3.connect(tmp_path / "layer" / "2021" / "swissgrid_05.mbtiles") as conn:
+        images = conn.execute("SELECT value FROM metadata WHERE name = 'images'").fetchone()[0]
+        conn.execute("ATTACH DATABASE ? AS shared", (str(tmp_path / "layer" / "2021" / images),))
+        assert conn.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM map "
+                            "JOIN shared.images USING (tile_id)").fetchall() == [(5, 1, 2, b"a")]
+
+
+def test_buffered_tiles_are_readable_before_the_commit(tmp_path):
+    store = MBTilesStore(str(tmp_path), batch_size=10)
+    for col in range(5):
+        store.put(key(col), bytes([col]))
+    assert count(store, "map") == 0
+    assert store.get(key(3)) == bytes([3])
+    assert store.stats()["pending"] == 5
+    for col in range(5, 10):
+        store.put(key(col), bytes([col]))
+    assert count(store, "map") == 10
+    assert store.stats()["pending"] == 0
+
+
+def test_reopen(tmp_path):
+    store = MBTilesStore(str(tmp_path))
+    store.put_many({key(col): bytes([col]) for col in range(20)}, flush=False)
+    store.close()
+    store = MBTilesStore(str(tmp_path))
+    assert all(store.get(key(col)) == bytes([col]) for col in range(20))
+    assert sorted(k.col for k in store.iter_keys()) == list(range(20))
+    assert store.stats()["hits"] == 20
+
+
+def test_delete(tmp_path):
+    store = MBTilesStore(str(tmp_path), batch_size=100)
+    store.put_many({key(col): bytes([col]) for col in range(3)})
+    store.put(key(9), b"buffered")
+    assert store.delete_many([key(0), key(9), key(5), key(0, dimension="1999")]) == 2
+    assert store.get(key(0)) is None
+    assert store.get(key(9)) is None
+    assert store.delete(key(1))
+    assert not store.delete(key(1))
+    assert [k.col for k in store.iter_keys()] == [2]
+
+
+def test_iter_keys_in_range(tmp_path):
+    store = MBTilesStore(str(tmp_path))
+    store.put_many({key(col, row): b"x" for col in range(5) for row in range(5)}, flush=False)
+    keys = store.iter_keys_in_range("layer", "2021", "swissgrid_05", TileRange(5, 1, 2, 2, 4))
+    assert sorted((k.col, k.row) for k in keys) == [(1, 2), (1, 3), (1, 4), (2, 2), (2, 3), (2, 4)]
+    assert list(store.iter_keys_in_range("layer", "2025", "swissgrid_05", TileRange(5, 0, 0, 9, 9))) == []
+
+
+def test_convert_directory(tmp_path):
+    disk_cache = DiskTileCache(str(tmp_path / "tiles"))
+    for col in range(7):
+        disk_cache.put(key(col), bytes([col]))
+    assert convert_directory(disk_cache, MBTilesStore(str(tmp_path / "mbtiles")), batch_size=3) == 7
+    store = MBTilesStore(str(tmp_path / "mbtiles"))
+    assert all(store.get(key(col)) == bytes([col]) for col in range(7))
+
+
+def test_identical_tiles_share_one_image(tmp_path):
+    store = MBTilesStore(str(tmp_path))
+    store.put_many({key(col): b"lake" if col % 2 else b"forest" for col in range(10)})
+    assert count(store, "map") == 10
+    assert count(store, "images") == 2
+    assert store.get(key(3)) == b"lake"
+    assert store.get(key(4)) == b"forest"
+
+
+def test_image_goes_with_its_last_tile(tmp_path):
+    store = MBTilesStore(str(tmp_path))
+    store.put_many({key(0): b"lake", key(1): b"lake", key(2): b"forest"})
+    assert store.delete_many([key(0), key(2)]) == 2
+    assert count(store, "images") == 1
+    assert store.get(key(1)) == b"lake"
+    assert store.delete(key(1))
+    assert count(store, "images") == 0
+
+
+def test_rewritten_tile_points_to_its_new_image(tmp_path):
+    store = MBTilesStore(str(tmp_path))
+    store.put(key(0), b"old")
+    store.flush()
+    store.put(key(0), b"new")
+    store.flush()
+    assert store.get(key(0)) == b"new"
+    assert count(store, "map") == 1
+    assert count(store, "images") == 1
+
+
+def test_vintages_share_the_images_of_the_layer(tmp_path):
+    store = MBTilesStore(str(tmp_path))
+    store.put_many({key(col): b"same" for col in range(3)})
+    store.put_many({key(col, dimension="2025"): b"same" for col in range(3)})
+    store.put_many({key(3, dimension="2025"): b"new"})
+    assert refs(store) == {b"same": 6, b"new": 1}
+    # deleting the tiles of a vintage keeps the images of the other one
+    assert store.delete_many([key(col) for col in range(3)]) == 3
+    assert refs(store) == {b"same": 3, b"new": 1}
+    assert store.get(key(0, dimension="2025")) == b"same"
+    assert store.delete_many([key(col, dimension="2025") for col in range(4)]) == 4
+    assert refs(store) == {}
+
+
+def test_rewriting_the_same_tile_keeps_its_reference(tmp_path):
+    store = MBTilesStore(str(tmp_path))
+    store.put_many({key(0): b"lake", key(1): b"lake"})
+    store.put_many({key(0): b"lake", key(1): b"forest"})
+    assert refs(store) == {b"lake": 1, b"forest": 1}
+    store.close()
+    # an image lost by a crash between the two commits comes back with the next write of its tile
+    with sqlite3.connect(tmp_path / "layer" / "images.db") as conn:
+        conn.execute("DELETE FROM images WHERE tile_data = ?", (b"lake",))
+    store = MBTilesStore(str(tmp_path))
+    assert store.get(key(0)) is None
+    store.put_many({key(0): b"lake"})
+    assert store.get(key(0)) == b"lake"
+    assert refs(store) == {b"lake": 1, b"forest": 1}
+
+
+def test_format_is_the_extension_of_the_layer(tmp_path):
+    store = MBTilesStore(str(tmp_path), extensions={"layer": "jpeg"})
+    store.put(key(0), b"x")
+    store.put(TileKey("other", "2021", "swissgrid_05", 5, 0, 0), b"y")
+    store.close()
+    for layer, extension in (("layer", "jpeg"), ("other", "png")):
+        with sqlite3.connect(tmp_path / layer / "2021" / "swissgrid_05.mbtiles") as conn:
+            assert conn.execute("SELECT value FROM metadata WHERE name = 'format'").fetchone()[0] == extension
+
+
+def test_close_closes_the_readers_of_all_threads(tmp_path):
+    store = MBTilesStore(str(tmp_path))
+    store.put(key(0), b"x")
+    store.flush()
+    readers = []
+
+    def read():
+        assert store.get(key(0)) == b"x"
+        readers.append(store._files[("layer", "2021", "swissgrid_05")].reader())
+
+    thread = threading.Thread(target=read)
+    thread.start()
+    thread.join()
+    read()
+    store.close()
+    assert len(readers) == 2 and readers[0] is not readers[1]
+    for conn in readers:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
@@ -0,0 +1,58 @@
+from app.cache.memoryCache import MemoryTileCache
+from app.wmts.utils import TileKey
+
+
+def key(col: int) -> TileKey:
+    return TileKey("layer", "default", "swissgrid_05", 5, col, 0)
+
+
+def test_budget_in_bytes():
+    cache = MemoryTileCache(100)
+    for col in range(4):
+        cache.put(key(col), bytes([col]) * 30)
+    # the fourth tile pushes the oldest one out
+    assert cache.size_bytes == 90
+    assert key(0) not in cache and len(cache) == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_get_refreshes_the_tile():
+    cache = MemoryTileCache(100)
+    for col in range(3):
+        cache.put(key(col), bytes([col]) * 30)
+    assert cache.get(key(0)) == bytes([0]) * 30
+    cache.put(key(3), bytes([3]) * 30)
+    assert key(0) in cache and key(1) not in cache
+    assert cache.get(key(1)) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_replace_and_delete_give_their_bytes_back():
+    cache = MemoryTileCache(100)
+    cache.put(key(0), b"a" * 30)
+    cache.put(key(0), b"b" * 50)
+    assert cache.size_bytes == 50 and len(cache) == 1
+    assert cache.delete(key(0))
+    assert not cache.delete(key(0))
+    assert cache.size_bytes == 0
+
+
+def test_tile_larger_than_the_budget_is_not_kept():
+    cache = MemoryTileCache(100)
+    cache.put(key(0), b"a" * 30)
+    cache.put(key(1), b"b" * 101)
+    assert key(1) not in cache and key(0) in cache
+    assert cache.size_bytes == 30
+
+
+def test_identical_tiles_are_counted_once():
+    cache = MemoryTileCache(100)
+    for col in range(10):
+        cache.put(key(col), b"lake" * 10)
+    cache.put(key(10), b"forest" * 5)
+    assert cache.size_bytes == 70 and len(cache) == 11
+    assert cache.get(key(3)) is cache.get(key(7))
+    for col in range(10):
+        cache.delete(key(col))
+    assert cache.size_bytes == 30
+    assert cache.stats()["blobs"] == 1
@@ -0,0 +1,72 @@
+import io
+
+import pytest
+from PIL import Image
+
+from app.wms.metaTile import get_meta_tile_range, iter_meta_tile_ranges, slice_meta_tile
+from app.wmts.tileMatrix import TileRange
+from app.wmts.tileMatrixSet import get_tile_matrix_set
+
+TILE = 4
+
+
+@pytest.fixture
+def table():
+    return get_tile_matrix_set("swissgrid_05").table
+
+
+def test_meta_tile_range_is_aligned(table):
+    assert get_meta_tile_range(table, 3, 13, 2, 4) == TileRange(3, 12, 0, 15, 3)
+    assert get_meta_tile_range(table, 3, 12, 3, 4) == TileRange(3, 12, 0, 15, 3)
+    assert get_meta_tile_range(table, 3, 13, 2, 1) == TileRange(3, 13, 2, 13, 2)
+
+
+def test_meta_tile_range_is_clipped_to_the_matrix(table):
+    # 38 x 25 tiles at zoom 0
+    assert get_meta_tile_range(table, 0, 37, 24, 16) == TileRange(0, 32, 16, 37, 24)
+    with pytest.raises(ValueError):
+        get_meta_tile_range(table, 0, 38, 0, 16)
+
+
+def test_iter_meta_tile_ranges():
+    parts = list(iter_meta_tile_ranges(TileRange(5, 3, 6, 9, 8), 4))
+    assert parts == [TileRange(5, 3, 6, 3, 7), TileRange(5, 4, 6, 7, 7), TileRange(5, 8, 6, 9, 7),
+                     TileRange(5, 3, 8, 3, 8), TileRange(5, 4, 8, 7, 8), TileRange(5, 8, 8, 9, 8)]
+    assert sum(part.count for part in parts) == TileRange(5, 3, 6, 9, 8).count
+
+
+def meta_tile(meta_range: TileRange, gutter: int) -> bytes:
+    # each tile has the colour of its (col, row), the gutter is white
+    image = Image.new("RGB", (meta_range.num_cols * TILE + 2 * gutter, meta_range.num_rows * TILE + 2 * gutter),
+                      (255, 255, 255))
+    for _, col, row in meta_range.tiles():
+        left = gutter + (col - meta_range.min_col) * TILE
+        top = gutter + (row - meta_range.min_row) * TILE
+        image.paste((col, row, 0), (left, top, left + TILE, top + TILE))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def colours(data: bytes) -> set:
+    with Image.open(io.BytesIO(data)) as image:
+        assert image.size == (TILE, TILE)
+        return {colour for _, colour in image.getcolors()}
+
+
+def test_slice_meta_tile_drops_the_gutter():
+    meta_range = TileRange(5, 10, 20, 12, 21)
+    tiles = slice_meta_tile(meta_tile(meta_range, 2), meta_range, 2, TILE, TILE)
+    assert sorted(tiles) == [(col, row) for col in range(10, 13) for row in range(20, 22)]
+    for (col, row), data in tiles.items():
+        assert colours(data) == {(col, row, 0)}
+
+
+def test_uniform_meta_tile_is_encoded_once():
+    meta_range = TileRange(5, 0, 0, 1, 1)
+    buffer = io.BytesIO()
+    Image.new("RGB", (2 * TILE, 2 * TILE), (0, 90, 0)).save(buffer, "PNG")
+    tiles = slice_meta_tile(buffer.getvalue(), meta_range, 0, TILE, TILE)
+    assert len(tiles) == 4
+    assert len({id(data) for data in tiles.values()}) == 1
+    assert colours(tiles[(1, 1)]) == {(0, 90, 0)}
@@ -0,0 +1,61 @@
+import io
+
+import pytest
+from PIL import Image
+
+from app.cache.memoryCache import MemoryTileCache
+from app.pyramid import build_parent_block
+from app.wmts.tileMatrix import TileRange
+from app.wmts.tileMatrixSet import get_tile_matrix_set
+from app.wmts.utils import TileKey
+
+RED = (255, 0, 0, 255)
+
+
+@pytest.fixture
+def table():
+    return get_tile_matrix_set("swissgrid_05").table
+
+
+def png(rgba: tuple[int, int, int, int]) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGBA", (256, 256), rgba).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def key(zoom: int, col: int, row: int) -> TileKey:
+    return TileKey("layer", "default", "swissgrid_05", zoom, col, row)
+
+
+def pixels(data: bytes) -> dict:
+    with Image.open(io.BytesIO(data)) as image:
+        rgba = image.convert("RGBA")
+        return {"top_left": rgba.getpixel((10, 10)), "bottom_right": rgba.getpixel((245, 245))}
+
+
+def test_parents_of_the_children_found(table):
+    store = MemoryTileCache(1 << 24)
+    # zoom 3 is 5 m per pixel and zoom 4 2.5 m: the parent (10, 10) has the children (20, 20) to (21, 21)
+    store.put(key(4, 20, 20), png(RED))
+    tiles = build_parent_block(store, table, TileRange(3, 10, 10, 11, 11), "layer", "default", "swissgrid_05")
+    # the parents without any child are left out
+    assert list(tiles) == [key(3, 10, 10)]
+    # the missing children are transparent
+    assert pixels(tiles[key(3, 10, 10)]) == {"top_left": RED, "bottom_right": (0, 0, 0, 0)}
+
+
+def test_parents_of_a_fractional_zoom_ratio(table):
+    store = MemoryTileCache(1 << 24)
+    # 2.5 m then 1 m per pixel at zoom 5: a parent covers 2.5 x 2.5 children
+    for col in range(450, 462):
+        for row in range(750, 762):
+            store.put(key(5, col, row), png(RED))
+    tiles = build_parent_block(store, table, TileRange(4, 181, 301, 182, 302), "layer", "default", "swissgrid_05")
+    assert len(tiles) == 4
+    for data in tiles.values():
+        assert pixels(data) == {"top_left": RED, "bottom_right": RED}
+
+
+def test_no_children(table):
+    store = MemoryTileCache(1 << 24)
+    assert build_parent_block(store, table, TileRange(3, 10, 10, 11, 11), "layer", "default", "swissgrid_05") == {}
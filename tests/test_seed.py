@@ -0,0 +1,80 @@
+import pytest
+
+from app.config import load_tilecloud_config
+from app.layerRegistry import build_layer
+from app.seed import (check_checkpoint, get_checkpoint_header, get_checkpoint_path, get_seed_options, load_checkpoint,
+                      seed)
+from app.wms.metaTile import iter_meta_tile_ranges
+from app.wmts.tileMatrixSet import get_tile_matrix_set, register_tilecloud_grids
+
+# 4 x 4 tiles of swissgrid_05 at zoom 4, 2.5 m per pixel, cols 184 to 187 and rows 304 to 307
+BBOX = (2537760.0, 1152880.0, 2540320.0, 1155440.0)
+
+
+def test_seed_and_service_cut_the_same_metatiles(monkeypatch, tmp_path):
+    monkeypatch.setenv("WMS_BACKEND", "http://wms.test/wms")
+    config = load_tilecloud_config()
+    register_tilecloud_grids(config)
+    metatiles = set()
+    for name, layer_config in config["layers"].items():
+        try:
+            options = get_seed_options(config, name, "directory", str(tmp_path), 1)
+        except ValueError:
+            continue
+        layer = build_layer(name, layer_config)
+        assert (options.meta_size, options.meta_buffer) == (layer.meta_size, layer.meta_buffer)
+        metatiles.add((layer.meta_size, layer.meta_buffer))
+    # the shipped configuration has layers with buffered metatiles, without buffer and without metatiles
+    assert {(16, 30), (16, 0), (1, 0)} <= metatiles
+
+
+def test_meta_defaults_of_tilecloud_chain(monkeypatch, tmp_path):
+    monkeypatch.setenv("WMS_BACKEND", "http://wms.test/wms")
+    config = {"layers": {"meta": {"grid": "swissgrid_05", "layers": "a", "meta": True},
+                         "single": {"grid": "swissgrid_05", "layers": "a", "meta_size": 4}}}
+    for name, expected in (("meta", (8, 128)), ("single", (1, 0))):
+        options = get_seed_options(config, name, "directory", str(tmp_path), 1)
+        assert (options.meta_size, options.meta_buffer) == expected
+    with pytest.raises(ValueError):
+        get_seed_options(config, "unknown", "directory", str(tmp_path), 1)
+
+
+def options(monkeypatch, tmp_path, meta_size: int = 2):
+    # nothing answers on the discard port, every GetMap fails
+    monkeypatch.setenv("WMS_BACKEND", "http://127.0.0.1:9/wms")
+    config = {"layers": {"layer": {"grid": "swissgrid_05", "layers": "a", "meta": True, "meta_size": meta_size,
+                                   "meta_buffer": 0}}}
+    return get_seed_options(config, "layer", "directory", str(tmp_path / "tiles"), 1)
+
+
+def test_checkpoint_of_another_seeding(monkeypatch, tmp_path):
+    first = options(monkeypatch, tmp_path)
+    second = options(monkeypatch, tmp_path, meta_size=4)
+    assert get_checkpoint_path(first, BBOX) != get_checkpoint_path(second, BBOX)
+    assert get_checkpoint_path(first, BBOX) != get_checkpoint_path(first, (0.0, 0.0, 1.0, 1.0))
+    path = tmp_path / "seed.checkpoint"
+    path.write_text(get_checkpoint_header(first, BBOX) + "\n")
+    check_checkpoint(str(path), get_checkpoint_header(first, BBOX))
+    with pytest.raises(ValueError):
+        check_checkpoint(str(path), get_checkpoint_header(second, BBOX))
+
+
+def test_load_checkpoint_skips_a_partial_line(tmp_path):
+    path = tmp_path / "seed.checkpoint"
+    path.write_text("# header\n2021 5 2 4\ndefault 5 0 0\ndefault 5 1")
+    assert load_checkpoint(str(path)) == {("2021", 5, 2, 4), ("default", 5, 0, 0)}
+    assert load_checkpoint(str(tmp_path / "missing")) == set()
+
+
+def test_resume_renders_the_chunks_left_only(monkeypatch, tmp_path):
+    seed_options = options(monkeypatch, tmp_path)
+    tile_range = get_tile_matrix_set("swissgrid_05").table.get_tile_range(BBOX, 4)
+    chunks = list(iter_meta_tile_ranges(tile_range, 2))
+    assert len(chunks) == 4
+    path = tmp_path / "seed.checkpoint"
+    path.write_text(get_checkpoint_header(seed_options, BBOX) + "\n" +
+                    "".join(f"default 4 {chunk.min_col} {chunk.min_row}\n" for chunk in chunks[:3]))
+    # the chunk left fails and stays out of the checkpoint
+    assert seed(seed_options, BBOX, range(4, 5), ["default"], 1, str(path), 10) == 1
+    assert len(load_checkpoint(str(path))) == 3
+    assert path.read_text().count("#") == 1
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from app.wms.singleFlight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    single_flight = SingleFlight()
+    executions = []
+
+    async def work():
+        executions.append(1)
+        await asyncio.sleep(0.01)
+        return b"tile"
+
+    async def run():
+        results = await asyncio.gather(*(single_flight.do("key", work) for _ in range(10)),
+                                       single_flight.do("other", work))
+        assert results == [b"tile"] * 11
+        assert single_flight.in_flight() == 0
+        # once done, the next call runs the work again
+        await single_flight.do("key", work)
+
+    asyncio.run(run())
+    assert len(executions) == 3
+    assert (single_flight.calls, single_flight.executions, single_flight.coalesced) == (12, 3, 9)
+
+
+def test_the_error_goes_to_all_the_callers():
+    single_flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("backend down")
+
+    async def run():
+        results = await asyncio.gather(*(single_flight.do("key", work) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert single_flight.in_flight() == 0
+        with pytest.raises(RuntimeError):
+            await single_flight.do("key", work)
+
+    asyncio.run(run())
+    assert (single_flight.executions, single_flight.errors) == (2, 2)
+
+
+def test_a_cancelled_caller_does_not_cancel_the_others():
+    single_flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.05)
+        return b"tile"
+
+    async def run():
+        leader = asyncio.ensure_future(single_flight.do("key", work))
+        follower = asyncio.ensure_future(single_flight.do("key", work))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        assert await follower == b"tile"
+        assert leader.cancelled()
+
+    asyncio.run(run())
+    assert (single_flight.executions, single_flight.errors) == (1, 0)
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from app.wmts.swissProjection import lv95_to_wgs84, wgs84_to_lv95
+
+
+def dms(degrees: int, minutes: int, seconds: float) -> float:
+    return degrees + minutes / 60 + seconds / 3600
+
+
+def test_swisstopo_example_to_lv95():
+    # the example of the swisstopo formula sheet: λ = 8°43'49.79", φ = 46°02'38.87"
+    east, north = wgs84_to_lv95(dms(8, 43, 49.79), dms(46, 2, 38.87))
+    assert east == pytest.approx(2699999.76, abs=0.01)
+    assert north == pytest.approx(1099999.97, abs=0.01)
+
+
+def test_swisstopo_example_to_wgs84():
+    # E = 2 700 000, N = 1 100 000 is λ = 8°43'49.80", φ = 46°02'38.86"
+    lon, lat = lv95_to_wgs84(2700000.0, 1100000.0)
+    assert lon == pytest.approx(dms(8, 43, 49.80), abs=0.01 / 3600)
+    assert lat == pytest.approx(dms(46, 2, 38.86), abs=0.01 / 3600)
+
+
+def test_old_observatory_of_bern():
+    # the origin of the projection, the auxiliary values are 0
+    east, north = wgs84_to_lv95(dms(7, 26, 22.50), dms(46, 57, 8.66))
+    assert east == pytest.approx(2600072.37)
+    assert north == pytest.approx(1200147.07)
+
+
+@pytest.mark.parametrize("extent, tolerance", [
+    # Lausanne, the area of the layers
+    ((2530000, 1145000, 2550000, 1165000), 1.0),
+    # the whole country, the approximate formulas lose a few metres at its edges
+    ((2485000, 1075000, 2834000, 1296000), 5.0),
+])
+def test_round_trip(extent, tolerance):
+    generator = np.random.default_rng(1)
+    east = generator.uniform(extent[0], extent[2], 1000)
+    north = generator.uniform(extent[1], extent[3], 1000)
+    lon, lat = lv95_to_wgs84(east, north)
+    east2, north2 = wgs84_to_lv95(lon, lat)
+    assert np.abs(east2 - east).max() < tolerance
+    assert np.abs(north2 - north).max() < tolerance
+
+
+def test_vectorized_and_scalar_agree():
+    lons = [6.63, 7.44, 8.54]
+    lats = [46.52, 46.95, 47.37]
+    east, north = wgs84_to_lv95(lons, lats)
+    assert east.shape == (3,)
+    for i in range(3):
+        assert wgs84_to_lv95(lons[i], lats[i]) == (east[i], north[i])
+
+
+def test_shapes_must_match():
+    with pytest.raises(ValueError):
+        wgs84_to_lv95([6.6, 6.7], [46.5])
+    with pytest.raises(ValueError):
+        lv95_to_wgs84([2537000.0], [1152000.0, 1153000.0])
@@ -0,0 +1,71 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image, UnidentifiedImageError
+
+from app.tileCompositor import composite_tiles, encode_composite
+
+SIZE = 4
+
+
+def png(rgba: tuple[int, int, int, int], mode: str = "RGBA") -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGBA", (SIZE, SIZE), rgba).convert(mode).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def pixel(tiles: list[bytes]) -> list[int]:
+    out = composite_tiles(tiles, SIZE, SIZE)
+    assert out.shape == (SIZE, SIZE, 4) and out.dtype == np.uint8
+    # uniform tiles give a uniform composite
+    assert (out == out[0, 0]).all()
+    return out[0, 0].tolist()
+
+
+def test_no_tile_is_transparent():
+    assert pixel([]) == [0, 0, 0, 0]
+
+
+def test_single_tile_is_unchanged():
+    assert pixel([png((10, 20, 30, 255))]) == [10, 20, 30, 255]
+    assert pixel([png((10, 20, 30, 128))]) == [10, 20, 30, 128]
+
+
+def test_half_transparent_over_opaque():
+    # 0.5 * blue + 0.5 * red, 128 / 255 rounds to 128
+    assert pixel([png((255, 0, 0, 255)), png((0, 0, 255, 128))]) == [127, 0, 128, 255]
+
+
+def test_half_transparent_over_half_transparent():
+    # alpha = a_top + a_bottom * (1 - a_top), the colours weighted by their contribution
+    top, bottom = 128 / 255, 128 / 255
+    alpha = top + bottom * (1 - top)
+    red = 255 * bottom * (1 - top) / alpha
+    blue = 255 * top / alpha
+    assert pixel([png((255, 0, 0, 128)), png((0, 0, 255, 128))]) == \
+        [round(red), 0, round(blue), round(alpha * 255)]
+
+
+def test_transparent_top_keeps_the_bottom():
+    assert pixel([png((1, 2, 3, 200)), png((0, 0, 0, 0))]) == [1, 2, 3, 200]
+
+
+def test_opaque_top_hides_the_layers_below():
+    # the hidden layers are not even decoded
+    assert pixel([b"not a png", png((9, 8, 7, 255))]) == [9, 8, 7, 255]
+    with pytest.raises(UnidentifiedImageError):
+        composite_tiles([b"not a png", png((9, 8, 7, 254))], SIZE, SIZE)
+
+
+def test_palette_and_rgb_tiles():
+    assert pixel([png((255, 0, 0, 255), "P"), png((0, 255, 0, 255), "RGB")]) == [0, 255, 0, 255]
+
+
+@pytest.mark.parametrize("image_format, pil_format", [("png", "PNG"), ("webp", "WEBP")])
+def test_encode_composite_is_lossless(image_format, pil_format):
+    rgba = np.random.default_rng(1).integers(0, 256, (SIZE, SIZE, 4), dtype=np.uint8)
+    rgba[..., 3] = 255
+    with Image.open(io.BytesIO(encode_composite(rgba, image_format))) as image:
+        assert image.format == pil_format
+        assert (np.asarray(image.convert("RGBA")) == rgba).all()
@@ -0,0 +1,90 @@
+from app.wmts.tileCoverage import TileCoverage, get_geojson_polygons
+from app.wmts.tileMatrixSet import get_tile_matrix_set
+
+# swissgrid_05: origin at the top left corner, tiles of 12800 m at zoom 0 and 5120 m at zoom 1
+X0, Y0 = 2420000.0, 1350000.0
+SPAN = 12800.0
+
+
+def square(min_col: float, min_row: float, max_col: float, max_row: float) -> list:
+    """
+    Ring of the zoom 0 tiles from (min_col, min_row) to (max_col, max_row), in tile units.
+    """
+    x_min, x_max = X0 + min_col * SPAN, X0 + max_col * SPAN
+    y_min, y_max = Y0 - max_row * SPAN, Y0 - min_row * SPAN
+    return [(x_min, y_min), (x_max, y_min), (x_max, y_max), (x_min, y_max), (x_min, y_min)]
+
+
+def get_table():
+    return get_tile_matrix_set("swissgrid_05").table
+
+
+def test_whole_matrix_without_bbox():
+    table = get_table()
+    coverage = TileCoverage(table)
+    assert coverage.contains(0, 0, 0)
+    assert coverage.contains(0, table.matrix_widths[0] - 1, table.matrix_heights[0] - 1)
+    assert not coverage.contains(0, table.matrix_widths[0], 0)
+    assert not coverage.contains(0, -1, 0)
+    assert not coverage.contains(table.max_zoom + 1, 0, 0)
+    assert not coverage.contains(table.min_zoom - 1, 0, 0)
+
+
+def test_bbox():
+    coverage = TileCoverage(get_table(), bbox=[X0 + 2 * SPAN, Y0 - 4 * SPAN, X0 + 4 * SPAN, Y0 - 2 * SPAN])
+    assert coverage.contains(0, 2, 2)
+    assert coverage.contains(0, 3, 3)
+    # the edges of the bbox do not pull in the next tiles
+    assert not coverage.contains(0, 4, 3)
+    assert not coverage.contains(0, 3, 1)
+    assert coverage.contains(1, 5, 5)
+    assert not coverage.contains(1, 4, 5)
+
+
+def test_polygon_bitmap_is_grown_by_one_tile():
+    coverage = TileCoverage(get_table(), polygons=[[square(3.5, 3.5, 4.5, 4.5)]])
+    assert coverage.contains(0, 3, 3)
+    assert coverage.contains(0, 4, 4)
+    # the neighbours of the tiles touched by the polygon
+    assert coverage.contains(0, 2, 2)
+    assert coverage.contains(0, 5, 5)
+    assert not coverage.contains(0, 6, 4)
+    assert not coverage.contains(0, 1, 1)
+    assert not coverage.contains(0, 20, 20)
+
+
+def test_hole():
+    outer = square(0, 0, 20, 20)
+    hole = square(5, 5, 15, 15)
+    coverage = TileCoverage(get_table(), polygons=[[outer, hole]])
+    assert coverage.contains(0, 2, 2)
+    assert not coverage.contains(0, 10, 10)
+    # along the edge of the hole, the tiles are partly covered
+    assert coverage.contains(0, 5, 10)
+
+
+def test_finer_zooms_use_the_finest_bitmap():
+    table = get_table()
+    # only zoom 0 (38 x 25 tiles) gets a bitmap
+    coverage = TileCoverage(table, polygons=[[square(4, 4, 5, 5)]], max_bitmap_cells=1000)
+    assert coverage.stats()["bitmap_zooms"] == [0]
+    # zoom 1 tile (11, 11) has its centre in zoom 0 tile (4, 4)
+    assert coverage.contains(1, 11, 11)
+    assert not coverage.contains(1, 40, 40)
+    # the last zoom, far inside the polygon and far out of it
+    i = table.max_zoom - table.min_zoom
+    inside = int(4.5 * SPAN / table.spans_x[i])
+    assert coverage.contains(table.max_zoom, inside, inside)
+    assert not coverage.contains(table.max_zoom, 30 * inside, 2 * inside)
+
+
+def test_geojson_polygons():
+    document = {"type": "FeatureCollection", "features": [
+        {"type": "Feature", "geometry": {"type": "Polygon", "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 0]]]}},
+        {"type": "Feature", "geometry": {"type": "MultiPolygon", "coordinates": [
+            [[[0, 0, 5], [2, 0, 5], [2, 2, 5], [0, 0, 5]]], [[[3, 3], [4, 3], [4, 4], [3, 3]]]]}},
+        {"type": "Feature", "geometry": {"type": "Point", "coordinates": [0, 0]}},
+    ]}
+    polygons = get_geojson_polygons(document)
+    assert len(polygons) == 3
+    assert polygons[1] == [[(0.0, 0.0), (2.0, 0.0), (2.0, 2.0), (0.0, 0.0)]]
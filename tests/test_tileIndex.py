@@ -0,0 +1,97 @@
+import random
+
+import pytest
+
+from app.cache import tileIndex
+from app.cache.tileIndex import TileIndex
+from app.wmts.tileMatrix import TileRange
+from app.wmts.utils import TileKey
+
+
+def key(zoom: int, col: int, row: int, dimension: str = "2021") -> TileKey:
+    return TileKey("layer", dimension, "swissgrid_05", zoom, col, row)
+
+
+def query(index: TileIndex, tile_range: TileRange, dimension: str = "2021") -> list[tuple[int, int]]:
+    return [(k.col, k.row) for k in index.query("layer", dimension, "swissgrid_05", tile_range)]
+
+
+def test_add_and_query():
+    index = TileIndex()
+    index.add_many([key(3, 1, 1), key(3, 2, 1), key(3, 5, 2), key(3, 1, 4), key(4, 1, 1)])
+    # sorted by row then col, only the tiles of the zoom inside the range
+    assert query(index, TileRange(3, 1, 1, 2, 4)) == [(1, 1), (2, 1), (1, 4)]
+    assert query(index, TileRange(3, 0, 0, 10, 10)) == [(1, 1), (2, 1), (5, 2), (1, 4)]
+    assert query(index, TileRange(5, 0, 0, 10, 10)) == []
+    assert query(index, TileRange(3, 0, 0, 10, 10), dimension="2025") == []
+    assert len(index) == 5
+
+
+def test_add_twice_and_discard():
+    index = TileIndex()
+    index.add(key(3, 1, 1))
+    index.add(key(3, 1, 1))
+    assert len(index) == 1
+    index.discard(key(3, 1, 1))
+    index.discard(key(3, 7, 7))
+    index.discard(key(9, 7, 7))
+    assert len(index) == 0
+    assert query(index, TileRange(3, 0, 0, 10, 10)) == []
+
+
+@pytest.mark.parametrize("min_merge", [4, 4096])
+def test_merge_matches_a_set(monkeypatch, min_merge):
+    # a small MIN_MERGE merges the pending changes into the sorted array many times
+    monkeypatch.setattr(tileIndex, "MIN_MERGE", min_merge)
+    generator = random.Random(1)
+    index = TileIndex()
+    present = set()
+    for _ in range(5000):
+        col, row = generator.randrange(40), generator.randrange(40)
+        if generator.random() < 0.7:
+            index.add(key(5, col, row))
+            present.add((col, row))
+        else:
+            index.discard(key(5, col, row))
+            present.discard((col, row))
+        if generator.random() < 0.01:
+            assert len(index) == len(present)
+    assert len(index) == len(present)
+    tile_range = TileRange(5, 10, 5, 30, 25)
+    expected = sorted(((col, row) for col, row in present if 10 <= col <= 30 and 5 <= row <= 25),
+                      key=lambda tile: (tile[1], tile[0]))
+    assert query(index, tile_range) == expected
+
+
+def test_len_does_not_merge(monkeypatch):
+    monkeypatch.setattr(tileIndex, "MIN_MERGE", 100)
+    index = TileIndex()
+    index.add_many(key(2, col, 0) for col in range(150))
+    index.add_many(key(2, col, 1) for col in range(10))
+    index.discard(key(2, 0, 0))
+    tiles = index._zooms[("layer", "2021", "swissgrid_05", 2)]
+    pending = (set(tiles.added), set(tiles.removed))
+    assert len(index) == 159
+    assert index.stats() == {"tiles": 159, "zoom_levels": 1, "size_bytes": 159 * 8}
+    assert (tiles.added, tiles.removed) == pending
+    tiles.merge()
+    assert len(index) == 159
+    assert query(index, TileRange(2, 0, 0, 2, 1)) == [(1, 0), (2, 0), (0, 1), (1, 1), (2, 1)]
+
+
+def test_large_columns_and_rows():
+    index = TileIndex()
+    index.add(key(9, 37499, 24999))
+    index.add(key(9, 0, 24999))
+    assert query(index, TileRange(9, 1, 24990, 37499, 24999)) == [(37499, 24999)]
+
+
+def test_contains(monkeypatch):
+    monkeypatch.setattr(tileIndex, "MIN_MERGE", 2)
+    index = TileIndex()
+    index.add_many([key(3, col, 0) for col in range(6)])
+    index.discard(key(3, 2, 0))
+    # merged and pending changes alike
+    assert key(3, 5, 0) in index and key(3, 0, 0) in index
+    assert key(3, 2, 0) not in index
+    assert key(3, 6, 0) not in index and key(4, 0, 0) not in index and key(3, 0, 0, "2025") not in index
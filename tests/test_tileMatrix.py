@@ -0,0 +1,83 @@
+import pytest
+
+from app.wmts.tileMatrix import TileRange
+from app.wmts.tileMatrixSet import SWISS_BBOX, get_tile_matrix_set
+
+# swissgrid_05: origin at the top left corner of SWISS_BBOX, tiles of 256 * 50 m = 12800 m at zoom 0
+X0, Y0 = 2420000.0, 1350000.0
+SPAN = 12800.0
+
+
+@pytest.fixture
+def table():
+    return get_tile_matrix_set("swissgrid_05").table
+
+
+def test_tile_range_of_one_tile(table):
+    assert table.get_tile_range([X0, Y0 - SPAN, X0 + SPAN, Y0], 0) == TileRange(0, 0, 0, 0, 0)
+
+
+def test_tile_range_edges_do_not_pull_neighbours(table):
+    # a bbox lying exactly on tile edges covers the tiles inside only
+    bbox = [X0 + SPAN, Y0 - 3 * SPAN, X0 + 3 * SPAN, Y0 - SPAN]
+    assert table.get_tile_range(bbox, 0) == TileRange(0, 1, 1, 2, 2)
+
+
+def test_tile_range_absorbs_float_noise(table):
+    # 2 * 12800 computed with rounding errors, on both sides of the edge
+    bbox = [X0 + SPAN * (1 + 1e-15), Y0 - SPAN, X0 + 25600.000000000004, Y0 - 1e-10]
+    assert table.get_tile_range(bbox, 0) == TileRange(0, 1, 0, 1, 0)
+    bbox = [X0 + 12799.999999999998, Y0 - SPAN, X0 + 25599.999999999996, Y0]
+    assert table.get_tile_range(bbox, 0) == TileRange(0, 1, 0, 1, 0)
+
+
+def test_tile_range_just_over_an_edge(table):
+    # a real overlap, well above the epsilon, takes the next tile
+    bbox = [X0 + SPAN - 1, Y0 - SPAN - 1, X0 + 2 * SPAN + 1, Y0]
+    assert table.get_tile_range(bbox, 0) == TileRange(0, 0, 0, 2, 1)
+
+
+def test_tile_range_inside_one_tile(table):
+    assert table.get_tile_range([X0 + 100, Y0 - 200, X0 + 300, Y0 - 100], 0) == TileRange(0, 0, 0, 0, 0)
+
+
+def test_tile_range_is_clipped_to_the_matrix(table):
+    tile_range = table.get_tile_range([X0 - 1e6, Y0 - 1e7, X0 + 1e7, Y0 + 1e6], 0)
+    assert tile_range == TileRange(0, 0, 0, table.matrix_widths[0] - 1, table.matrix_heights[0] - 1)
+
+
+def test_tile_range_outside_of_the_matrix(table):
+    assert table.get_tile_range([X0 - 2 * SPAN, Y0 - SPAN, X0 - SPAN, Y0], 0) is None
+    assert table.get_tile_range([X0, Y0, X0 + SPAN, Y0 + SPAN], 0) is None
+
+
+def test_tile_range_bbox_round_trip(table):
+    for zoom in range(table.min_zoom, table.max_zoom + 1):
+        tile_range = TileRange(zoom, 3, 5, 7, 11)
+        assert table.get_tile_range(table.get_tile_range_bbox(tile_range), zoom) == tile_range
+
+
+def test_tile_range_unknown_zoom(table):
+    with pytest.raises(ValueError):
+        table.get_tile_range(SWISS_BBOX, table.max_zoom + 1)
+
+
+def test_count_tiles_matches_the_ranges():
+    tile_matrix_set = get_tile_matrix_set("swissgrid_05")
+    bbox = [2537000.0, 1152000.0, 2539000.0, 1154000.0]
+    count = tile_matrix_set.count_tiles(bbox, 0, 6)
+    assert count == sum(1 for _ in tile_matrix_set.iter_tiles(bbox, 0, 6))
+    assert count == sum(r.count for r in tile_matrix_set.get_tile_ranges(bbox, 0, 6).values())
+
+
+def test_count_tiles_on_edges():
+    tile_matrix_set = get_tile_matrix_set("swissgrid_05")
+    # 2 x 2 tiles of zoom 0, 5 x 5 of zoom 1 (5120 m) as 25600 m is 5 tiles exactly
+    bbox = [X0, Y0 - 2 * SPAN, X0 + 2 * SPAN, Y0]
+    assert tile_matrix_set.count_tiles(bbox, 0, 0) == 4
+    assert tile_matrix_set.count_tiles(bbox, 1, 1) == 25
+    assert tile_matrix_set.count_tiles(bbox, 0, 1) == 29
+
+
+def test_count_tiles_outside():
+    assert get_tile_matrix_set("swissgrid_05").count_tiles([0, 0, 1, 1]) == 0
@@ -0,0 +1,51 @@
+import pytest
+
+from app.wmts.tileMatrixSet import get_canonical_matrix, get_equivalent_zoom, get_tile_matrix_set
+
+
+@pytest.mark.parametrize("matrix_set, zoom, target, expected", [
+    # 50 m, 20 m and 0.1 m per pixel are in both grids, on the same origin
+    ("2056_28", 18, "swissgrid_05", 0),
+    ("2056_28", 19, "swissgrid_05", 1),
+    ("swissgrid_05", 8, "2056_28", 28),
+    ("swissgrid_05", 3, "swissgrid_05", 3),
+    # 2 m and 0.05 m per pixel are in one grid only
+    ("2056_28", 23, "swissgrid_05", None),
+    ("swissgrid_05", 9, "2056_28", None),
+])
+def test_get_equivalent_zoom(matrix_set, zoom, target, expected):
+    assert get_equivalent_zoom(matrix_set, zoom, target) == expected
+
+
+def test_tiles_of_identical_matrices_are_stored_once():
+    assert get_canonical_matrix("2056_28", 18) == ("swissgrid_05", 0)
+    assert get_canonical_matrix("swissgrid_05", 0) == ("swissgrid_05", 0)
+    assert get_canonical_matrix("2056_28", 23) == ("2056_28", 23)
+    with pytest.raises(ValueError):
+        get_canonical_matrix("swissgrid_05", 10)
+    with pytest.raises(ValueError):
+        get_equivalent_zoom("unknown", 0, "swissgrid_05")
+
+
+@pytest.mark.parametrize("resolution, expected", [
+    (5.0, 3),
+    # by ratio, 3.5 m is nearer to 2.5 m than to 5 m
+    (3.5, 4),
+    (3.6, 3),
+    # out of the grid, the first or the last zoom level
+    (100.0, 0),
+    (0.01, 9),
+])
+def test_get_nearest_zoom(resolution, expected):
+    assert get_tile_matrix_set("swissgrid_05").get_nearest_zoom(resolution) == expected
+
+
+def test_get_nearest_zoom_by_scale_denominator():
+    tile_matrix_set = get_tile_matrix_set("swissgrid_05")
+    # 1 m per pixel at 0.28 mm per pixel
+    assert tile_matrix_set.get_nearest_zoom(scale_denominator=3571.43) == 5
+    assert get_tile_matrix_set("2056_28").get_nearest_zoom(scale_denominator=3571.43) == 25
+    with pytest.raises(ValueError):
+        tile_matrix_set.get_nearest_zoom()
+    with pytest.raises(ValueError):
+        tile_matrix_set.get_nearest_zoom(0.0)
@@ -0,0 +1,79 @@
+import asyncio
+import io
+
+from PIL import Image
+
+from app.cache.memoryCache import MemoryTileCache
+from app.layerRegistry import build_layer
+from app.main import get_prefetch_keys
+from app.tilePrefetcher import TilePrefetcher
+from app.tileService import TileService
+from app.wms.wms import GetMapTemplate
+from app.wmts.utils import TileKey
+
+GET_MAP = GetMapTemplate("http://wms.test/wms", "layer")
+# the tiles 457 to 458 and 773 to 774 of swissgrid_05 at zoom 5, 1 m per pixel
+VIEWPORT = (2536992.0, 1151600.0, 2537504.0, 1152112.0)
+
+
+class FakeWmsClient:
+    def __init__(self):
+        self.urls = []
+
+    async def get_image(self, url: str, headers: dict | None = None) -> bytes:
+        self.urls.append(url)
+        buffer = io.BytesIO()
+        Image.new("RGBA", (256, 256), (10, 20, 30, 255)).save(buffer, "PNG")
+        return buffer.getvalue()
+
+
+def key(col: int, row: int = 773, zoom: int = 5) -> TileKey:
+    return TileKey("layer", "default", "swissgrid_05", zoom, col, row)
+
+
+def test_prefetch_keys_the_nearest_first():
+    layer = build_layer("layer", {"grid": "swissgrid_05", "layers": "a"})
+    keys = list(get_prefetch_keys(layer, VIEWPORT, 5, 1))
+    # the ring around the 2 x 2 tiles, then the tiles of the viewport at zoom 6 and at zoom 4
+    assert [zoom for zoom, _, _ in keys] == [5] * 12 + [6] * 16 + [4] * 2
+    ring = {(col, row) for _, col, row in keys[:12]}
+    assert ring == {(col, row) for col in range(456, 460) for row in range(772, 776)} - \
+        {(col, row) for col in (457, 458) for row in (773, 774)}
+    assert [zoom for zoom, _, _ in get_prefetch_keys(layer, VIEWPORT, 5, 0)] == [6] * 16 + [4] * 2
+
+
+def test_prefetch_fills_the_memory_cache():
+    client = FakeWmsClient()
+    service = TileService(client, memory_cache=MemoryTileCache(1 << 24))
+
+    async def run():
+        prefetcher = TilePrefetcher(service, workers=2)
+        assert prefetcher.schedule([key(0), key(1), key(1)], GET_MAP) == 2
+        await prefetcher._queue.join()
+        # the tiles already in the memory cache are not fetched again
+        assert prefetcher.schedule([key(0), key(2)], GET_MAP) == 2
+        await prefetcher._queue.join()
+        await prefetcher.aclose()
+        return prefetcher
+
+    prefetcher = asyncio.run(run())
+    assert len(client.urls) == 3
+    assert all(key(col) in service.memory_cache for col in range(3))
+    assert prefetcher.stats() == \
+        {"scheduled": 4, "truncated": 0, "fetched": 3, "errors": 0, "queued": 0}
+
+
+def test_full_queue_gives_up_the_rest():
+    client = FakeWmsClient()
+    service = TileService(client)
+
+    async def run():
+        prefetcher = TilePrefetcher(service, workers=1, max_queued=3)
+        # the worker does not run before the first await, the invalid tile is an error
+        assert prefetcher.schedule([key(-1)] + [key(col) for col in range(10)], GET_MAP) == 3
+        await prefetcher._queue.join()
+        await prefetcher.aclose()
+        return prefetcher
+
+    prefetcher = asyncio.run(run())
+    assert (prefetcher.truncated, prefetcher.fetched, prefetcher.errors) == (1, 2, 1)
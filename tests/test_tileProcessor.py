@@ -0,0 +1,98 @@
+import asyncio
+import io
+
+import pytest
+from PIL import Image
+
+from app.tileProcessor import TileProcessor, choose_tile_format, optimize_png, transcode
+
+VARIANTS = ("webp", "jpeg")
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, "png"),
+    ("", "png"),
+    ("*/*", "png"),
+    ("image/*", "png"),
+    ("image/png", "png"),
+    # browsers name webp explicitly, next to image/*
+    ("image/avif,image/webp,image/apng,image/*,*/*;q=0.8", "webp"),
+    ("image/webp", "webp"),
+    ("image/jpeg", "jpeg"),
+    # webp is preferred over jpeg at the same q-value
+    ("image/jpeg,image/webp", "webp"),
+    # the highest q-value wins
+    ("image/webp;q=0.5,image/jpeg;q=0.9", "jpeg"),
+    ("image/webp;q=0.9,image/jpeg;q=0.5", "webp"),
+    ("image/webp;q=0.7,image/jpeg;q=0.7,image/png;q=0.7", "webp"),
+    # a variant needs a q-value at least as high as the original format
+    ("image/png,image/webp;q=0.8", "png"),
+    ("image/png;q=0.8,image/webp;q=0.8", "webp"),
+    ("image/png;q=0.5,image/webp;q=0.6", "webp"),
+    ("image/*;q=0.9,image/webp;q=0.5", "png"),
+    ("IMAGE/WEBP ; q=1", "webp"),
+    # q=0 refuses a format
+    ("image/webp;q=0", "png"),
+    ("image/webp;q=0,image/jpeg", "jpeg"),
+    ("image/webp;q=abc", "png"),
+])
+def test_choose_tile_format(accept, expected):
+    assert choose_tile_format(accept, "png", VARIANTS) == expected
+
+
+def test_choose_tile_format_only_enabled_variants():
+    assert choose_tile_format("image/webp", "png", ("jpeg",)) == "png"
+    assert choose_tile_format("image/webp,image/jpeg", "png", ("jpeg",)) == "jpeg"
+    assert choose_tile_format("image/webp", "png", ()) == "png"
+
+
+def test_choose_tile_format_of_a_jpeg_layer():
+    assert choose_tile_format("image/jpeg", "jpeg", VARIANTS) == "jpeg"
+    assert choose_tile_format("image/webp,image/jpeg", "jpeg", VARIANTS) == "webp"
+
+
+def png(mode: str = "RGBA", alpha: int = 128) -> bytes:
+    buffer = io.BytesIO()
+    image = Image.new(mode, (256, 256), (10, 20, 30, alpha)[:len(mode)])
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_optimize_png_keeps_the_pixels():
+    data = png()
+    optimized = optimize_png(data)
+    assert len(optimized) <= len(data)
+    with Image.open(io.BytesIO(data)) as before, Image.open(io.BytesIO(optimized)) as after:
+        assert after.convert("RGBA").tobytes() == before.convert("RGBA").tobytes()
+
+
+@pytest.mark.parametrize("image_format, pil_format, mode", [
+    ("webp", "WEBP", "RGBA"),
+    ("jpeg", "JPEG", "RGB"),
+    # an RGBA tile whose alpha channel is fully opaque
+    ("jpeg", "JPEG", "RGBA"),
+])
+def test_transcode(image_format, pil_format, mode):
+    with Image.open(io.BytesIO(transcode(png(mode, alpha=255), image_format))) as image:
+        assert image.format == pil_format
+        assert image.size == (256, 256)
+
+
+def test_no_jpeg_of_a_tile_with_transparency():
+    assert transcode(png(), "jpeg") is None
+    assert transcode(png(), "webp") is not None
+
+
+def test_get_variant_remembers_the_tiles_without_jpeg():
+    processor = TileProcessor(1, variant_cache_max_bytes=1 << 20)
+
+    async def run():
+        assert await processor.get_variant("transparent", png(), "jpeg") is None
+        assert await processor.get_variant("transparent", png(), "jpeg") is None
+        assert await processor.get_variant("opaque", png("RGB"), "jpeg") is not None
+
+    try:
+        asyncio.run(run())
+    finally:
+        processor.close()
+    assert processor.transcoded == 2
@@ -0,0 +1,113 @@
+import asyncio
+import io
+import re
+
+from PIL import Image
+
+from app.cache.memoryCache import MemoryTileCache
+from app.cache.mbtilesStore import MBTilesStore
+from app.cache.tileStore import TileSignature, tile_digest
+from app.tileService import TileService
+from app.wms.metaTile import MetaTileRenderer
+from app.wms.wms import GetMapTemplate
+from app.wmts.tileMatrix import TileRange
+from app.wmts.utils import TileKey
+
+GET_MAP = GetMapTemplate("http://wms.test/wms", "layer")
+
+
+def png(width: int, height: int, rgba: tuple[int, int, int, int]) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGBA", (width, height), rgba).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class FakeWmsClient:
+    """
+    Renders uniform images of the size asked, transparent when empty is set.
+    """
+
+    def __init__(self):
+        self.urls = []
+        self.empty = True
+
+    async def get_image(self, url: str, headers: dict | None = None) -> bytes:
+        self.urls.append(url)
+        width, height = (int(re.search(f"{name}=(\\d+)", url).group(1)) for name in ("WIDTH", "HEIGHT"))
+        return png(width, height, (0, 0, 0, 0) if self.empty else (10, 20, 30, 255))
+
+
+def key(col: int, row: int = 0) -> TileKey:
+    return TileKey("layer", "default", "swissgrid_05", 5, col, row)
+
+
+def signature(data: bytes) -> TileSignature:
+    return TileSignature(len(data), tile_digest(data))
+
+
+def test_empty_tiles_are_not_stored_and_answered_without_the_backend(tmp_path):
+    client = FakeWmsClient()
+    store = MBTilesStore(str(tmp_path))
+    service = TileService(client, tile_store=store, memory_cache=MemoryTileCache(1 << 20),
+                          empty_tiles={"layer": signature(png(256, 256, (0, 0, 0, 0)))})
+
+    async def run():
+        empty = await service.get_tile(key(0), GET_MAP)
+        assert await service.get_tile(key(0), GET_MAP) == empty
+        assert len(client.urls) == 1
+        client.empty = False
+        assert await service.get_tile(key(1), GET_MAP) != empty
+        await service.aclose()
+
+    asyncio.run(run())
+    assert key(0) not in service.tile_index and key(1) in service.tile_index
+    assert service.get_memory_tile(key(0)) is None
+    assert [k.col for k in MBTilesStore(str(tmp_path)).iter_keys()] == [1]
+    assert service.stats()["tiles"]["empty"] == 1
+
+
+def test_empty_metatile(tmp_path):
+    client = FakeWmsClient()
+    service = TileService(client, MetaTileRenderer(client, keep_rendered=0), MBTilesStore(str(tmp_path)),
+                          empty_metatiles={"layer": signature(png(512, 512, (0, 0, 0, 0)))},
+                          meta_settings={"layer": (2, 0)})
+
+    async def run():
+        await service.get_tile(key(0), GET_MAP)
+        # the other tiles of the metatile are known to be empty too
+        await service.get_tile(key(1, 1), GET_MAP)
+        assert len(client.urls) == 1
+        await service.aclose()
+
+    asyncio.run(run())
+    assert len(service.empty_index) == 4
+    assert list(MBTilesStore(str(tmp_path)).iter_keys()) == []
+
+
+def test_invalidate_forgets_the_empty_tiles():
+    client = FakeWmsClient()
+    service = TileService(client, empty_tiles={"layer": signature(png(256, 256, (0, 0, 0, 0)))})
+
+    async def run():
+        await service.get_tile(key(0), GET_MAP)
+        removed = await service.invalidate("layer", "default", "swissgrid_05", [TileRange(5, 0, 0, 3, 3)])
+        assert removed["empty"] == 1
+        client.empty = False
+        assert await service.get_tile(key(0), GET_MAP) == png(256, 256, (10, 20, 30, 255))
+        assert len(client.urls) == 2
+
+    asyncio.run(run())
+
+
+def test_metatiles_by_layer():
+    client = FakeWmsClient()
+    service = TileService(client, MetaTileRenderer(client), meta_settings={"layer": (4, 8)})
+
+    async def run():
+        await service.get_tile(key(0), GET_MAP)
+        await service.get_tile(key(0)._replace(layer="single"), GET_MAP)
+
+    asyncio.run(run())
+    # 4 x 4 tiles and a gutter of 8 pixels, then a single tile for the layer without metatiles
+    assert "WIDTH=1040&HEIGHT=1040" in client.urls[0]
+    assert "WIDTH=256&HEIGHT=256" in client.urls[1]
@@ -0,0 +1,69 @@
+import asyncio
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+import pytest
+
+from app.wms.wms import GetMapTemplate, WmsClient, WmsError, add_gutter, get_wms_params, get_wms_url
+from app.wmts.utils import BBox
+
+
+def test_get_wms_params():
+    params = get_wms_params(BBox(bbox=[2537000, 1152000, 2537512, 1152512]), "a,b", 10,
+                            dimensions={"DATE": "2021"})
+    assert params["LAYERS"] == "a,b"
+    assert params["BBOX"] == "2537000.0,1152000.0,2537512.0,1152512.0"
+    # the gutter grows the image on each side
+    assert (params["WIDTH"], params["HEIGHT"]) == ("276", "276")
+    assert (params["FORMAT"], params["TRANSPARENT"]) == ("image/png", "true")
+    assert params["DATE"] == "2021"
+    params = get_wms_params((0, 0, 1, 1), "a", 0, image_format="jpeg")
+    assert (params["FORMAT"], params["TRANSPARENT"]) == ("image/jpeg", "false")
+
+
+def test_add_gutter():
+    assert add_gutter((0, 0, 100, 100), 10, 0.5) == (-5, -5, 105, 105)
+
+
+def test_get_wms_url_keeps_the_query_of_the_backend():
+    assert get_wms_url("http://wms.test/wms", {"A": "1 2"}) == "http://wms.test/wms?A=1+2"
+    assert get_wms_url("http://wms.test/wms?map=x", {"A": "1"}) == "http://wms.test/wms?map=x&A=1"
+
+
+def test_get_map_template_matches_get_wms_params():
+    template = GetMapTemplate("http://wms.test/wms", "a", dimensions={"DATE": "2021"})
+    bbox = (2537000.0, 1152000.0, 2537256.0, 1152256.0)
+    query = parse_qs(urlsplit(template.get_url(bbox, 256, 256)).query, keep_blank_values=True)
+    expected = get_wms_params(bbox, "a", 0, dimensions={"DATE": "2021"})
+    assert {name: values[0] for name, values in query.items()} == expected
+
+
+def client(handler) -> WmsClient:
+    wms_client = WmsClient()
+    wms_client.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return wms_client
+
+
+def test_get_image():
+    wms_client = client(lambda request: httpx.Response(200, content=b"png", headers={"content-type": "image/png"}))
+    assert asyncio.run(wms_client.get_image("http://wms.test/wms")) == b"png"
+
+
+@pytest.mark.parametrize("status, content_type", [
+    (500, "image/png"),
+    # the ServiceExceptionReport of mapserver
+    (200, "text/xml"),
+])
+def test_get_image_without_an_image(status, content_type):
+    wms_client = client(lambda request: httpx.Response(status, content=b"error",
+                                                       headers={"content-type": content_type}))
+    with pytest.raises(WmsError):
+        asyncio.run(wms_client.get_image("http://wms.test/wms"))
+
+
+def test_get_image_of_an_unreachable_backend():
+    def handler(request):
+        raise httpx.ConnectError("refused", request=request)
+
+    with pytest.raises(WmsError):
+        asyncio.run(client(handler).get_image("http://wms.test/wms"))